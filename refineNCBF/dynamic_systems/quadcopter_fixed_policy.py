@@ -10,6 +10,7 @@ from refineNCBF.dynamic_systems.dynamic_systems import ControlAffineDynamicSyste
 from refineNCBF.dynamic_systems.quadcopter import QuadcopterVerticalParams, default_quadcopter_vertical_params
 from refineNCBF.hj_reachability_interface.hj_dynamics import HJControlAffineDynamicsFixedPolicy, ActorModes
 from refineNCBF.utils.files import FilePathRelative
+from refineNCBF.utils.table_lookup import TableLookupModes
 from refineNCBF.utils.types import VectorBatch
 from scripts.pre_constructed_stuff.quadcopter_cbf import load_tabularized_sac
 
@@ -88,6 +89,7 @@ class QuadcopterFixedPolicy(ControlAffineDynamicSystemFixedPolicy):
         return disturbance_jacobian
 
     def compute_control(self, state: VectorBatch) -> VectorBatch:
+        # a TabularizedDnn policy is a jax table lookup, so it traces into the vmapped hamiltonian as gathers
         control = jnp.atleast_1d(self._control_policy(state).squeeze())
         return control
 
@@ -98,13 +100,18 @@ class QuadcopterFixedPolicy(ControlAffineDynamicSystemFixedPolicy):
 
 def load_quadcopter_sac_jax_hj(
         grid: hj_reachability.Grid,
-        relative_path: FilePathRelative
+        relative_path: FilePathRelative,
+        lookup_mode: TableLookupModes = TableLookupModes.NEAREST,
+        tabulate_dynamics: bool = False,
 ) -> HJControlAffineDynamicsFixedPolicy:
-    return HJControlAffineDynamicsFixedPolicy.from_parts(
+    dynamics = HJControlAffineDynamicsFixedPolicy.from_parts(
         dynamics=QuadcopterFixedPolicy.from_specs_with_policy(
             params=default_quadcopter_vertical_params,
-            control_policy=load_tabularized_sac(grid, relative_path),
+            control_policy=load_tabularized_sac(grid, relative_path, lookup_mode),
         ),
         control_mode=ActorModes.MAX,
         disturbance_mode=ActorModes.MIN,
     )
+    if tabulate_dynamics:
+        dynamics = dynamics.with_dynamics_table(grid)
+    return dynamics
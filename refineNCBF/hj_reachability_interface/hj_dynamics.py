@@ -1,10 +1,15 @@
 from enum import IntEnum
+from typing import Optional, Tuple
 
 import attr
+import jax
+import numpy as np
 from jax import numpy as jnp
 
 import hj_reachability
 from refineNCBF.dynamic_systems.dynamic_systems import ControlAffineDynamicSystem, ControlAffineDynamicSystemFixedPolicy
+from refineNCBF.utils.table_lookup import lookup_table
+from refineNCBF.utils.types import ArrayNd
 
 
 class ActorModes(IntEnum):
@@ -66,8 +71,34 @@ class HJControlAffineDynamics(hj_reachability.ControlAndDisturbanceAffineDynamic
         return self.control_affine_dynamic_system.compute_disturbance_jacobian(state=state)
 
 
+@jax.tree_util.register_pytree_node_class
+@attr.s(auto_attribs=True, eq=False)
+class DynamicsTable:
+    """
+    closed loop dynamics and partial max magnitudes tabulated over grid. registered as a pytree, so the jitted steps
+    take it as data (see split_dynamics_table) rather than baking it in as constants through the static dynamics.
+    """
+    grid: hj_reachability.Grid
+    dynamics: ArrayNd
+    partial_max_magnitudes: ArrayNd
+
+    def tree_flatten(self):
+        return (self.grid, self.dynamics, self.partial_max_magnitudes), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
+
+
 @attr.s(auto_attribs=True, eq=False)
 class HJControlAffineDynamicsFixedPolicy(hj_reachability.ControlAndDisturbanceAffineDynamics):
+    """
+    since control and disturbance are fixed functions of state (and the wrapped system ignores time), the closed loop
+    vector field and the partial max magnitudes are fixed per state. with_dynamics_table evaluates both once on every
+    cell of a grid, after which the hamiltonian is a table read and a dot product with the gradient.
+
+    a tabled copy keeps the copy without its table, which is what the jitted steps take as their static dynamics.
+    """
     _dynamics: ControlAffineDynamicSystemFixedPolicy
 
     control_mode: str
@@ -75,6 +106,9 @@ class HJControlAffineDynamicsFixedPolicy(hj_reachability.ControlAndDisturbanceAf
     control_space: hj_reachability.sets.Box
     disturbance_space: hj_reachability.sets.Box
 
+    _table: Optional[DynamicsTable] = attr.ib(default=None, repr=False)
+    _untabled: Optional['HJControlAffineDynamicsFixedPolicy'] = attr.ib(default=None, repr=False)
+
     @classmethod
     def from_parts(
             cls,
@@ -110,6 +144,71 @@ class HJControlAffineDynamicsFixedPolicy(hj_reachability.ControlAndDisturbanceAf
             disturbance_space=disturbance_space
         )
 
+    def with_dynamics_table(
+            self,
+            grid: hj_reachability.Grid,
+            chunk_size: int = 2 ** 16
+    ) -> 'HJControlAffineDynamicsFixedPolicy':
+        """
+        copy that reads the closed loop dynamics and partial max magnitudes from tables over grid, evaluated chunk_size
+        cells at a time. the tables are looked up by state (nearest cell), so steps on cropped grids read them too.
+        """
+        dynamics = self.without_table()
+
+        def evaluate(state):
+            control, disturbance = dynamics.optimal_control_and_disturbance(state, 0., None)
+            return (
+                dynamics(state, control, disturbance, 0.),
+                dynamics.partial_max_magnitudes(state, 0., None, None)
+            )
+
+        evaluate_chunk = jax.jit(jax.vmap(evaluate))
+        flat_states = np.asarray(grid.states).reshape((-1, grid.ndim))
+        chunk_count = -(-len(flat_states) // chunk_size)
+        # the last chunk is padded to chunk_size, so every chunk runs the same compiled evaluation
+        padded_states = np.pad(flat_states, ((0, chunk_count * chunk_size - len(flat_states)), (0, 0)), mode='edge')
+        dynamics_table = np.empty_like(padded_states)
+        partial_max_magnitudes_table = np.empty_like(padded_states)
+        for start in range(0, len(padded_states), chunk_size):
+            dynamics_chunk, partial_max_magnitudes_chunk = evaluate_chunk(padded_states[start:start + chunk_size])
+            dynamics_table[start:start + chunk_size] = dynamics_chunk
+            partial_max_magnitudes_table[start:start + chunk_size] = partial_max_magnitudes_chunk
+
+        return dynamics.with_table(DynamicsTable(
+            grid=grid,
+            dynamics=jnp.asarray(dynamics_table[:len(flat_states)].reshape(grid.states.shape)),
+            partial_max_magnitudes=jnp.asarray(
+                partial_max_magnitudes_table[:len(flat_states)].reshape(grid.states.shape)
+            ),
+        ))
+
+    def get_table(self) -> Optional[DynamicsTable]:
+        return self._table
+
+    def with_table(self, table: Optional[DynamicsTable]) -> 'HJControlAffineDynamicsFixedPolicy':
+        """
+        copy reading its dynamics from table, which may be traced. copies share the same untabled dynamics.
+        """
+        untabled = self.without_table()
+        if table is None:
+            return untabled
+        return attr.evolve(untabled, table=table, untabled=untabled)
+
+    def without_table(self) -> 'HJControlAffineDynamicsFixedPolicy':
+        if self._table is None:
+            return self
+        return self._untabled
+
+    def hamiltonian(self, state, time, value, grad_value):
+        if self._table is None:
+            return super().hamiltonian(state, time, value, grad_value)
+        return grad_value @ lookup_table(self._table.dynamics, self._table.grid, state)
+
+    def partial_max_magnitudes(self, state, time, value, grad_value_box):
+        if self._table is None:
+            return super().partial_max_magnitudes(state, time, value, grad_value_box)
+        return lookup_table(self._table.partial_max_magnitudes, self._table.grid, state)
+
     def optimal_control_and_disturbance(self, state, time, grad_value):
         return (
             self._dynamics.compute_control(state),
@@ -124,3 +223,24 @@ class HJControlAffineDynamicsFixedPolicy(hj_reachability.ControlAndDisturbanceAf
 
     def disturbance_jacobian(self, state, time):
         return self._dynamics.compute_disturbance_jacobian(state=state)
+
+
+def split_dynamics_table(
+        dynamics: hj_reachability.Dynamics
+) -> Tuple[hj_reachability.Dynamics, Optional[DynamicsTable]]:
+    """
+    (static dynamics, table) for a jitted step: the dynamics without its table, which is hashed by identity and stays
+    the same across tabled copies, and the table to pass in as an operand. dynamics without a table come back as is.
+    """
+    if isinstance(dynamics, HJControlAffineDynamicsFixedPolicy):
+        return dynamics.without_table(), dynamics.get_table()
+    return dynamics, None
+
+
+def join_dynamics_table(dynamics: hj_reachability.Dynamics, table: Optional[DynamicsTable]) -> hj_reachability.Dynamics:
+    """
+    inverse of split_dynamics_table, called inside the jitted step with the traced table.
+    """
+    if table is None:
+        return dynamics
+    return dynamics.with_table(table)
@@ -0,0 +1,255 @@
+import functools
+from typing import List, NamedTuple, Optional, Tuple
+
+import jax
+import numpy as np
+from jax import numpy as jnp
+
+import hj_reachability
+from hj_reachability import time_integration
+from hj_reachability.time_integration import lax_friedrichs_numerical_hamiltonian
+from refineNCBF.hj_reachability_interface.hj_dynamics import split_dynamics_table, join_dynamics_table
+from refineNCBF.hj_reachability_interface.hj_step import NARROW_BAND_GHOST_CELLS, _is_periodic_dim
+from refineNCBF.hj_reachability_interface.hj_value_postprocessors import ValuePostprocessor
+from refineNCBF.utils.types import ArrayNd, MaskNd
+
+_TVD_RUNGE_KUTTA_ORDERS = {
+    time_integration.first_order_total_variation_diminishing_runge_kutta: 1,
+    time_integration.second_order_total_variation_diminishing_runge_kutta: 2,
+    time_integration.third_order_total_variation_diminishing_runge_kutta: 3,
+}
+
+
+class NarrowBand(NamedTuple):
+    """
+    compact buffer of the active cells of a grid and their stencil ghost layer. buffer_indices are the flat grid
+    indices of the buffer cells, active_positions the positions of the active cells in the buffer, and, per dimension,
+    segment_positions and window_offsets locate the stencil of every active cell in the buffer (see
+    get_stencil_segments). both counts are padded to a power of two by repeating entries, so the jitted step is
+    compiled once per size bucket.
+    """
+    buffer_indices: ArrayNd
+    active_positions: ArrayNd
+    segment_positions: Tuple[ArrayNd, ...]
+    window_offsets: Tuple[ArrayNd, ...]
+
+    @property
+    def active_indices(self) -> ArrayNd:
+        return self.buffer_indices[self.active_positions]
+
+
+def get_narrow_band(
+        grid: hj_reachability.Grid,
+        active_set: MaskNd,
+        ghost_cells: int = NARROW_BAND_GHOST_CELLS
+) -> Optional[NarrowBand]:
+    """
+    the narrow band of active_set, built on the host, or None if active_set is empty. buffer cells are found with a
+    grid-sized bitmap rather than a sort, so building it stays cheap next to the step.
+    """
+    active_indices = np.flatnonzero(np.asarray(active_set))
+    if len(active_indices) == 0:
+        return None
+    active_indices = _pad_to_power_of_two(active_indices)
+    segments, window_offsets = get_stencil_segments(grid, active_indices, ghost_cells, np)
+
+    in_buffer = np.zeros(int(np.prod(grid.shape)), dtype=bool)
+    in_buffer[active_indices] = True
+    for segment in segments:
+        in_buffer[segment] = True
+    buffer_positions = np.cumsum(in_buffer, dtype=np.int32) - 1
+
+    return NarrowBand(
+        buffer_indices=jnp.asarray(_pad_to_power_of_two(np.flatnonzero(in_buffer).astype(np.int32))),
+        active_positions=jnp.asarray(buffer_positions[active_indices]),
+        segment_positions=tuple(jnp.asarray(buffer_positions[segment]) for segment in segments),
+        window_offsets=tuple(jnp.asarray(window_offset, dtype=np.int32) for window_offset in window_offsets),
+    )
+
+
+def get_stencil_segments(
+        grid: hj_reachability.Grid,
+        cell_indices: ArrayNd,
+        ghost_cells: int = NARROW_BAND_GHOST_CELLS,
+        xp=np,
+) -> Tuple[List[ArrayNd], List[ArrayNd]]:
+    """
+    flat indices of the grid line segment each cell's stencil along each dimension is read from, and the offset of
+    the stencil window in that segment once padded by the dimension's boundary condition (see get_stencil_windows).
+    periodic dimensions read the wrapped window itself. other dimensions read the window clipped into the grid, so a
+    cell near an edge gets its ghost values from the boundary condition, as in the dense step. works on numpy (host)
+    or jax.numpy (device, traceable) indices through xp.
+    """
+    strides = np.cumprod((1, *grid.shape[:0:-1]))[::-1]
+    coordinates = xp.unravel_index(cell_indices, grid.shape)
+    window = 2 * ghost_cells + 1
+
+    segments, window_offsets = [], []
+    for dim, points in enumerate(grid.shape):
+        coordinate = coordinates[dim]
+        if _is_periodic_dim(grid, dim):
+            positions = (coordinate[:, None] + np.arange(-ghost_cells, ghost_cells + 1)) % points
+            window_offset = xp.zeros_like(coordinate)
+        else:
+            length = min(points, window)
+            start = xp.clip(coordinate - ghost_cells, 0, points - length)
+            positions = start[:, None] + np.arange(length)
+            window_offset = coordinate - start
+        segments.append(cell_indices[:, None] + (positions - coordinate[:, None]) * int(strides[dim]))
+        window_offsets.append(window_offset)
+    return segments, window_offsets
+
+
+def get_stencil_windows(
+        grid: hj_reachability.Grid,
+        segment_values: Tuple[ArrayNd, ...],
+        window_offsets: Tuple[ArrayNd, ...],
+        ghost_cells: int = NARROW_BAND_GHOST_CELLS
+) -> List[ArrayNd]:
+    """
+    per dimension, the (cells, 2 * ghost_cells + 1) stencil windows centered on each cell, from the values of its
+    segments.
+    """
+    windows = []
+    for dim, (values, window_offset) in enumerate(zip(segment_values, window_offsets)):
+        if _is_periodic_dim(grid, dim):
+            windows.append(values)
+            continue
+        boundary_condition = grid.boundary_conditions[dim]
+        padded = jax.vmap(lambda segment: boundary_condition(segment, ghost_cells))(values)
+        windows.append(jax.vmap(
+            lambda padded_segment, offset: jax.lax.dynamic_slice_in_dim(padded_segment, offset, 2 * ghost_cells + 1)
+        )(padded, window_offset))
+    return windows
+
+
+def compute_upwind_grad_values(
+        grid: hj_reachability.Grid,
+        upwind_scheme,
+        windows: List[ArrayNd]
+) -> Tuple[ArrayNd, ArrayNd]:
+    """
+    (left_grad_values, right_grad_values) of the cells the stencil windows are centered on, each (cells, ndim), as
+    grid.upwind_grad_values computes them on the dense grid. the windows already hold the ghost values, so the scheme
+    is run without padding and the derivative at the window center is kept.
+    """
+    left, right = [], []
+    for spacing, dim_windows in zip(grid.spacings, windows):
+        left_window, right_window = jax.vmap(
+            lambda window: upwind_scheme(window, spacing, lambda values, pad_width: values)
+        )(dim_windows)
+        center = (left_window.shape[-1] - 1) // 2
+        left.append(left_window[:, center])
+        right.append(right_window[:, center])
+    return jnp.stack(left, -1), jnp.stack(right, -1)
+
+
+def hj_step_narrow_band(
+        dynamics: hj_reachability.Dynamics,
+        grid: hj_reachability.Grid,
+        solver_settings: hj_reachability.SolverSettings,
+        initial_values: ArrayNd,
+        time_start: float,
+        time_target: float,
+        active_set: MaskNd,
+) -> ArrayNd:
+    """
+    steps only the active cells, gathered with their stencil ghost layer into a compact buffer (see get_narrow_band),
+    then scatters them back, so the cost scales with the active set rather than the grid.
+
+    cells outside the active set are frozen at every stage, ghost cells included. the upwind derivatives, hamiltonian,
+    dissipation and time integration follow hj_reachability.step cell by cell; the one difference is that the cfl sub
+    step and the global lax-friedrichs grad box are taken over the active cells rather than the whole grid. the sub
+    steps are cfl-stable for every updated cell, and the result differs from the dense step by time discretization
+    error. value postprocessors that are not a ValuePostprocessor are assumed to act cell by cell.
+    """
+    assert time_target < time_start
+
+    initial_values = jnp.asarray(initial_values)
+    narrow_band = get_narrow_band(grid, active_set)
+    if narrow_band is None:
+        return initial_values
+
+    value_postprocessor = solver_settings.value_postprocessor
+    value_postprocessor = (
+        value_postprocessor.gather(narrow_band.active_indices)
+        if isinstance(value_postprocessor, ValuePostprocessor) else None
+    )
+
+    dynamics, dynamics_table = split_dynamics_table(dynamics)
+    active_values = _step_narrow_band(
+        solver_settings,
+        dynamics,
+        dynamics_table,
+        grid,
+        value_postprocessor,
+        time_start,
+        initial_values.reshape(-1)[narrow_band.buffer_indices],
+        time_target,
+        narrow_band,
+    )
+    return initial_values.reshape(-1).at[narrow_band.active_indices].set(active_values).reshape(grid.shape)
+
+
+@functools.partial(jax.jit, static_argnames=("dynamics",))
+def _step_narrow_band(solver_settings, dynamics, dynamics_table, grid, value_postprocessor, time, buffer_values,
+                      target_time, narrow_band):
+    dynamics = join_dynamics_table(dynamics, dynamics_table)
+    if not isinstance(value_postprocessor, ValuePostprocessor):
+        value_postprocessor = solver_settings.value_postprocessor
+    assert solver_settings.time_integrator in _TVD_RUNGE_KUTTA_ORDERS, \
+        "narrow band stepping supports the total variation diminishing runge kutta integrators of hj_reachability"
+    order = _TVD_RUNGE_KUTTA_ORDERS[solver_settings.time_integrator]
+    time = jnp.asarray(time, dtype=buffer_values.dtype)
+    states = grid.states.reshape((-1, grid.ndim))[narrow_band.active_indices]
+
+    def euler_step(time, active_values, time_step=None, max_time_step=None):
+        time_direction = jnp.sign(max_time_step) if time_step is None else jnp.sign(time_step)
+        signed_hamiltonian = lambda *args: time_direction * dynamics.hamiltonian(*args)
+        buffer = buffer_values.at[narrow_band.active_positions].set(active_values)
+        windows = get_stencil_windows(
+            grid,
+            tuple(buffer[segment_positions] for segment_positions in narrow_band.segment_positions),
+            narrow_band.window_offsets
+        )
+        left_grad_values, right_grad_values = compute_upwind_grad_values(grid, solver_settings.upwind_scheme, windows)
+        # the active cells stand in for the grid, as one flat axis of cells
+        dissipation_coefficients = solver_settings.artificial_dissipation_scheme(
+            dynamics.partial_max_magnitudes, states, time, active_values, left_grad_values, right_grad_values
+        )
+        dvalues_dt = -solver_settings.hamiltonian_postprocessor(time_direction * jax.vmap(
+            lambda state, value, left_grad_value, right_grad_value, dissipation_coefficient:
+            lax_friedrichs_numerical_hamiltonian(
+                signed_hamiltonian, state, time, value, left_grad_value, right_grad_value, dissipation_coefficient
+            )
+        )(states, active_values, left_grad_values, right_grad_values, dissipation_coefficients))
+        if time_step is None:
+            time_step_bound = 1 / jnp.max(jnp.sum(dissipation_coefficients / jnp.array(grid.spacings), -1))
+            time_step = time_direction * jnp.minimum(
+                solver_settings.CFL_number * time_step_bound, jnp.abs(max_time_step)
+            )
+        return time + time_step, active_values + time_step * dvalues_dt
+
+    def sub_step(time_values):
+        # the total variation diminishing runge kutta schemes of hj_reachability.time_integration
+        time, values = time_values
+        time_1, values_1 = euler_step(time, values, max_time_step=target_time - time)
+        if order == 1:
+            return time_1, value_postprocessor(time_1, values_1)
+        time_step = time_1 - time
+        _, values_2 = euler_step(time_1, values_1, time_step)
+        if order == 2:
+            return time_1, value_postprocessor(time_1, (values + values_2) / 2)
+        values_0_5 = (3 / 4) * values + (1 / 4) * values_2
+        _, values_1_5 = euler_step(time + time_step / 2, values_0_5, time_step)
+        return time_1, value_postprocessor(time_1, (1 / 3) * values + (2 / 3) * values_1_5)
+
+    return jax.lax.while_loop(
+        lambda time_values: jnp.abs(target_time - time_values[0]) > 0,
+        sub_step,
+        (time, buffer_values[narrow_band.active_positions])
+    )[1]
+
+
+def _pad_to_power_of_two(indices: np.ndarray) -> np.ndarray:
+    return np.pad(indices, (0, (1 << (len(indices) - 1).bit_length()) - len(indices)), mode='edge')
@@ -1,8 +1,19 @@
+import dataclasses
+import functools
+from typing import Tuple
+
+import jax
 import numpy as np
+from jax import numpy as jnp
 
 import hj_reachability
+from refineNCBF.hj_reachability_interface.hj_dynamics import split_dynamics_table, join_dynamics_table
+from refineNCBF.hj_reachability_interface.hj_value_postprocessors import ValuePostprocessor
 from refineNCBF.utils.types import ArrayNd, MaskNd
 
+# half-width of the widest upwind stencil (WENO5), i.e. the ghost layer an active cell reads from
+NARROW_BAND_GHOST_CELLS = 3
+
 
 def hj_step(
         dynamics: hj_reachability.Dynamics,
@@ -16,7 +27,7 @@ def hj_step(
 ) -> ArrayNd:
     assert time_target < time_start
 
-    return hj_reachability.step(
+    return hj_reachability_step(
         solver_settings=solver_settings,
         dynamics=dynamics,
         grid=grid,
@@ -28,6 +39,198 @@ def hj_step(
     )
 
 
+def hj_reachability_step(
+        solver_settings: hj_reachability.SolverSettings,
+        dynamics: hj_reachability.Dynamics,
+        grid: hj_reachability.Grid,
+        time,
+        values: ArrayNd,
+        target_time,
+        active_set: MaskNd = None,
+        progress_bar: bool = True,
+) -> ArrayNd:
+    """
+    hj_reachability.step, with the table of tabled dynamics (see split_dynamics_table) passed in as an operand rather
+    than baked into the executable through the static dynamics.
+    """
+    dynamics, dynamics_table = split_dynamics_table(dynamics)
+    return _step(
+        solver_settings, dynamics, dynamics_table, grid, time, values, target_time, active_set,
+        progress_bar=progress_bar,
+    )
+
+
+def lower_hj_reachability_step(
+        solver_settings: hj_reachability.SolverSettings,
+        dynamics: hj_reachability.Dynamics,
+        grid: hj_reachability.Grid,
+        time,
+        values,
+        target_time,
+        active_set=None,
+        progress_bar: bool = True,
+):
+    """
+    lowers hj_reachability_step for these arguments, which may be abstract (jax.ShapeDtypeStruct), without running it.
+    """
+    dynamics, dynamics_table = split_dynamics_table(dynamics)
+    return _step.lower(
+        solver_settings, dynamics, dynamics_table, grid, time, values, target_time, active_set,
+        progress_bar=progress_bar,
+    )
+
+
+@functools.partial(jax.jit, static_argnames=("dynamics", "progress_bar"))
+def _step(solver_settings, dynamics, dynamics_table, grid, time, values, target_time, active_set, progress_bar):
+    # traced inline rather than through its own jit, which would take the tabled dynamics as a static argument
+    step = getattr(hj_reachability.step, '__wrapped__', hj_reachability.step)
+    return step(
+        solver_settings=solver_settings,
+        dynamics=join_dynamics_table(dynamics, dynamics_table),
+        grid=grid,
+        time=time,
+        values=values,
+        target_time=target_time,
+        active_set=active_set,
+        progress_bar=progress_bar,
+    )
+
+
+def hj_step_cropped(
+        dynamics: hj_reachability.Dynamics,
+        grid: hj_reachability.Grid,
+        solver_settings: hj_reachability.SolverSettings,
+        initial_values_cropped: ArrayNd,
+        time_start: float,
+        time_target: float,
+        active_set_cropped: MaskNd,
+        index_slice: Tuple[slice, ...],
+) -> ArrayNd:
+    """
+    steps the index_slice crop of grid, given the values and active set already cropped to it. cropped dimensions get
+    the crop of the grid, and of the value postprocessor if it is a ValuePostprocessor.
+    """
+    value_postprocessor = solver_settings.value_postprocessor
+    if isinstance(value_postprocessor, ValuePostprocessor):
+        value_postprocessor = value_postprocessor.crop(index_slice)
+
+    dynamics, dynamics_table = split_dynamics_table(dynamics)
+    return _step_cropped(
+        solver_settings,
+        dynamics,
+        dynamics_table,
+        crop_grid(grid, index_slice),
+        value_postprocessor,
+        time_start,
+        jnp.asarray(initial_values_cropped),
+        time_target,
+        jnp.asarray(active_set_cropped),
+    )
+
+
+def hj_step_block(
+        dynamics: hj_reachability.Dynamics,
+        grid: hj_reachability.Grid,
+        solver_settings: hj_reachability.SolverSettings,
+        initial_values_block: ArrayNd,
+        time_start: float,
+        time_target: float,
+        active_set_block: MaskNd,
+        start_indices: ArrayNd,
+) -> ArrayNd:
+    """
+    steps the block of grid at start_indices with the shape of initial_values_block. unlike hj_step_cropped, the start
+    may be traced, so blocks of one shape can be stepped together under jax.vmap.
+    """
+    shape = tuple(initial_values_block.shape)
+    value_postprocessor = solver_settings.value_postprocessor
+    if isinstance(value_postprocessor, ValuePostprocessor):
+        value_postprocessor = value_postprocessor.crop_dynamic(start_indices, shape)
+
+    dynamics, dynamics_table = split_dynamics_table(dynamics)
+    return _step_cropped(
+        solver_settings,
+        dynamics,
+        dynamics_table,
+        crop_grid_dynamic(grid, start_indices, shape),
+        value_postprocessor,
+        time_start,
+        jnp.asarray(initial_values_block),
+        time_target,
+        jnp.asarray(active_set_block),
+    )
+
+
+@functools.partial(jax.jit, static_argnames=("dynamics",))
+def _step_cropped(solver_settings, dynamics, dynamics_table, grid, value_postprocessor, time, values, target_time,
+                  active_set):
+    if isinstance(value_postprocessor, ValuePostprocessor):
+        solver_settings = dataclasses.replace(solver_settings, value_postprocessor=value_postprocessor)
+    return _step(
+        solver_settings, dynamics, dynamics_table, grid, time, values, target_time, active_set, progress_bar=False
+    )
+
+
+def crop_grid(grid: hj_reachability.Grid, index_slice: Tuple[slice, ...]) -> hj_reachability.Grid:
+    lo, hi, shape, boundary_conditions = [], [], [], []
+    for dim, dim_slice in enumerate(index_slice):
+        if dim_slice.start == 0 and dim_slice.stop == grid.shape[dim]:
+            lo.append(grid.domain.lo[dim])
+            hi.append(grid.domain.hi[dim])
+            boundary_conditions.append(grid.boundary_conditions[dim])
+        else:
+            lo.append(grid.coordinate_vectors[dim][dim_slice.start])
+            hi.append(grid.coordinate_vectors[dim][dim_slice.stop - 1])
+            boundary_conditions.append(
+                hj_reachability.boundary_conditions.extrapolate
+                if _is_periodic_dim(grid, dim)
+                else grid.boundary_conditions[dim]
+            )
+        shape.append(dim_slice.stop - dim_slice.start)
+
+    return hj_reachability.Grid.from_lattice_parameters_and_boundary_conditions(
+        domain=hj_reachability.sets.Box(jnp.array(lo), jnp.array(hi)),
+        shape=tuple(shape),
+        boundary_conditions=tuple(boundary_conditions),
+    )
+
+
+def crop_grid_dynamic(grid: hj_reachability.Grid, start_indices: ArrayNd, shape: Tuple[int, ...]) -> hj_reachability.Grid:
+    """
+    crop of grid to shape at start_indices, which may be traced. dimensions kept whole keep their domain and boundary
+    conditions, like crop_grid.
+    """
+    lo, hi, coordinate_vectors, boundary_conditions = [], [], [], []
+    for dim, points in enumerate(shape):
+        if points == grid.shape[dim]:
+            coordinate_vectors.append(grid.coordinate_vectors[dim])
+            lo.append(grid.domain.lo[dim])
+            hi.append(grid.domain.hi[dim])
+            boundary_conditions.append(grid.boundary_conditions[dim])
+        else:
+            coordinate_vector = jax.lax.dynamic_slice_in_dim(grid.coordinate_vectors[dim], start_indices[dim], points)
+            coordinate_vectors.append(coordinate_vector)
+            lo.append(coordinate_vector[0])
+            hi.append(coordinate_vector[-1])
+            boundary_conditions.append(
+                hj_reachability.boundary_conditions.extrapolate
+                if _is_periodic_dim(grid, dim)
+                else grid.boundary_conditions[dim]
+            )
+
+    return hj_reachability.Grid(
+        states=jax.lax.dynamic_slice(grid.states, (*start_indices, 0), (*shape, grid.ndim)),
+        domain=hj_reachability.sets.Box(jnp.stack(lo), jnp.stack(hi)),
+        coordinate_vectors=tuple(coordinate_vectors),
+        spacings=grid.spacings,
+        boundary_conditions=tuple(boundary_conditions),
+    )
+
+
+def _is_periodic_dim(grid: hj_reachability.Grid, dim: int) -> bool:
+    return grid.boundary_conditions[dim] is hj_reachability.boundary_conditions.periodic
+
+
 def hj_solve(
         dynamics: hj_reachability.Dynamics,
         grid: hj_reachability.Grid,
@@ -2,6 +2,7 @@ from abc import ABC, abstractmethod
 from typing import Tuple, Optional
 
 import attr
+import jax
 from jax import numpy as jnp
 
 from refineNCBF.utils.types import ArrayNd, MaskNd
@@ -9,11 +10,41 @@ from refineNCBF.utils.types import ArrayNd, MaskNd
 
 @attr.s(auto_attribs=True, eq=False)
 class ValuePostprocessor(ABC):
+    """
+    value postprocessors are registered as pytrees, so a cropped copy can be passed into a jitted step as data
+    rather than as a static argument.
+    """
     @abstractmethod
     def __call__(self, t, x):
         ...
 
+    @abstractmethod
+    def crop(self, index_slice: Tuple[slice, ...]) -> 'ValuePostprocessor':
+        ...
+
+    def crop_dynamic(self, start_indices: ArrayNd, shape: Tuple[int, ...]) -> 'ValuePostprocessor':
+        """
+        crop to shape at start_indices, which may be traced (e.g. under jax.vmap). like crop, every array is assumed
+        to span the grid.
+        """
+        return jax.tree_util.tree_map(lambda array: jax.lax.dynamic_slice(array, start_indices, shape), self)
+
+    def gather(self, flat_indices: ArrayNd) -> 'ValuePostprocessor':
+        """
+        copy for the cells at flat_indices of the grid, as a flat array of cells (e.g. a narrow band). like crop, every
+        array is assumed to span the grid.
+        """
+        return jax.tree_util.tree_map(lambda array: jnp.ravel(array)[flat_indices], self)
 
+    def tree_flatten(self):
+        return tuple(getattr(self, field.name) for field in attr.fields(type(self))), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
+
+
+@jax.tree_util.register_pytree_node_class
 @attr.s(auto_attribs=True, eq=False)
 class ValuePostprocessorSequence(ValuePostprocessor):
     value_postprocessors: Tuple[ValuePostprocessor, ...]
@@ -27,7 +58,13 @@ class ValuePostprocessorSequence(ValuePostprocessor):
             x = value_postprocessor(t, x)
         return x
 
+    def crop(self, index_slice: Tuple[slice, ...]) -> 'ValuePostprocessorSequence':
+        return ValuePostprocessorSequence(
+            tuple(value_postprocessor.crop(index_slice) for value_postprocessor in self.value_postprocessors)
+        )
 
+
+@jax.tree_util.register_pytree_node_class
 @attr.s(auto_attribs=True, eq=False)
 class NotBiggerator(ValuePostprocessor):
     values: ArrayNd
@@ -43,7 +80,11 @@ class NotBiggerator(ValuePostprocessor):
     def __call__(self, t, x):
         return jnp.where(self.enforcement_region, jnp.minimum(x, self.values), self.values)
 
+    def crop(self, index_slice: Tuple[slice, ...]) -> 'NotBiggerator':
+        return NotBiggerator(values=self.values[index_slice], enforcement_region=self.enforcement_region[index_slice])
+
 
+@jax.tree_util.register_pytree_node_class
 @attr.s(auto_attribs=True, eq=False)
 class NotSmallerator(ValuePostprocessor):
     values: ArrayNd
@@ -59,7 +100,11 @@ class NotSmallerator(ValuePostprocessor):
     def __call__(self, t, x):
         return jnp.where(self.enforcement_region, jnp.maximum(x, self.values), self.values)
 
+    def crop(self, index_slice: Tuple[slice, ...]) -> 'NotSmallerator':
+        return NotSmallerator(values=self.values[index_slice], enforcement_region=self.enforcement_region[index_slice])
 
+
+@jax.tree_util.register_pytree_node_class
 @attr.s(auto_attribs=True, eq=False)
 class Freezerator(ValuePostprocessor):
     """
@@ -78,7 +123,11 @@ class Freezerator(ValuePostprocessor):
     def __call__(self, t, x):
         return jnp.where(self.enforcement_region, self.values, x)
 
+    def crop(self, index_slice: Tuple[slice, ...]) -> 'Freezerator':
+        return Freezerator(values=self.values[index_slice], enforcement_region=self.enforcement_region[index_slice])
+
 
+@jax.tree_util.register_pytree_node_class
 @attr.s(auto_attribs=True, eq=False)
 class ReachAvoid(ValuePostprocessor):
     values: ArrayNd
@@ -94,3 +143,6 @@ class ReachAvoid(ValuePostprocessor):
         v_enforce_obstacle = jnp.minimum(x, self.values)
         v_enforce_safety = jnp.where(self.reach_set, self.values, v_enforce_obstacle)
         return v_enforce_safety
+
+    def crop(self, index_slice: Tuple[slice, ...]) -> 'ReachAvoid':
+        return ReachAvoid(values=self.values[index_slice], reach_set=self.reach_set[index_slice])
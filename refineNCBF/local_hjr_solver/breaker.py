@@ -7,7 +7,8 @@ import jax.numpy as jnp
 import numpy as np
 
 from refineNCBF.local_hjr_solver.result import LocalUpdateResult
-from refineNCBF.utils.sets import get_mask_boundary_by_dilation
+from refineNCBF.utils.sets import get_mask_boundary_by_dilation_jax
+from refineNCBF.utils.types import ArrayNd, MaskNd
 from refineNCBF.utils.visuals import make_configured_logger
 
 
@@ -22,6 +23,23 @@ class BreakCriterion(ABC, Callable):
         ...
 
 
+@attr.s(auto_attribs=True)
+class CompiledBreakCriterion(BreakCriterion):
+    """
+    break criterion that can also be evaluated on device, inside a jitted solver iteration. iteration is the number
+    of completed iterations, values are the values after it and previous_values the values before it.
+    """
+    @abstractmethod
+    def compute(
+            self,
+            iteration: ArrayNd,
+            values: ArrayNd,
+            previous_values: ArrayNd,
+            pending_seed_set: MaskNd
+    ) -> ArrayNd:
+        ...
+
+
 @attr.s(auto_attribs=True)
 class BreakCriteriaChecker(ABC, Callable):
     _break_criteria: List[BreakCriterion]
@@ -43,13 +61,27 @@ class BreakCriteriaChecker(ABC, Callable):
 
         return criterion_met
 
+    def compute(
+            self,
+            iteration: ArrayNd,
+            values: ArrayNd,
+            previous_values: ArrayNd,
+            pending_seed_set: MaskNd
+    ) -> ArrayNd:
+        assert all(isinstance(criterion, CompiledBreakCriterion) for criterion in self._break_criteria), \
+            "all break criteria must be compiled break criteria to be evaluated on device"
+        criterion_met = jnp.array(False)
+        for criterion in self._break_criteria:
+            criterion_met = criterion_met | criterion.compute(iteration, values, previous_values, pending_seed_set)
+        return criterion_met
+
     def _get_break_reasons(self, data):
         break_reasons = [criterion.get_descriptor() for criterion in self._break_criteria if criterion(data)]
         return break_reasons
 
 
 @attr.s(auto_attribs=True)
-class MaxIterations(BreakCriterion):
+class MaxIterations(CompiledBreakCriterion):
     _max_iterations: int
 
     @classmethod
@@ -57,14 +89,17 @@ class MaxIterations(BreakCriterion):
         return cls(max_iterations=max_iterations)
 
     def __call__(self, data: LocalUpdateResult) -> bool:
-        return len(data) >= self._max_iterations
+        return data.get_iteration_count() >= self._max_iterations
+
+    def compute(self, iteration, values, previous_values, pending_seed_set) -> ArrayNd:
+        return iteration >= self._max_iterations
 
     def get_descriptor(self) -> str:
         return f'criterion of maximum {self._max_iterations} iterations has been met'
 
 
 @attr.s(auto_attribs=True)
-class PostFilteredActiveSetEmpty(BreakCriterion):
+class PostFilteredActiveSetEmpty(CompiledBreakCriterion):
     @classmethod
     def from_parts(cls):
         return cls()
@@ -72,12 +107,15 @@ class PostFilteredActiveSetEmpty(BreakCriterion):
     def __call__(self, data: LocalUpdateResult) -> bool:
         return jnp.count_nonzero(data.get_pending_seed_set()) == 0
 
+    def compute(self, iteration, values, previous_values, pending_seed_set) -> ArrayNd:
+        return ~jnp.any(pending_seed_set)
+
     def get_descriptor(self) -> str:
         return f'criterion of empty post-filtered active set has been met'
 
 
 @attr.s(auto_attribs=True)
-class BarrierNotMarching(BreakCriterion):
+class BarrierNotMarching(CompiledBreakCriterion):
     change_fraction: float
 
     @classmethod
@@ -87,15 +125,19 @@ class BarrierNotMarching(BreakCriterion):
     def __call__(self, data: LocalUpdateResult) -> bool:
         if len(data) < 1:
             return False
-        elif len(data) == 1:
-            current_boundary = get_mask_boundary_by_dilation(data.iterations[-1].computed_values >= 0)
-            previous_boundary = get_mask_boundary_by_dilation(data.initial_values >= 0)
-        else:
-            current_boundary = get_mask_boundary_by_dilation(data.iterations[-1].computed_values >= 0)
-            previous_boundary = get_mask_boundary_by_dilation(data.iterations[-2].computed_values >= 0)
+
+        current_boundary = data.get_viability_kernel_boundary_by_dilation()
+        previous_boundary = data.get_viability_kernel_boundary_by_dilation(iteration=len(data) - 1)
 
         boundary_overlap = current_boundary & previous_boundary
         return np.count_nonzero(boundary_overlap)/np.count_nonzero(current_boundary) > self.change_fraction
 
+    def compute(self, iteration, values, previous_values, pending_seed_set) -> ArrayNd:
+        current_boundary = get_mask_boundary_by_dilation_jax(values >= 0)
+        previous_boundary = get_mask_boundary_by_dilation_jax(previous_values >= 0)
+        boundary_overlap = current_boundary & previous_boundary
+        overlap_fraction = jnp.count_nonzero(boundary_overlap) / jnp.count_nonzero(current_boundary)
+        return (iteration >= 1) & (overlap_fraction > self.change_fraction)
+
     def get_descriptor(self) -> str:
         return f'criterion of less than {self.change_fraction*100} percent change in boundary cells has been met.'
@@ -0,0 +1,89 @@
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import attr
+import numpy as np
+from jax import numpy as jnp
+
+from refineNCBF.utils.sets import SignedDistanceEngine, compute_signed_distance
+from refineNCBF.utils.types import MaskNd, ArrayNd
+
+
+@attr.s(auto_attribs=True)
+class LocalUpdateResultCache:
+    """
+    memo of quantities derived from the values of a LocalUpdateResult (kernel mask, boundary bands, signed distances),
+    so pre-filters, expanders, post-filters and breakers computing the same quantity in one iteration share it.
+
+    entries are keyed by the iteration count they were derived at, so they never go stale when an iteration is added,
+    and only the most recent keep_iterations counts are held.
+    """
+    _keep_iterations: int = 2
+
+    _entries: Dict[Tuple[int, Hashable], Any] = attr.ib(factory=dict)
+    _signed_distance_engines: Dict[Tuple[Hashable, Optional[float]], SignedDistanceEngine] = attr.ib(factory=dict)
+
+    def get_or_compute(self, iteration: int, key: Hashable, compute: Callable[[], Any]) -> Any:
+        entry_key = (iteration, key)
+        if entry_key not in self._entries:
+            self._evict_before(iteration - self._keep_iterations + 1)
+            self._entries[entry_key] = compute()
+        return self._entries[entry_key]
+
+    def get_signed_distance(
+            self,
+            iteration: int,
+            key: Hashable,
+            band: Optional[float],
+            compute_mask: Callable[[], MaskNd],
+            use_jax: bool = False
+    ) -> ArrayNd:
+        """
+        signed distance of a mask, computed at most once per iteration. by default this is the full fast marching field
+        of compute_signed_distance, and band is ignored. with use_jax it is the banded jax field, reusing a field
+        already cached for this iteration with an equal or wider band; fields for the same key and band are computed
+        by one persistent engine, so consecutive iterations only recompute around where the mask changed.
+        """
+        if not use_jax:
+            return self.get_or_compute(
+                iteration,
+                ('signed_distance', key, False, None),
+                lambda: _compute_signed_distance_or_infinite(compute_mask())
+            )
+
+        for (cached_iteration, cached_key), signed_distance in self._entries.items():
+            if (
+                    cached_iteration == iteration
+                    and isinstance(cached_key, tuple)
+                    and cached_key[:3] == ('signed_distance', key, True)
+                    and _band_covers(cached_key[3], band)
+            ):
+                return signed_distance
+
+        engine = self._signed_distance_engines.setdefault(
+            (key, band), SignedDistanceEngine.from_parts(band=band)
+        )
+        return self.get_or_compute(iteration, ('signed_distance', key, True, band), lambda: engine(compute_mask()))
+
+    def clear(self):
+        self._entries.clear()
+        self._signed_distance_engines.clear()
+
+    def _evict_before(self, iteration: int):
+        for entry_key in [entry_key for entry_key in self._entries if entry_key[0] < iteration]:
+            del self._entries[entry_key]
+
+
+def _band_covers(band: Optional[float], requested_band: Optional[float]) -> bool:
+    if band is None:
+        return True
+    if requested_band is None:
+        return False
+    return band >= requested_band
+
+
+def _compute_signed_distance_or_infinite(mask: MaskNd) -> ArrayNd:
+    # a full or empty mask has no boundary to march from; every cell is then infinitely far inside or outside, as the
+    # mask helpers of utils.sets treat it
+    if np.all(mask) or not np.any(mask):
+        return jnp.full(np.shape(mask), jnp.inf if np.all(mask) else -jnp.inf)
+    return compute_signed_distance(mask)
@@ -0,0 +1,123 @@
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import List, Optional, Tuple
+
+import attr
+
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult
+from refineNCBF.local_hjr_solver.store import LocalUpdateResultStore
+from refineNCBF.utils.files import FilePathRelative, FilePathAbsolute, construct_refine_ncbf_path
+from refineNCBF.utils.visuals import make_configured_logger
+
+_LAST_USED_FILE = 'last_used'
+
+
+@attr.s(auto_attribs=True)
+class LocalUpdateResultDiskCache:
+    """
+    content-addressed on-disk cache of solved results. an entry is a LocalUpdateResultStore named after a key, which
+    LocalHjrSolver.with_result_cache derives from everything that determines the result (dynamics, grid, problem
+    arrays, component settings, seed set and initial values). hits are loaded lazily from the store.
+
+    with max_bytes, least recently used entries are evicted after every save until the cache fits. entries are written
+    to a temporary directory and renamed into place, so an interrupted save never leaves a partial entry behind.
+    """
+    _directory: FilePathAbsolute
+    _max_bytes: Optional[int] = None
+
+    _logger: logging.Logger = make_configured_logger(__name__)
+
+    @classmethod
+    def from_parts(cls, directory: FilePathRelative = 'data/result_cache', max_bytes: Optional[int] = None):
+        return cls(directory=construct_refine_ncbf_path(directory), max_bytes=max_bytes)
+
+    def __contains__(self, key: str) -> bool:
+        return LocalUpdateResultStore.from_directory(self._get_entry_path(key)).exists()
+
+    def __len__(self) -> int:
+        return len(self._get_entries())
+
+    def load(self, key: str) -> Optional[LocalUpdateResult]:
+        """
+        the cached result for key (without solver and dynamics attached), or None on a miss.
+        """
+        if key not in self:
+            return None
+        self._touch(key)
+        return LocalUpdateResult.load(self._get_entry_path(key), load_objects=False)
+
+    def save(self, key: str, result: LocalUpdateResult):
+        if key in self:
+            self._touch(key)
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        temporary_path = os.path.join(self._directory, f'.{key}.{uuid.uuid4().hex}.tmp')
+        try:
+            LocalUpdateResultStore.from_directory(temporary_path).save(result, include_objects=False)
+            _touch_file(os.path.join(temporary_path, _LAST_USED_FILE))
+            os.replace(temporary_path, self._get_entry_path(key))
+        except OSError as error:
+            # another process saved the same key first
+            self._logger.warning(f'could not save result cache entry {key}: {error}')
+        finally:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """
+        removes least recently used entries until the cache fits in max_bytes.
+        """
+        if self._max_bytes is None:
+            return
+        entries = self._get_entries()
+        total_bytes = sum(entry_bytes for _, _, entry_bytes in entries)
+        for key, _, entry_bytes in sorted(entries, key=lambda entry: entry[1]):
+            if total_bytes <= self._max_bytes:
+                break
+            shutil.rmtree(self._get_entry_path(key), ignore_errors=True)
+            total_bytes -= entry_bytes
+            self._logger.info(f'evicted result cache entry {key} ({entry_bytes} bytes)')
+
+    def clear(self):
+        for key, _, _ in self._get_entries():
+            shutil.rmtree(self._get_entry_path(key), ignore_errors=True)
+
+    def _get_entry_path(self, key: str) -> FilePathAbsolute:
+        return os.path.join(self._directory, key)
+
+    def _get_entries(self) -> List[Tuple[str, float, int]]:
+        """
+        (key, last used time, size in bytes) of every entry.
+        """
+        if not os.path.isdir(self._directory):
+            return []
+        entries = []
+        for key in os.listdir(self._directory):
+            if key.startswith('.') or key not in self:
+                continue
+            entry_path = self._get_entry_path(key)
+            last_used_path = os.path.join(entry_path, _LAST_USED_FILE)
+            last_used = os.path.getmtime(last_used_path) if os.path.isfile(last_used_path) else 0.
+            entries.append((key, last_used, _get_directory_bytes(entry_path)))
+        return entries
+
+    def _touch(self, key: str):
+        _touch_file(os.path.join(self._get_entry_path(key), _LAST_USED_FILE))
+
+
+def _touch_file(file_path: FilePathAbsolute):
+    with open(file_path, 'a'):
+        pass
+    now = time.time()
+    os.utime(file_path, (now, now))
+
+
+def _get_directory_bytes(directory: FilePathAbsolute) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, file_name))
+        for root, _, file_names in os.walk(directory)
+        for file_name in file_names
+    )
@@ -1,13 +1,17 @@
+import math
 from abc import ABC, abstractmethod
-from typing import Callable
+from typing import Callable, Optional, Tuple
 
 import attr
 import jax
+import numpy as np
+from jax import numpy as jnp
 
+import hj_reachability
 from refineNCBF.local_hjr_solver.result import LocalUpdateResult
-from refineNCBF.utils.sets import expand_mask_by_signed_distance, compute_signed_distance, expand_mask_by_dilation, \
-    get_mask_boundary_by_dilation
-from refineNCBF.utils.types import MaskNd
+from refineNCBF.utils.sets import expand_mask_by_signed_distance, compute_signed_distance, compute_signed_distance_jax, \
+    expand_mask_by_dilation_jax, get_mask_boundary_by_dilation_jax, expand_mask_by_index_boxes
+from refineNCBF.utils.types import MaskNd, ArrayNd
 
 
 @attr.s(auto_attribs=True)
@@ -20,20 +24,47 @@ class NeighborExpander(ABC, Callable):
     ) -> MaskNd:
         ...
 
+    def get_neighbor_cells(self) -> Optional[int]:
+        """
+        how many cells beyond the source set, at most, this expander activates along any axis. None if that is not
+        bounded (or not known), e.g. for an infinite distance.
+        """
+        return None
+
+
+@attr.s(auto_attribs=True)
+class CompiledNeighborExpander(NeighborExpander):
+    """
+    neighbor expander written as a pure jax function of device arrays, so it can also run inside a jitted solver
+    iteration.
+    """
+    @abstractmethod
+    def compute(self, values: ArrayNd, source_set: MaskNd, iteration: ArrayNd) -> MaskNd:
+        ...
+
+    def __call__(self, data: LocalUpdateResult, source_set: MaskNd) -> MaskNd:
+        return self.compute(jnp.asarray(data.get_recent_values()), jnp.asarray(source_set), jnp.asarray(len(data)))
+
 
 @attr.s(auto_attribs=True)
 class SignedDistanceNeighbors(NeighborExpander):
     _distance: float
+    _use_jax: bool = False
 
     @classmethod
     def from_parts(
             cls,
-            distance: float
+            distance: float,
+            use_jax: bool = False
     ):
         return cls(
-            distance=distance
+            distance=distance,
+            use_jax=use_jax
         )
 
+    def get_neighbor_cells(self) -> Optional[int]:
+        return _get_distance_cells(self._distance)
+
     def __call__(
             self,
             data: LocalUpdateResult,
@@ -47,7 +78,8 @@ class SignedDistanceNeighbors(NeighborExpander):
         else:
             active_set_expanded = expand_mask_by_signed_distance(
                 source_set,
-                self._distance
+                self._distance,
+                use_jax=self._use_jax
             )
         return active_set_expanded
 
@@ -57,20 +89,26 @@ class SignedDistanceNeighborsNearBoundary(NeighborExpander):
     _neighbor_distance: float
     _boundary_distance_inner: float
     _boundary_distance_outer: float
+    _use_jax: bool = False
 
     @classmethod
     def from_parts(
             cls,
             neighbor_distance: float,
             boundary_distance_inner: float,
-            boundary_distance_outer: float
+            boundary_distance_outer: float,
+            use_jax: bool = False
     ):
         return cls(
             neighbor_distance=neighbor_distance,
             boundary_distance_inner=boundary_distance_inner,
-            boundary_distance_outer=boundary_distance_outer
+            boundary_distance_outer=boundary_distance_outer,
+            use_jax=use_jax
         )
 
+    def get_neighbor_cells(self) -> Optional[int]:
+        return _get_distance_cells(self._neighbor_distance)
+
     def __call__(
             self,
             data: LocalUpdateResult,
@@ -79,8 +117,13 @@ class SignedDistanceNeighborsNearBoundary(NeighborExpander):
         if len(data) == 0:
             active_set_expanded = source_set
         else:
-            signed_distance_active = compute_signed_distance(source_set)
-            signed_distance_kernel = compute_signed_distance(data.get_viability_kernel())
+            if self._use_jax:
+                signed_distance_active = compute_signed_distance_jax(source_set, band=self._neighbor_distance)
+            else:
+                signed_distance_active = compute_signed_distance(source_set)
+            signed_distance_kernel = data.get_viability_kernel_signed_distance(
+                band=max(self._boundary_distance_inner, self._boundary_distance_outer), use_jax=self._use_jax
+            )
             expanded = signed_distance_active >= -self._neighbor_distance
             boundary = (signed_distance_kernel <= self._boundary_distance_inner) & (
                         signed_distance_kernel >= -self._boundary_distance_outer)
@@ -102,7 +145,33 @@ class SignedDistanceNeighborsNearBoundary(NeighborExpander):
 
 
 @attr.s(auto_attribs=True)
-class SignedDistanceNeighborsNearBoundaryDilation(NeighborExpander):
+class DilationNeighbors(CompiledNeighborExpander):
+    _distance: float
+
+    @classmethod
+    def from_parts(
+            cls,
+            distance: float
+    ):
+        return cls(
+            distance=distance
+        )
+
+    def get_neighbor_cells(self) -> Optional[int]:
+        return _get_distance_cells(self._distance)
+
+    def compute(self, values: ArrayNd, source_set: MaskNd, iteration: ArrayNd) -> MaskNd:
+        if self._distance == jnp.inf:
+            return jnp.ones_like(source_set, dtype=bool)
+
+        # a fractional distance still reaches the next cell out, as the signed distance neighbors do
+        expanded = expand_mask_by_dilation_jax(source_set, math.ceil(self._distance))
+        active_set_expanded = jnp.where(iteration == 0, source_set, expanded)
+        return active_set_expanded
+
+
+@attr.s(auto_attribs=True)
+class SignedDistanceNeighborsNearBoundaryDilation(CompiledNeighborExpander):
     _neighbor_distance: int
     _boundary_distance_inner: int
     _boundary_distance_outer: int
@@ -120,34 +189,45 @@ class SignedDistanceNeighborsNearBoundaryDilation(NeighborExpander):
             boundary_distance_outer=boundary_distance_outer
         )
 
-    def __call__(
-            self,
-            data: LocalUpdateResult,
-            source_set: MaskNd
-    ) -> MaskNd:
-        if len(data) == 0:
-            active_set_expanded = source_set
-        else:
-            expanded = expand_mask_by_dilation(source_set, self._neighbor_distance)
-            boundary = get_mask_boundary_by_dilation(data.get_viability_kernel(), self._boundary_distance_inner,
-                                                     self._boundary_distance_outer)
-            active_set_expanded = expanded & boundary
+    def get_neighbor_cells(self) -> Optional[int]:
+        return _get_distance_cells(self._neighbor_distance)
+
+    def __call__(self, data: LocalUpdateResult, source_set: MaskNd) -> MaskNd:
+        boundary = data.get_viability_kernel_boundary_by_dilation(
+            int(self._boundary_distance_inner), int(self._boundary_distance_outer)
+        )
+        return self._expand(jnp.asarray(source_set), boundary, jnp.asarray(len(data)))
+
+    def compute(self, values: ArrayNd, source_set: MaskNd, iteration: ArrayNd) -> MaskNd:
+        boundary = get_mask_boundary_by_dilation_jax(values >= 0, int(self._boundary_distance_inner),
+                                                     int(self._boundary_distance_outer))
+        return self._expand(source_set, boundary, iteration)
+
+    def _expand(self, source_set: MaskNd, boundary: MaskNd, iteration: ArrayNd) -> MaskNd:
+        expanded = expand_mask_by_dilation_jax(source_set, math.ceil(self._neighbor_distance))
+        active_set_expanded = jnp.where(iteration == 0, source_set, expanded & boundary)
         return active_set_expanded
 
 
 @attr.s(auto_attribs=True)
 class InnerSignedDistanceNeighbors(NeighborExpander):
     _distance: float
+    _use_jax: bool = False
 
     @classmethod
     def from_parts(
             cls,
-            distance: float
+            distance: float,
+            use_jax: bool = False
     ):
         return cls(
-            distance=distance
+            distance=distance,
+            use_jax=use_jax
         )
 
+    def get_neighbor_cells(self) -> Optional[int]:
+        return _get_distance_cells(self._distance)
+
     def __call__(
             self,
             data: LocalUpdateResult,
@@ -158,26 +238,77 @@ class InnerSignedDistanceNeighbors(NeighborExpander):
         else:
             active_set_expanded = expand_mask_by_signed_distance(
                 source_set,
-                self._distance
+                self._distance,
+                use_jax=self._use_jax
             ) & data.get_viability_kernel()
         return active_set_expanded
 
 
 @attr.s(auto_attribs=True)
-class NoNeighbors(NeighborExpander):
+class NoNeighbors(CompiledNeighborExpander):
     @classmethod
     def from_parts(
             cls
     ):
         return cls()
 
-    def __call__(
-            self,
-            data: LocalUpdateResult,
-            source_set: MaskNd
-    ) -> MaskNd:
+    def get_neighbor_cells(self) -> Optional[int]:
+        return 0
+
+    def compute(self, values: ArrayNd, source_set: MaskNd, iteration: ArrayNd) -> MaskNd:
         return source_set
 
-# TODO: add a neighbor expander that uses dynamics.
-#  use partial max magnitudes to determine the maximum step size from this cell in each direction.
-#  then snap to nearest grid point in each direction using snap_state_to_grid_index(), and fill in the box between the 2^N points.
+
+@attr.s(auto_attribs=True)
+class DynamicsReachableNeighbors(CompiledNeighborExpander):
+    """
+    activates the cells whose value can be influenced by the source set within one solver time step, i.e. the cells
+    whose reachable box contains a source cell. along each axis, the half width of a cell's box is the partial max
+    magnitude of the dynamics at that cell (over the control and disturbance bounds) times the time step, in cells and
+    rounded up, plus stencil_half_width cells for the spatial derivative stencil along the axes the cell moves in. so on
+    anisotropic systems cells are only activated along the directions they actually move in. the widths are
+    precomputed over the whole grid.
+    """
+    _half_widths: ArrayNd
+    _periodic_axes: Tuple[bool, ...]
+    _max_half_widths: Tuple[int, ...]
+
+    @classmethod
+    def from_parts(
+            cls,
+            dynamics: hj_reachability.Dynamics,
+            grid: hj_reachability.Grid,
+            time_step: float,
+            safety_factor: float = 1,
+            stencil_half_width: int = 1
+    ):
+        partial_max_magnitudes = hj_reachability.utils.multivmap(
+            lambda state: dynamics.partial_max_magnitudes(state, 0., None, None),
+            np.arange(grid.ndim)
+        )(grid.states)
+        half_widths = jnp.ceil(safety_factor * jnp.abs(time_step) * partial_max_magnitudes / jnp.array(grid.spacings))
+        half_widths = jnp.where(partial_max_magnitudes > 0, half_widths + stencil_half_width, 0).astype(jnp.int32)
+        max_half_widths = jnp.max(half_widths.reshape(-1, grid.ndim), axis=0)
+        return cls(
+            half_widths=half_widths,
+            periodic_axes=tuple(
+                boundary_condition is hj_reachability.boundary_conditions.periodic
+                for boundary_condition in grid.boundary_conditions
+            ),
+            max_half_widths=tuple(int(max_half_width) for max_half_width in max_half_widths)
+        )
+
+    def get_neighbor_cells(self) -> Optional[int]:
+        return max(self._max_half_widths, default=0)
+
+    def compute(self, values: ArrayNd, source_set: MaskNd, iteration: ArrayNd) -> MaskNd:
+        expanded = expand_mask_by_index_boxes(source_set, self._half_widths, self._periodic_axes, self._max_half_widths)
+        active_set_expanded = jnp.where(iteration == 0, source_set, expanded)
+        return active_set_expanded
+
+
+def _get_distance_cells(distance: float) -> Optional[int]:
+    # signed distances and dilations are in cells, and a fractional distance reaches the next cell out
+    if distance == np.inf:
+        return None
+    return math.ceil(distance)
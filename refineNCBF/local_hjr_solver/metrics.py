@@ -0,0 +1,233 @@
+import csv
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import attr
+import jax
+
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult
+from refineNCBF.utils.files import FilePathRelative, construct_refine_ncbf_path
+from refineNCBF.utils.masks import count_mask_nonzero
+
+COMPILE_EVENT_SUFFIX = 'backend_compile_duration'
+
+
+@attr.dataclass
+class IterationMetrics:
+    """
+    timings of one recorded iteration: wall time of each solver stage (synchronized with the device, so the time is
+    spent in the stage that dispatched the work), active cell counts, and the jax compilations that happened during it.
+    """
+    iteration: int
+    stage_durations: Dict[str, float]
+    cells_pre_filtered: int
+    cells_expanded: int
+    cells_post_filtered: int
+    compile_count: int = 0
+    compile_duration: float = 0.
+
+    @property
+    def total_duration(self) -> float:
+        return sum(self.stage_durations.values())
+
+    @property
+    def cells_per_second(self) -> float:
+        """
+        expanded (i.e. computed) cells per second of the step stage, or of the whole iteration if it has no step stage.
+        """
+        duration = self.stage_durations.get('step', self.total_duration)
+        return self.cells_expanded / duration if duration > 0 else float('nan')
+
+    def to_record(self) -> Dict[str, Any]:
+        record = {'iteration': self.iteration}
+        record.update({f'{stage}_duration': duration for stage, duration in self.stage_durations.items()})
+        record.update({
+            'total_duration': self.total_duration,
+            'cells_pre_filtered': self.cells_pre_filtered,
+            'cells_expanded': self.cells_expanded,
+            'cells_post_filtered': self.cells_post_filtered,
+            'cells_per_second': self.cells_per_second,
+            'compile_count': self.compile_count,
+            'compile_duration': self.compile_duration,
+        })
+        return record
+
+
+@attr.dataclass
+class SolverMetrics:
+    iterations: List[IterationMetrics] = attr.ib(factory=list)
+
+    def __len__(self):
+        return len(self.iterations)
+
+    def add(self, iteration_metrics: IterationMetrics):
+        self.iterations.append(iteration_metrics)
+
+    def get_stage_totals(self) -> Dict[str, float]:
+        stage_totals = {}
+        for iteration_metrics in self.iterations:
+            for stage, duration in iteration_metrics.stage_durations.items():
+                stage_totals[stage] = stage_totals.get(stage, 0.) + duration
+        return stage_totals
+
+    def get_dominant_stage(self) -> Optional[str]:
+        stage_totals = self.get_stage_totals()
+        return max(stage_totals, key=stage_totals.get) if len(stage_totals) > 0 else None
+
+    def get_compile_count(self) -> int:
+        return sum(iteration_metrics.compile_count for iteration_metrics in self.iterations)
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        return [iteration_metrics.to_record() for iteration_metrics in self.iterations]
+
+
+@attr.s(auto_attribs=True)
+class MetricsExporter(ABC, Callable):
+    """
+    receives the metrics of every recorded iteration as the solver produces them.
+    """
+    @abstractmethod
+    def __call__(self, iteration_metrics: IterationMetrics):
+        ...
+
+
+@attr.s(auto_attribs=True)
+class NoMetricsExporter(MetricsExporter):
+    @classmethod
+    def from_parts(cls):
+        return cls()
+
+    def __call__(self, iteration_metrics: IterationMetrics):
+        pass
+
+
+@attr.s(auto_attribs=True)
+class CallbackMetricsExporter(MetricsExporter):
+    _callback: Callable[[IterationMetrics], None]
+
+    @classmethod
+    def from_parts(cls, callback: Callable[[IterationMetrics], None]):
+        return cls(callback=callback)
+
+    def __call__(self, iteration_metrics: IterationMetrics):
+        self._callback(iteration_metrics)
+
+
+@attr.s(auto_attribs=True)
+class CsvMetricsExporter(MetricsExporter):
+    """
+    appends one row per iteration to a csv file, with the columns of the first row written.
+    """
+    _file_path: FilePathRelative
+
+    @classmethod
+    def from_parts(cls, file_path: FilePathRelative):
+        return cls(file_path=file_path)
+
+    def __call__(self, iteration_metrics: IterationMetrics):
+        full_path = construct_refine_ncbf_path(self._file_path)
+        record = iteration_metrics.to_record()
+        if os.path.isfile(full_path):
+            with open(full_path, 'r', newline='') as f:
+                fieldnames = next(csv.reader(f))
+            write_header = False
+        else:
+            fieldnames, write_header = list(record.keys()), True
+
+        with open(full_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, restval='', extrasaction='ignore')
+            if write_header:
+                writer.writeheader()
+            writer.writerow(record)
+
+
+@attr.s(auto_attribs=True)
+class JsonLinesMetricsExporter(MetricsExporter):
+    _file_path: FilePathRelative
+
+    @classmethod
+    def from_parts(cls, file_path: FilePathRelative):
+        return cls(file_path=file_path)
+
+    def __call__(self, iteration_metrics: IterationMetrics):
+        with open(construct_refine_ncbf_path(self._file_path), 'a') as f:
+            f.write(json.dumps(iteration_metrics.to_record()) + '\n')
+
+
+@attr.s(auto_attribs=True)
+class CompileEventCounter:
+    """
+    running count and duration of jax backend compilations, fed by a jax.monitoring listener.
+    """
+    _count: int = 0
+    _duration: float = 0.
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, repr=False)
+
+    def __call__(self, event: str, duration: float, **kwargs):
+        if event.endswith(COMPILE_EVENT_SUFFIX):
+            with self._lock:
+                self._count += 1
+                self._duration += duration
+
+    def snapshot(self) -> Tuple[int, float]:
+        with self._lock:
+            return self._count, self._duration
+
+
+_compile_event_counter: Optional[CompileEventCounter] = None
+
+
+def get_compile_event_counter() -> CompileEventCounter:
+    """
+    process-wide compile event counter, registered with jax.monitoring on first use (listeners cannot be removed).
+    """
+    global _compile_event_counter
+    if _compile_event_counter is None:
+        _compile_event_counter = CompileEventCounter()
+        jax.monitoring.register_event_duration_secs_listener(_compile_event_counter)
+    return _compile_event_counter
+
+
+@attr.s(auto_attribs=True)
+class IterationTimer:
+    """
+    times the solver stages of one iteration. when disabled, stages are called as is, without synchronizing.
+    """
+    _enabled: bool
+    _stage_durations: Dict[str, float] = attr.ib(factory=dict)
+    _compile_snapshot: Tuple[int, float] = (0, 0.)
+
+    @classmethod
+    def from_parts(cls, enabled: bool):
+        timer = cls(enabled=enabled)
+        if enabled:
+            timer._compile_snapshot = get_compile_event_counter().snapshot()
+        return timer
+
+    def time(self, stage: str, compute: Callable, *args):
+        if not self._enabled:
+            return compute(*args)
+        start_time = time.perf_counter()
+        output = jax.block_until_ready(compute(*args))
+        self._stage_durations[stage] = self._stage_durations.get(stage, 0.) + time.perf_counter() - start_time
+        return output
+
+    def finish(self, result: LocalUpdateResult) -> IterationMetrics:
+        """
+        metrics of the iteration last added to result.
+        """
+        compile_count, compile_duration = get_compile_event_counter().snapshot()
+        iteration = result.iterations[-1]
+        return IterationMetrics(
+            iteration=len(result),
+            stage_durations=dict(self._stage_durations),
+            cells_pre_filtered=count_mask_nonzero(iteration.active_set_pre_filtered),
+            cells_expanded=count_mask_nonzero(iteration.active_set_expanded),
+            cells_post_filtered=count_mask_nonzero(iteration.active_set_post_filtered),
+            compile_count=compile_count - self._compile_snapshot[0],
+            compile_duration=compile_duration - self._compile_snapshot[1],
+        )
@@ -22,13 +22,13 @@ class ActiveSetPostFilter(ABC, Callable):
 
 
 @attr.s(auto_attribs=True)
-class RemoveWhereUnchanged(ActiveSetPostFilter):
-    _atol: float
-    _rtol: float
-
-    @classmethod
-    def from_parts(cls, atol: float, rtol: float):
-        return cls(atol=atol, rtol=rtol)
+class CompiledActiveSetPostFilter(ActiveSetPostFilter):
+    """
+    post-filter written as a pure jax function of device arrays, so it can also run inside a jitted solver iteration.
+    """
+    @abstractmethod
+    def compute(self, values: ArrayNd, active_set_expanded: MaskNd, values_next: ArrayNd) -> MaskNd:
+        ...
 
     def __call__(
             self,
@@ -37,46 +37,47 @@ class RemoveWhereUnchanged(ActiveSetPostFilter):
             active_set_expanded: MaskNd,
             values_next: ArrayNd
     ) -> MaskNd:
+        return self.compute(jnp.asarray(data.get_recent_values()), active_set_expanded, values_next)
+
+
+@attr.s(auto_attribs=True)
+class RemoveWhereUnchanged(CompiledActiveSetPostFilter):
+    _atol: float
+    _rtol: float
+
+    @classmethod
+    def from_parts(cls, atol: float, rtol: float):
+        return cls(atol=atol, rtol=rtol)
+
+    def compute(self, values: ArrayNd, active_set_expanded: MaskNd, values_next: ArrayNd) -> MaskNd:
         changed = active_set_expanded & ~jnp.isclose(
-            data.get_recent_values(), values_next,
+            values, values_next,
             atol=self._atol, rtol=self._rtol
         )
         return changed
 
 
 @attr.s(auto_attribs=True)
-class RemoveWhereNonNegativeHamiltonian(ActiveSetPostFilter):
+class RemoveWhereNonNegativeHamiltonian(CompiledActiveSetPostFilter):
     hamitonian_atol: float = 1e-3
 
     @classmethod
     def from_parts(cls, hamiltonian_atol: float = 1e-3):
         return cls(hamiltonian_atol)
 
-    def __call__(
-            self,
-            data: LocalUpdateResult,
-            active_set_pre_filtered: MaskNd,
-            active_set_expanded: MaskNd,
-            values_next: ArrayNd
-    ) -> MaskNd:
-        hamiltonian = values_next - data.get_recent_values()
+    def compute(self, values: ArrayNd, active_set_expanded: MaskNd, values_next: ArrayNd) -> MaskNd:
+        hamiltonian = values_next - values
         negative_hamiltonian = hamiltonian < -self.hamitonian_atol
         return negative_hamiltonian & active_set_expanded
 
 
 @attr.s(auto_attribs=True)
-class NoPostFilter(ActiveSetPostFilter):
+class NoPostFilter(CompiledActiveSetPostFilter):
     @classmethod
     def from_parts(cls):
         return cls()
 
-    def __call__(
-            self,
-            data: LocalUpdateResult,
-            active_set_pre_filtered: MaskNd,
-            active_set_expanded: MaskNd,
-            values_next: ArrayNd
-    ) -> MaskNd:
+    def compute(self, values: ArrayNd, active_set_expanded: MaskNd, values_next: ArrayNd) -> MaskNd:
         return active_set_expanded
 
 
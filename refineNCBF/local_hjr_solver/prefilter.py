@@ -2,10 +2,11 @@ from abc import ABC, abstractmethod
 from typing import Callable
 
 import attr
+from jax import numpy as jnp
 
 from refineNCBF.local_hjr_solver.result import LocalUpdateResult
-from refineNCBF.utils.sets import shrink_mask_by_signed_distance
-from refineNCBF.utils.types import MaskNd
+from refineNCBF.utils.sets import get_mask_boundary_by_dilation_jax
+from refineNCBF.utils.types import MaskNd, ArrayNd
 
 
 @attr.s(auto_attribs=True)
@@ -16,27 +17,46 @@ class ActiveSetPreFilter(ABC, Callable):
 
 
 @attr.s(auto_attribs=True)
-class NoPreFilter(ActiveSetPreFilter):
+class CompiledActiveSetPreFilter(ActiveSetPreFilter):
+    """
+    pre-filter written as a pure jax function of device arrays, so it can also run inside a jitted solver iteration.
+    """
+    @abstractmethod
+    def compute(self, values: ArrayNd, pending_seed_set: MaskNd, iteration: ArrayNd) -> MaskNd:
+        ...
+
+    def __call__(self, data: LocalUpdateResult) -> MaskNd:
+        return self.compute(
+            jnp.asarray(data.get_recent_values()),
+            jnp.asarray(data.get_pending_seed_set()),
+            jnp.asarray(len(data)),
+        )
+
+
+@attr.s(auto_attribs=True)
+class NoPreFilter(CompiledActiveSetPreFilter):
     @classmethod
     def from_parts(cls):
         return cls()
 
-    def __call__(self, data: LocalUpdateResult) -> MaskNd:
-        active_set_filtered = data.get_pending_seed_set()
+    def compute(self, values: ArrayNd, pending_seed_set: MaskNd, iteration: ArrayNd) -> MaskNd:
+        active_set_filtered = pending_seed_set
         return active_set_filtered
 
 
 @attr.s(auto_attribs=True)
 class PreFilterWhereFarFromZeroLevelset(ActiveSetPreFilter):
     _distance: float
+    _use_jax: bool = False
 
     @classmethod
-    def from_parts(cls, distance: float):
-        return cls(distance=distance)
+    def from_parts(cls, distance: float, use_jax: bool = False):
+        return cls(distance=distance, use_jax=use_jax)
 
     def __call__(self, data: LocalUpdateResult) -> MaskNd:
-        where_far_exterior = shrink_mask_by_signed_distance(data.get_recent_values() >= 0, distance=self._distance)
-        where_far_interior = shrink_mask_by_signed_distance(data.get_recent_values() < 0, distance=self._distance)
+        signed_distance_kernel = data.get_viability_kernel_signed_distance(band=self._distance, use_jax=self._use_jax)
+        where_far_exterior = signed_distance_kernel >= self._distance
+        where_far_interior = signed_distance_kernel <= -self._distance
 
         active_set_filtered = (
                 data.get_pending_seed_set()
@@ -70,15 +90,18 @@ class PreFilterWhereOutsideZeroLevelset(ActiveSetPreFilter):
 class PreFilterWhereFarFromBoundarySplit(ActiveSetPreFilter):
     _distance_inner: float
     _distance_outer: float
+    _use_jax: bool = False
 
     @classmethod
-    def from_parts(cls, distance_inner: float, distance_outer: float):
-        return cls(distance_inner=distance_inner, distance_outer=distance_outer)
+    def from_parts(cls, distance_inner: float, distance_outer: float, use_jax: bool = False):
+        return cls(distance_inner=distance_inner, distance_outer=distance_outer, use_jax=use_jax)
 
     def __call__(self, data: LocalUpdateResult) -> MaskNd:
-        where_far_exterior = shrink_mask_by_signed_distance(data.get_recent_values() >= 0,
-                                                            distance=self._distance_inner)
-        where_far_interior = shrink_mask_by_signed_distance(data.get_recent_values() < 0, distance=self._distance_outer)
+        signed_distance_kernel = data.get_viability_kernel_signed_distance(
+            band=max(self._distance_inner, self._distance_outer), use_jax=self._use_jax
+        )
+        where_far_exterior = signed_distance_kernel >= self._distance_inner
+        where_far_interior = signed_distance_kernel <= -self._distance_outer
 
         active_set_filtered = (
                 data.get_pending_seed_set()
@@ -96,17 +119,19 @@ class PreFilterWhereFarFromBoundarySplit(ActiveSetPreFilter):
 class PreFilterWhereFarFromBoundarySplitOnce(ActiveSetPreFilter):
     _distance_inner: float
     _distance_outer: float
+    _use_jax: bool = False
 
     @classmethod
-    def from_parts(cls, distance_inner: float, distance_outer: float):
-        return cls(distance_inner=distance_inner, distance_outer=distance_outer)
+    def from_parts(cls, distance_inner: float, distance_outer: float, use_jax: bool = False):
+        return cls(distance_inner=distance_inner, distance_outer=distance_outer, use_jax=use_jax)
 
     def __call__(self, data: LocalUpdateResult) -> MaskNd:
         if len(data) == 0:
-            where_far_exterior = shrink_mask_by_signed_distance(data.get_recent_values() >= 0,
-                                                                distance=self._distance_inner)
-            where_far_interior = shrink_mask_by_signed_distance(data.get_recent_values() < 0,
-                                                                distance=self._distance_outer)
+            signed_distance_kernel = data.get_viability_kernel_signed_distance(
+                band=max(self._distance_inner, self._distance_outer), use_jax=self._use_jax
+            )
+            where_far_exterior = signed_distance_kernel >= self._distance_inner
+            where_far_interior = signed_distance_kernel <= -self._distance_outer
 
             active_set_filtered = (
                     data.get_pending_seed_set()
@@ -120,3 +145,39 @@ class PreFilterWhereFarFromBoundarySplitOnce(ActiveSetPreFilter):
             return active_set_filtered
         else:
             return data.get_pending_seed_set()
+
+
+@attr.s(auto_attribs=True)
+class PreFilterWhereFarFromBoundarySplitDilation(CompiledActiveSetPreFilter):
+    """
+    dilation analogue of PreFilterWhereFarFromBoundarySplit: keeps seed cells within distance_inner cells inside
+    or distance_outer cells outside the zero levelset.
+    """
+    _distance_inner: int
+    _distance_outer: int
+    _only_first_iteration: bool = False
+
+    @classmethod
+    def from_parts(cls, distance_inner: int, distance_outer: int, only_first_iteration: bool = False):
+        return cls(
+            distance_inner=int(distance_inner),
+            distance_outer=int(distance_outer),
+            only_first_iteration=only_first_iteration
+        )
+
+    def __call__(self, data: LocalUpdateResult) -> MaskNd:
+        return self._filter(
+            jnp.asarray(data.get_pending_seed_set()),
+            data.get_viability_kernel_boundary_by_dilation(self._distance_inner, self._distance_outer),
+            jnp.asarray(len(data)),
+        )
+
+    def compute(self, values: ArrayNd, pending_seed_set: MaskNd, iteration: ArrayNd) -> MaskNd:
+        near_boundary = get_mask_boundary_by_dilation_jax(values >= 0, self._distance_inner, self._distance_outer)
+        return self._filter(pending_seed_set, near_boundary, iteration)
+
+    def _filter(self, pending_seed_set: MaskNd, near_boundary: MaskNd, iteration: ArrayNd) -> MaskNd:
+        active_set_filtered = pending_seed_set & near_boundary
+        if self._only_first_iteration:
+            active_set_filtered = jnp.where(iteration == 0, active_set_filtered, pending_seed_set)
+        return active_set_filtered
@@ -1,3 +1,4 @@
+import os
 import warnings
 from typing import List, Optional, Union, Tuple
 
@@ -10,21 +11,46 @@ from matplotlib import pyplot as plt, animation
 import hj_reachability
 from refineNCBF.hj_reachability_interface.hj_step import hj_step
 from refineNCBF.hj_reachability_interface.hj_value_postprocessors import ReachAvoid
+from refineNCBF.local_hjr_solver.cache import LocalUpdateResultCache
 from refineNCBF.optimized_dp_interface.odp_dynamics import OdpDynamics
 from refineNCBF.utils.files import FilePathRelative, check_if_file_exists, construct_refine_ncbf_path, \
     generate_unique_filename
+from refineNCBF.utils.masks import compact_mask, as_dense_mask, count_mask_nonzero
+from refineNCBF.utils.sets import get_mask_boundary_by_dilation_jax
 from refineNCBF.utils.types import MaskNd, ArrayNd
 from refineNCBF.utils.visuals import ArraySlice2D, ArraySlice1D
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
 
+@attr.dataclass
+class LocalUpdateResultValuesDelta:
+    """
+    sparse change of a values array between consecutive iterations: the flat indices of the cells that changed and
+    their new values.
+    """
+    indices: np.ndarray
+    values: np.ndarray
+
+    @classmethod
+    def from_values(cls, values: ArrayNd, values_next: ArrayNd):
+        values_next = np.asarray(values_next).ravel()
+        indices = np.flatnonzero(np.asarray(values).ravel() != values_next)
+        return cls(indices=indices, values=values_next[indices])
+
+    def apply_to(self, flat_values: np.ndarray):
+        flat_values[self.indices] = self.values
+
+
 @attr.dataclass
 class LocalUpdateResultIteration:
     active_set_pre_filtered: MaskNd
     active_set_expanded: MaskNd
-    computed_values: ArrayNd
+    computed_values: Optional[ArrayNd]
     active_set_post_filtered: MaskNd
+    values_delta: Optional[LocalUpdateResultValuesDelta] = None
+    time_step: Optional[float] = None
+    iteration_count: Optional[int] = None
 
     @classmethod
     def from_parts(
@@ -33,12 +59,16 @@ class LocalUpdateResultIteration:
             active_set_expanded: MaskNd,
             values_next: ArrayNd,
             active_set_post_filtered: MaskNd,
+            time_step: Optional[float] = None,
+            iteration_count: Optional[int] = None,
     ):
         return cls(
             active_set_pre_filtered=active_set_pre_filtered,
             active_set_expanded=active_set_expanded,
             computed_values=values_next,
             active_set_post_filtered=active_set_post_filtered,
+            time_step=time_step,
+            iteration_count=iteration_count,
         )
 
 
@@ -56,6 +86,18 @@ class LocalUpdateResult:
     iterations: List[LocalUpdateResultIteration] = attr.ib(factory=list)
     # blurbs: List[str] = attr.ib(default=None, validator=attr.validators.optional(attr.validators.instance_of(list)))
     blurbs: List[str] = attr.ib(factory=list)
+    cache: LocalUpdateResultCache = attr.ib(factory=LocalUpdateResultCache, repr=False, eq=False)
+
+    # with a keyframe interval, only every keyframe_interval-th iteration keeps dense computed_values, the others keep
+    # a sparse delta to the iteration before. recent_values holds the latest values densely either way.
+    keyframe_interval: Optional[int] = None
+    recent_values: Optional[ArrayNd] = attr.ib(default=None, repr=False, eq=False)
+
+    # with compact masks, the seed set, avoid set and per-iteration active sets are kept as CompactMasks
+    compact_masks: bool = False
+
+    # per-iteration stage timings and cell counts, filled in by solvers with metrics enabled
+    metrics: Optional["SolverMetrics"] = attr.ib(default=None, eq=False)
 
     @classmethod
     def from_parts(
@@ -67,11 +109,17 @@ class LocalUpdateResult:
             seed_set: MaskNd,
             initial_values: ArrayNd,
             terminal_values: ArrayNd,
-            reach_set: Optional[MaskNd] = None
+            reach_set: Optional[MaskNd] = None,
+            keyframe_interval: Optional[int] = None,
+            compact_masks: bool = False
     ):
         if reach_set is None:
             reach_set = jnp.zeros_like(avoid_set, dtype=bool)
 
+        if compact_masks:
+            avoid_set = compact_mask(avoid_set)
+            seed_set = compact_mask(seed_set)
+
         return cls(
             local_solver=local_solver,
             dynamics=dynamics,
@@ -81,31 +129,87 @@ class LocalUpdateResult:
             initial_values=initial_values,
             terminal_values=terminal_values,
             seed_set=seed_set,
+            keyframe_interval=keyframe_interval,
+            compact_masks=compact_masks,
         )
 
     def __len__(self):
         return len(self.iterations)
 
     def add_iteration(self, iteration: LocalUpdateResultIteration, blurb: str = ''):
+        values_next = iteration.computed_values
+        if self.keyframe_interval is not None and len(self) % self.keyframe_interval != 0:
+            iteration = attr.evolve(
+                iteration,
+                computed_values=None,
+                values_delta=LocalUpdateResultValuesDelta.from_values(self.get_recent_values(), values_next)
+            )
+        if self.compact_masks:
+            iteration = attr.evolve(
+                iteration,
+                active_set_pre_filtered=compact_mask(iteration.active_set_pre_filtered),
+                active_set_expanded=compact_mask(iteration.active_set_expanded),
+                active_set_post_filtered=compact_mask(iteration.active_set_post_filtered),
+            )
         self.iterations.append(iteration)
+        self.recent_values = values_next
         if self.blurbs is None:
             self.blurbs = []
         self.blurbs.append(blurb)
 
-    def save(self, file_path: FilePathRelative):
+    def save(self, file_path: FilePathRelative, include_objects: bool = True):
+        """
+        saves into a chunked, memory-mappable directory store (see LocalUpdateResultStore), or as a single dill
+        pickle if file_path ends in .dill.
+        """
+        from refineNCBF.local_hjr_solver.store import LocalUpdateResultStore
+
         full_path = construct_refine_ncbf_path(file_path)
         check_if_file_exists(full_path)
-        with open(full_path, "wb") as f:
-            dill.dump(self, f)
+        if full_path.endswith('.dill'):
+            with open(full_path, "wb") as f:
+                dill.dump(self, f)
+        else:
+            LocalUpdateResultStore.from_directory(full_path).save(self, include_objects=include_objects)
+
+    def __getstate__(self):
+        # derived quantities are recomputed on demand, so they are left out of pickles rather than cleared here
+        state = self.__dict__.copy()
+        state['cache'] = LocalUpdateResultCache()
+        return state
 
     def get_middle_index(self) -> Tuple[int, ...]:
         return tuple([pts//2 for pts in self.grid.shape])
 
     @staticmethod
-    def load(file_path: FilePathRelative) -> "LocalUpdateResult":
+    def load(file_path: FilePathRelative, load_objects: bool = True) -> "LocalUpdateResult":
+        """
+        loads a directory store lazily (arrays memory-mapped, iterations opened on access), or a dill pickle in full.
+        """
+        from refineNCBF.local_hjr_solver.store import LocalUpdateResultStore
+
         full_path = construct_refine_ncbf_path(file_path)
+        if os.path.isdir(full_path):
+            return LocalUpdateResultStore.from_directory(full_path).load(load_objects=load_objects)
+
         with open(full_path, "rb") as f:
             cls = dill.load(f)
+        if not hasattr(cls, 'cache'):
+            cls.cache = LocalUpdateResultCache()
+        if not hasattr(cls, 'keyframe_interval'):
+            cls.keyframe_interval = None
+            cls.recent_values = None
+            for iteration in cls.iterations:
+                iteration.values_delta = None
+        for iteration in cls.iterations:
+            if not hasattr(iteration, 'time_step'):
+                iteration.time_step = None
+            if not hasattr(iteration, 'iteration_count'):
+                iteration.iteration_count = None
+        if not hasattr(cls, 'compact_masks'):
+            cls.compact_masks = False
+        if not hasattr(cls, 'metrics'):
+            cls.metrics = None
         return cls
 
     def max_diff(self):
@@ -114,60 +218,130 @@ class LocalUpdateResult:
 
     def get_previous_values(self, iteration: int = -1):
         if len(self) > 1:
-            return self.iterations[iteration-1].computed_values
+            return self.get_values(iteration - 1)
         else:
             return self.initial_values
 
     def get_pending_seed_set(self) -> MaskNd:
         if len(self.iterations) == 0:
-            return self.seed_set
+            return jnp.asarray(as_dense_mask(self.seed_set))
         else:
-            return self.iterations[-1].active_set_post_filtered
+            return jnp.asarray(as_dense_mask(self.iterations[-1].active_set_post_filtered))
 
     def get_recent_set_for_compute(self) -> MaskNd:
         if len(self) == 0:
-            return jnp.ones_like(self.seed_set, dtype=bool)
+            return jnp.ones(self.seed_set.shape, dtype=bool)
         else:
-            return self.iterations[-1].active_set_expanded
+            return jnp.asarray(as_dense_mask(self.iterations[-1].active_set_expanded))
 
     def get_total_active_count(self, up_to_iteration: int) -> int:
         return sum([
-            jnp.count_nonzero(iteration.active_set_expanded)
+            count_mask_nonzero(iteration.active_set_expanded)
             for iteration
             in self.iterations[:up_to_iteration]
         ])
 
     def get_total_active_mask(self) -> MaskNd:
-        total_active_mask = jnp.zeros_like(self.seed_set, dtype=bool)
+        total_active_mask = jnp.zeros(self.seed_set.shape, dtype=bool)
         for iteration in self.iterations:
-            total_active_mask = total_active_mask | iteration.active_set_expanded
+            total_active_mask = total_active_mask | as_dense_mask(iteration.active_set_expanded)
         return total_active_mask
 
+    def get_iteration_count(self) -> int:
+        """
+        number of solver iterations run so far. a solver that only records every few iterations stores the running
+        count with each recorded iteration; otherwise every iteration is recorded.
+        """
+        if len(self) == 0 or self.iterations[-1].iteration_count is None:
+            return len(self)
+        return self.iterations[-1].iteration_count
+
+    def get_last_time_step(self) -> Optional[float]:
+        if len(self) == 0:
+            return None
+        return self.iterations[-1].time_step
+
     def get_recent_values(self) -> ArrayNd:
-        return self.initial_values if len(self) == 0 else self.iterations[-1].computed_values
+        if len(self) == 0:
+            return self.initial_values
+        if self.recent_values is None:
+            self.recent_values = self.get_values(-1)
+        return self.recent_values
+
+    def get_values(self, iteration: int) -> ArrayNd:
+        """
+        values computed in the given iteration (negative indices count from the end). with delta encoding, these are
+        rebuilt from the closest keyframe at or before the iteration.
+        """
+        iteration = range(len(self))[iteration]
+        if iteration == len(self) - 1 and self.recent_values is not None:
+            return self.recent_values
+        if self.iterations[iteration].computed_values is not None:
+            return self.iterations[iteration].computed_values
+
+        keyframe = iteration
+        while keyframe >= 0 and self.iterations[keyframe].computed_values is None:
+            keyframe -= 1
+        base_values = self.initial_values if keyframe < 0 else self.iterations[keyframe].computed_values
+
+        flat_values = np.array(base_values).ravel()
+        for delta_iteration in self.iterations[keyframe + 1:iteration + 1]:
+            delta_iteration.values_delta.apply_to(flat_values)
+        return jnp.asarray(flat_values.reshape(np.shape(base_values)))
 
     def get_recent_values_list(self, span: int = 1) -> List[ArrayNd]:
         recent_values_list = []
         for i in range(span):
             if len(self.iterations) > i:
-                recent_values_list.append(self.iterations[-1 - i].computed_values)
+                recent_values_list.append(self.get_values(-1 - i))
             else:
                 recent_values_list.append(self.initial_values)
                 break
         return recent_values_list
 
     def get_viability_kernel(self) -> MaskNd:
-        return self.get_recent_values() >= 0
+        return self.cache.get_or_compute(len(self), 'viability_kernel', lambda: self.get_recent_values() >= 0)
+
+    def get_viability_kernel_signed_distance(self, band: Optional[float] = None, use_jax: bool = False) -> ArrayNd:
+        """
+        signed distance to the boundary of the current viability kernel (see compute_signed_distance), computed at most
+        once per iteration. with use_jax, the banded compute_signed_distance_jax field resolved up to band cells.
+        """
+        return self.cache.get_signed_distance(
+            len(self), 'viability_kernel', band, self.get_viability_kernel, use_jax=use_jax
+        )
+
+    def get_viability_kernel_boundary_by_dilation(
+            self,
+            iterations_inner: int = 1,
+            iterations_outer: int = 1,
+            iteration: Optional[int] = None
+    ) -> MaskNd:
+        """
+        dilation boundary band of the viability kernel after the given number of completed iterations (default: all of
+        them), computed at most once per iteration.
+        """
+        iteration = len(self) if iteration is None else iteration
+        return self.cache.get_or_compute(
+            iteration,
+            ('viability_kernel_boundary_by_dilation', iterations_inner, iterations_outer),
+            lambda: get_mask_boundary_by_dilation_jax(
+                self._get_values_after(iteration) >= 0, iterations_inner, iterations_outer
+            )
+        )
+
+    def _get_values_after(self, iteration: int) -> ArrayNd:
+        return self.initial_values if iteration == 0 else self.get_values(iteration - 1)
 
     def plot_value_1d(self, ref_index: ArraySlice1D):
         fig, ax = plt.subplots(figsize=(9, 7))
         ax.plot(self.grid.coordinate_vectors[ref_index.free_dim_1.dim],
                 ref_index.get_sliced_array(self.initial_values),
                 )
-        for iteration in self.iterations:
+        for iteration in range(len(self)):
             ax.plot(
                 self.grid.coordinate_vectors[ref_index.free_dim_1.dim],
-                ref_index.get_sliced_array(iteration.computed_values)
+                ref_index.get_sliced_array(self.get_values(iteration))
             )
 
         ax.set_xlabel(f'{ref_index.free_dim_1.name}')
@@ -257,7 +431,7 @@ class LocalUpdateResult:
                 levels=[0, 0.5], colors=['b'], alpha=.2
             )
 
-            values = self.initial_values if i == 0 else self.iterations[i - 1].computed_values
+            values = self._get_values_after(i)
             ax.contour(
                 self.grid.coordinate_vectors[reference_slice.free_dim_1.dim],
                 self.grid.coordinate_vectors[reference_slice.free_dim_2.dim],
@@ -303,7 +477,7 @@ class LocalUpdateResult:
         fig, ax = plt.figure(figsize=(9, 7)), plt.axes(projection='3d')
 
         def render_iteration(i: int):
-            values = self.iterations[i].computed_values
+            values = self.get_values(i)
 
             x1, x2 = np.meshgrid(
                 self.grid.coordinate_vectors[reference_slice.free_dim_1.dim],
@@ -417,7 +591,7 @@ class LocalUpdateResult:
             levels=[0, 0.5], colors=['b'], alpha=.2
         )
 
-        values = self.initial_values if iteration == 0 else self.iterations[iteration - 1].computed_values
+        values = self._get_values_after(iteration)
         ax.contour(
             self.grid.coordinate_vectors[reference_slice.free_dim_1.dim],
             self.grid.coordinate_vectors[reference_slice.free_dim_2.dim],
@@ -660,7 +834,7 @@ class LocalUpdateResult:
         if save_path is not None:
             raise NotImplementedError('saving not implemented yet')
 
-        values = self.iterations[iteration].computed_values
+        values = self.get_values(iteration)
 
         x1, x2 = np.meshgrid(
             self.grid.coordinate_vectors[reference_slice.free_dim_1.dim],
@@ -832,7 +1006,7 @@ class LocalUpdateResult:
         ax.contour(
             self.grid.coordinate_vectors[reference_slice.free_dim_1.dim],
             self.grid.coordinate_vectors[reference_slice.free_dim_2.dim],
-            reference_slice.get_sliced_array(self.iterations[iteration].computed_values).T,
+            reference_slice.get_sliced_array(self.get_values(iteration)).T,
             levels=[0], colors=['k'], alpha=.7, linestyles=['--']
         )
 
@@ -909,7 +1083,7 @@ class LocalUpdateResult:
         ax.contour(
             self.grid.coordinate_vectors[reference_slice.free_dim_1.dim],
             self.grid.coordinate_vectors[reference_slice.free_dim_2.dim],
-            reference_slice.get_sliced_array(self.iterations[iteration].computed_values).T,
+            reference_slice.get_sliced_array(self.get_values(iteration)).T,
             levels=[0], colors=['k'], alpha=.7, linestyles=['--']
         )
 
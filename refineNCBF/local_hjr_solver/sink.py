@@ -0,0 +1,148 @@
+import queue
+import threading
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import attr
+
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult
+from refineNCBF.local_hjr_solver.store import LocalUpdateResultStore, LazyIterationList
+from refineNCBF.utils.files import FilePathRelative, construct_refine_ncbf_path
+
+
+@attr.s(auto_attribs=True)
+class ResultSink(ABC):
+    """
+    receives a LocalUpdateResult as the solver produces it: start before the first iteration, write after every
+    added iteration, finish when the solve ends (also when it fails).
+    """
+    @abstractmethod
+    def start(self, result: LocalUpdateResult):
+        ...
+
+    @abstractmethod
+    def write(self, result: LocalUpdateResult):
+        ...
+
+    @abstractmethod
+    def finish(self, result: LocalUpdateResult):
+        ...
+
+
+@attr.s(auto_attribs=True)
+class NoResultSink(ResultSink):
+    @classmethod
+    def from_parts(cls):
+        return cls()
+
+    def start(self, result: LocalUpdateResult):
+        pass
+
+    def write(self, result: LocalUpdateResult):
+        pass
+
+    def finish(self, result: LocalUpdateResult):
+        pass
+
+
+@attr.s(auto_attribs=True)
+class StoreResultSink(ResultSink):
+    """
+    appends every iteration to a LocalUpdateResultStore as it is produced, so a crashed or preempted solve keeps all
+    completed iterations on disk. with background set, writes happen on a worker thread and overlap the next
+    iteration. with keep_last set, only the last keep_last iterations stay in memory; older ones are read back from
+    the store on access.
+    """
+    _store: LocalUpdateResultStore
+    _background: bool = True
+    _keep_last: Optional[int] = None
+    _include_objects: bool = True
+
+    _queue: Optional[queue.Queue] = attr.ib(default=None, repr=False)
+    _worker: Optional[threading.Thread] = attr.ib(default=None, repr=False)
+    _written_count: int = 0
+    _queued_count: int = 0
+    _error: Optional[BaseException] = attr.ib(default=None, repr=False)
+
+    @classmethod
+    def from_parts(
+            cls,
+            file_path: FilePathRelative,
+            background: bool = True,
+            keep_last: Optional[int] = None,
+            include_objects: bool = True,
+    ):
+        return cls(
+            store=LocalUpdateResultStore.from_directory(construct_refine_ncbf_path(file_path)),
+            background=background,
+            keep_last=keep_last,
+            include_objects=include_objects,
+        )
+
+    def start(self, result: LocalUpdateResult):
+        iterations = result.iterations
+        if isinstance(iterations, LazyIterationList) and iterations.store.directory == self._store.directory:
+            self._written_count = iterations.stored_count
+        else:
+            self._store.write_header(result, include_objects=self._include_objects)
+            result.iterations = LazyIterationList.from_store(self._store, 0)
+            for iteration in iterations:
+                result.iterations.append(iteration)
+            self._written_count = 0
+        self._queued_count = self._written_count
+
+        # the header (and objects.dill) is written before the worker exists, so the sink itself stays picklable
+        if self._background:
+            self._queue = queue.Queue()
+            self._worker = threading.Thread(target=self._drain_queue, daemon=True)
+            self._worker.start()
+
+        self._write_pending(result)
+
+    def write(self, result: LocalUpdateResult):
+        self._raise_worker_error()
+        self._write_pending(result)
+        self._release(result)
+
+    def finish(self, result: LocalUpdateResult):
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join()
+            self._queue, self._worker = None, None
+        self._raise_worker_error()
+        self._release(result)
+
+    def _write_pending(self, result: LocalUpdateResult):
+        for index in range(self._queued_count, len(result)):
+            job = (index, result.iterations[index], list(result.blurbs[:index + 1]))
+            if self._background:
+                self._queue.put(job)
+            else:
+                self._write_iteration(*job)
+        self._queued_count = len(result)
+
+    def _drain_queue(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            if self._error is None:
+                try:
+                    self._write_iteration(*job)
+                except BaseException as error:
+                    self._error = error
+
+    def _write_iteration(self, index: int, iteration, blurbs):
+        self._store.write_iteration(index, iteration)
+        self._store.write_progress(index + 1, blurbs)
+        self._written_count = index + 1
+
+    def _release(self, result: LocalUpdateResult):
+        result.iterations.mark_stored(self._written_count)
+        if self._keep_last is not None:
+            result.iterations.release(self._keep_last)
+
+    def _raise_worker_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f'writing to {self._store.directory} failed') from error
@@ -1,27 +1,43 @@
 import logging
 import time
-from typing import Callable, Union, Optional
+from typing import Callable, Union, Optional, Tuple
 
 import attr
+import jax
 import numpy as np
+from jax import numpy as jnp
 
 import hj_reachability
+from refineNCBF.hj_reachability_interface.hj_step import NARROW_BAND_GHOST_CELLS
 from refineNCBF.local_hjr_solver.breaker import BreakCriteriaChecker, MaxIterations, PostFilteredActiveSetEmpty, \
     BarrierNotMarching
+from refineNCBF.local_hjr_solver.disk_cache import LocalUpdateResultDiskCache
 from refineNCBF.local_hjr_solver.expand import NeighborExpander, SignedDistanceNeighbors, \
     InnerSignedDistanceNeighbors, \
     SignedDistanceNeighborsNearBoundary, SignedDistanceNeighborsNearBoundaryDilation
+from refineNCBF.local_hjr_solver.metrics import MetricsExporter, NoMetricsExporter, SolverMetrics, IterationTimer
 from refineNCBF.local_hjr_solver.postfilter import ActiveSetPostFilter, RemoveWhereUnchanged, \
     RemoveWhereNonNegativeHamiltonian
 from refineNCBF.local_hjr_solver.prefilter import ActiveSetPreFilter, NoPreFilter, PreFilterWhereFarFromZeroLevelset, \
     PreFilterWhereOutsideZeroLevelset, PreFilterWhereFarFromBoundarySplit
 from refineNCBF.local_hjr_solver.result import LocalUpdateResult, LocalUpdateResultIteration
-from refineNCBF.local_hjr_solver.step_hj import LocalHjrStepper, ClassicLocalHjrStepper, DecreaseLocalHjrStepper
+from refineNCBF.local_hjr_solver.sink import ResultSink, NoResultSink
+from refineNCBF.local_hjr_solver.step_hj import LocalHjrStepper, ClassicLocalHjrStepper, DecreaseLocalHjrStepper, HjReachabilityLocalHjrStepper
 from refineNCBF.local_hjr_solver.step_odp_type import OdpStepper
+from refineNCBF.local_hjr_solver.step_blocks import BlockSparseLocalHjrStepper
+from refineNCBF.local_hjr_solver.step_tiled import TiledLocalHjrStepper
+from refineNCBF.local_hjr_solver.time_step import TimeStepPolicy
 from refineNCBF.optimized_dp_interface.odp_dynamics import OdpDynamics
+from refineNCBF.utils.files import FilePathRelative
+from refineNCBF.utils.hashing import fingerprint
 from refineNCBF.utils.types import MaskNd, ArrayNd
 from refineNCBF.utils.visuals import make_configured_logger
 
+# solver fields that do not change the result of a solve
+_RESULT_CACHE_IGNORED_FIELDS = (
+    '_preloaded_result', '_result_sink', '_metrics_exporter', '_result_cache', '_verbose', '_logger'
+)
+
 
 @attr.s(auto_attribs=True)
 class LocalHjrSolver(Callable):
@@ -52,25 +68,84 @@ class LocalHjrSolver(Callable):
 
     _preloaded_result: Optional[LocalUpdateResult] = None
 
+    _keyframe_interval: Optional[int] = None
+    _compact_masks: bool = False
+    _result_sink: ResultSink = attr.Factory(NoResultSink)
+    _metrics_exporter: Optional[MetricsExporter] = None
+    _result_cache: Optional[LocalUpdateResultDiskCache] = None
+
     _verbose: bool = False
     _logger: logging.Logger = make_configured_logger(__name__)
 
     def __call__(self, active_set: MaskNd, initial_values: ArrayNd) -> LocalUpdateResult:
+        if self._result_cache is None or self._preloaded_result is not None:
+            return self._solve(active_set, initial_values)
+
+        key = self.get_result_cache_key(active_set, initial_values)
+        result = self._result_cache.load(key)
+        if result is not None:
+            if self._verbose:
+                self._logger.info(f'loaded result from cache entry {key}')
+            return self._attach_result(result)
+
+        result = self._solve(active_set, initial_values)
+        self._result_cache.save(key, result)
+        return result
+
+    def get_result_cache_key(self, active_set: MaskNd, initial_values: ArrayNd) -> str:
+        """
+        content hash of everything that determines the result of a solve: the solver type, dynamics, grid, problem
+        arrays and component settings, plus active_set and initial_values. result sinks, metrics and verbosity do not
+        change the result, so they are left out.
+        """
+        settings = [
+            getattr(self, field.name) for field in attr.fields(type(self))
+            if field.name not in _RESULT_CACHE_IGNORED_FIELDS
+        ]
+        return fingerprint(type(self), settings, active_set, initial_values)
+
+    def _solve(self, active_set: MaskNd, initial_values: ArrayNd) -> LocalUpdateResult:
         start_time = time.time()
         local_update_result = self._initialize_local_result(active_set, initial_values)
-        while True:
-            iteration = self._perform_local_update_iteration(local_update_result)
-            max_diff = local_update_result.max_diff()
-            cells_updated = local_update_result.get_recent_set_for_compute().sum()
-            share = cells_updated / self._avoid_set.size
-            blurb = f'iteration {len(local_update_result)} complete, \trunning duration is {(time.time() - start_time):.2f} seconds, \tcomputed over {cells_updated} of {self._avoid_set.size} cells ({(share * 100):.2f}%), \tmax diff: {max_diff:.2f}'
-            local_update_result.add_iteration(iteration, blurb)
-            if self._verbose:
-                self._logger.info(blurb)
-            if self._check_for_break(local_update_result):
-                break
+        self._result_sink.start(local_update_result)
+        try:
+            while True:
+                timer = self._make_iteration_timer(local_update_result)
+                iteration = self._perform_local_update_iteration(local_update_result, timer)
+                timer.time('record', self._record_iteration, local_update_result, iteration, start_time)
+                should_break = timer.time('break_check', self._check_for_break, local_update_result)
+                self._record_metrics(local_update_result, timer)
+                if should_break:
+                    break
+        finally:
+            self._result_sink.finish(local_update_result)
         return local_update_result
 
+    def _record_iteration(self, result: LocalUpdateResult, iteration: LocalUpdateResultIteration, start_time: float):
+        blurb = self._make_blurb(result, start_time)
+        result.add_iteration(iteration, blurb)
+        self._result_sink.write(result)
+        if self._verbose:
+            self._logger.info(blurb)
+
+    def _make_iteration_timer(self, result: LocalUpdateResult) -> IterationTimer:
+        if self._metrics_exporter is not None and result.metrics is None:
+            result.metrics = SolverMetrics()
+        return IterationTimer.from_parts(enabled=self._metrics_exporter is not None)
+
+    def _record_metrics(self, result: LocalUpdateResult, timer: IterationTimer):
+        if self._metrics_exporter is None:
+            return
+        iteration_metrics = timer.finish(result)
+        result.metrics.add(iteration_metrics)
+        self._metrics_exporter(iteration_metrics)
+
+    def _make_blurb(self, result: LocalUpdateResult, start_time: float) -> str:
+        max_diff = result.max_diff()
+        cells_updated = result.get_recent_set_for_compute().sum()
+        share = cells_updated / self._avoid_set.size
+        return f'iteration {len(result)} complete, \trunning duration is {(time.time() - start_time):.2f} seconds, \tcomputed over {cells_updated} of {self._avoid_set.size} cells ({(share * 100):.2f}%), \tmax diff: {max_diff:.2f}'
+
     def _initialize_local_result(self, active_set: MaskNd, initial_values: ArrayNd) -> LocalUpdateResult:
         if self._preloaded_result is None:
             return LocalUpdateResult.from_parts(
@@ -81,30 +156,35 @@ class LocalHjrSolver(Callable):
                 reach_set=self._reach_set,
                 seed_set=active_set,
                 initial_values=initial_values,
-                terminal_values=self._terminal_values
+                terminal_values=self._terminal_values,
+                keyframe_interval=self._keyframe_interval,
+                compact_masks=self._compact_masks
             )
         else:
             return self._preloaded_result
 
-    def _perform_local_update_iteration(self, result: LocalUpdateResult):
-        active_set_pre_filtered = self._active_set_pre_filter(
-            result
+    def _perform_local_update_iteration(self, result: LocalUpdateResult, timer: IterationTimer):
+        active_set_pre_filtered = timer.time(
+            'pre_filter', self._active_set_pre_filter, result
         )
-        active_set_expanded = self._neighbor_expander(
-            result, active_set_pre_filtered
+        active_set_expanded = timer.time(
+            'expand', self._neighbor_expander, result, active_set_pre_filtered
         )
-        values_next = self._local_hjr_stepper(
-            result, active_set_pre_filtered, active_set_expanded
+        values_next = timer.time(
+            'step', self._local_hjr_stepper, result, active_set_pre_filtered, active_set_expanded
         )
-        active_set_post_filtered = self._active_set_post_filter(
-            result, active_set_pre_filtered, active_set_expanded, values_next
+        active_set_post_filtered = timer.time(
+            'post_filter', self._active_set_post_filter, result, active_set_pre_filtered, active_set_expanded,
+            values_next
         )
+        time_step = self._local_hjr_stepper.get_time_step(result, active_set_expanded)
 
         return LocalUpdateResultIteration.from_parts(
             active_set_pre_filtered=active_set_pre_filtered,
             active_set_expanded=active_set_expanded,
             values_next=values_next,
             active_set_post_filtered=active_set_post_filtered,
+            time_step=None if time_step is None else float(time_step),
         )
 
     def _check_for_break(self, result: LocalUpdateResult):
@@ -125,6 +205,10 @@ class LocalHjrSolver(Callable):
             postfilter: ActiveSetPostFilter,
             breaker: BreakCriteriaChecker,
 
+            keyframe_interval: Optional[int] = None,
+            compact_masks: bool = False,
+            result_sink: Optional[ResultSink] = None,
+            metrics_exporter: Optional[MetricsExporter] = None,
             verbose: bool = False,
     ):
         return cls(
@@ -138,15 +222,170 @@ class LocalHjrSolver(Callable):
             local_hjr_stepper=stepper,
             active_set_post_filter=postfilter,
             break_criteria_checker=breaker,
+            keyframe_interval=keyframe_interval,
+            compact_masks=compact_masks,
+            result_sink=NoResultSink.from_parts() if result_sink is None else result_sink,
+            metrics_exporter=metrics_exporter,
             verbose=verbose,
         )
 
+    def with_keyframe_interval(self, keyframe_interval: Optional[int]) -> "LocalHjrSolver":
+        """
+        copy of this solver whose results keep dense values only every keyframe_interval iterations and sparse deltas
+        in between (None keeps every iteration dense).
+        """
+        return attr.evolve(self, keyframe_interval=keyframe_interval)
+
+    def with_compact_masks(self, compact_masks: bool = True) -> "LocalHjrSolver":
+        """
+        copy of this solver whose results keep seed, avoid and active sets as bit-packed or sparse CompactMasks.
+        """
+        return attr.evolve(self, compact_masks=compact_masks)
+
+    def with_result_sink(self, result_sink: ResultSink) -> "LocalHjrSolver":
+        """
+        copy of this solver that hands its result to result_sink as iterations are produced, e.g. a StoreResultSink
+        to checkpoint a long solve to disk.
+        """
+        return attr.evolve(self, result_sink=result_sink)
+
+    def with_time_step_policy(self, time_step_policy: Optional[TimeStepPolicy]) -> "LocalHjrSolver":
+        """
+        copy of this solver whose stepper chooses each iteration's time step with time_step_policy (None goes back to
+        the fixed time step). the chosen steps are recorded on the result's iterations.
+        """
+        assert isinstance(self._local_hjr_stepper, HjReachabilityLocalHjrStepper), \
+            "only the classic and decrease steppers support time step policies"
+        return attr.evolve(
+            self,
+            local_hjr_stepper=attr.evolve(self._local_hjr_stepper, time_step_policy=time_step_policy)
+        )
+
+    def with_tiles(
+            self,
+            tile_shape: Tuple[int, ...],
+            halo_cells: Optional[int] = None,
+            max_workers: Optional[int] = None
+    ) -> "LocalHjrSolver":
+        """
+        copy of this solver whose stepper is domain-decomposed into tiles of tile_shape, stepped in parallel by
+        max_workers processes (see TiledLocalHjrStepper). the halo defaults to, and must be at least, the neighbor
+        expander's distance plus the stencil (see get_min_halo_cells).
+        """
+        return attr.evolve(
+            self,
+            local_hjr_stepper=TiledLocalHjrStepper.from_parts(
+                stepper=self._local_hjr_stepper,
+                grid=self._grid,
+                tile_shape=tile_shape,
+                halo_cells=self._get_halo_cells(halo_cells),
+                max_workers=max_workers,
+            )
+        )
+
+    def with_blocks(
+            self,
+            block_shape: Tuple[int, ...],
+            halo_cells: Optional[int] = None
+    ) -> "LocalHjrSolver":
+        """
+        copy of this solver whose stepper only steps the blocks of block_shape that the expanded active set touches,
+        batched into one call (see BlockSparseLocalHjrStepper). halos are sized as in with_tiles.
+        """
+        return attr.evolve(
+            self,
+            local_hjr_stepper=BlockSparseLocalHjrStepper.from_parts(
+                stepper=self._local_hjr_stepper,
+                grid=self._grid,
+                block_shape=block_shape,
+                halo_cells=self._get_halo_cells(halo_cells),
+            )
+        )
+
+    def get_min_halo_cells(self) -> Optional[int]:
+        """
+        smallest halo a tile or block needs around its core: the distance the neighbor expander activates cells at,
+        plus the stencil. None if the expander does not bound that distance.
+        """
+        neighbor_cells = self._neighbor_expander.get_neighbor_cells()
+        if neighbor_cells is None:
+            return None
+        return neighbor_cells + NARROW_BAND_GHOST_CELLS
+
+    def _get_halo_cells(self, halo_cells: Optional[int]) -> int:
+        min_halo_cells = self.get_min_halo_cells()
+        if halo_cells is None:
+            assert min_halo_cells is not None, \
+                "the neighbor expander does not bound its distance, halo_cells must be given"
+            return min_halo_cells
+        assert min_halo_cells is None or halo_cells >= min_halo_cells, \
+            f"halo_cells must be at least {min_halo_cells}, the neighbor distance plus the stencil"
+        return halo_cells
+
+    def with_result_cache(self, result_cache: Optional[LocalUpdateResultDiskCache]) -> "LocalHjrSolver":
+        """
+        copy of this solver that returns the cached result of an identical earlier solve (see get_result_cache_key)
+        instead of solving, and caches the results it does solve. continued and resumed solves bypass the cache.
+        """
+        return attr.evolve(self, result_cache=result_cache)
+
+    def with_metrics(self, metrics_exporter: Optional[MetricsExporter] = None) -> "LocalHjrSolver":
+        """
+        copy of this solver that times every stage of every iteration into result.metrics and hands each iteration's
+        metrics to metrics_exporter. timing synchronizes with the device after each stage, so it costs some overlap.
+        """
+        return attr.evolve(
+            self,
+            metrics_exporter=NoMetricsExporter.from_parts() if metrics_exporter is None else metrics_exporter
+        )
+
     @classmethod
     def as_continue(cls, previous_result: LocalUpdateResult):
-        previous_solver = LocalUpdateResult.local_solver
+        """
+        solver that continues previous_result with the solver that produced it. results of odp steppers do not keep
+        their solver, use resume on an equivalently configured solver instead.
+        """
+        previous_solver = previous_result.local_solver
+        assert previous_solver is not None, "result does not keep its solver (e.g. odp stepper), use resume instead"
         previous_solver._preloaded_result = previous_result
         return previous_solver
 
+    def resume(self, checkpoint_path: FilePathRelative) -> LocalUpdateResult:
+        """
+        continues a solve from the last iteration persisted at checkpoint_path (a result store, e.g. written by a
+        StoreResultSink, or a dill file), starting from its exact values and pending seed set. this solver must be set
+        up like the one that wrote the checkpoint. only arrays are read back, so this works for odp steppers too. if
+        this solver's sink writes to the same store, it keeps appending to it.
+        """
+        result = self._attach_result(LocalUpdateResult.load(checkpoint_path, load_objects=False))
+        resumed_solver = attr.evolve(self, preloaded_result=result)
+        if len(result) > 0 and resumed_solver._check_for_break(result):
+            return result
+        return resumed_solver(active_set=result.seed_set, initial_values=result.initial_values)
+
+    def _attach_result(self, result: LocalUpdateResult) -> LocalUpdateResult:
+        """
+        attaches this solver and its dynamics to a result loaded without objects, and loads its most recent values.
+        """
+        is_odp = isinstance(self._local_hjr_stepper, OdpStepper)
+        result.local_solver = None if is_odp else self
+        result.dynamics = None if is_odp else self._dynamics
+        if len(result) > 0:
+            recent_values = result.get_values(-1)
+            result.recent_values = np.array(recent_values) if is_odp else jnp.asarray(recent_values)
+        return result
+
+    def warm_up(self, dtype=None) -> "LocalHjrSolver":
+        """
+        compiles the stepper's step ahead of the first solve for this solver's grid shape and a values dtype (by
+        default the terminal values' dtype), lowered on abstract arrays without running it (see
+        LocalHjrStepper.warm_up). with enable_compilation_cache, the executable is also persisted for later processes.
+        returns this solver.
+        """
+        dtype = jnp.asarray(self._terminal_values, dtype=dtype).dtype
+        self._local_hjr_stepper.warm_up(jax.ShapeDtypeStruct(self._grid.shape, dtype))
+        return self
+
     @classmethod
     def as_global_solver(
             cls,
@@ -223,6 +462,7 @@ class LocalHjrSolver(Callable):
             value_change_atol: float = 1e-3,
             value_change_rtol: float = 1e-3,
             max_iterations: int = 100,
+            narrow_band: bool = False,
 
             verbose: bool = False,
     ):
@@ -242,7 +482,8 @@ class LocalHjrSolver(Callable):
             grid=grid,
             terminal_values=terminal_values,
             time_step=solver_timestep,
-            verbose=verbose
+            verbose=verbose,
+            narrow_band=narrow_band,
         )
         active_set_post_filter = RemoveWhereUnchanged.from_parts(
             atol=value_change_atol,
@@ -285,6 +526,7 @@ class LocalHjrSolver(Callable):
             solver_timestep: float = -0.1,
             hamiltonian_atol: float = 1e-3,
             max_iterations: int = 100,
+            narrow_band: bool = False,
 
             verbose: bool = False,
     ):
@@ -311,7 +553,8 @@ class LocalHjrSolver(Callable):
             grid=grid,
             terminal_values=terminal_values,
             time_step=solver_timestep,
-            verbose=verbose
+            verbose=verbose,
+            narrow_band=narrow_band,
         )
         active_set_post_filter = RemoveWhereNonNegativeHamiltonian.from_parts(
             hamiltonian_atol=hamiltonian_atol
@@ -0,0 +1,130 @@
+import logging
+import time
+from typing import Callable, List, Optional
+
+import attr
+import jax
+import numpy as np
+from jax import numpy as jnp
+
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult, LocalUpdateResultIteration
+from refineNCBF.local_hjr_solver.solve_compiled import CompiledLocalHjrSolver, CompiledIterationCarry, \
+    run_compiled_iterations_batched
+from refineNCBF.local_hjr_solver.step_hj import HjReachabilityLocalHjrStepper
+from refineNCBF.utils.types import MaskNd, ArrayNd
+from refineNCBF.utils.visuals import make_configured_logger
+
+
+@attr.s(auto_attribs=True)
+class BatchedLocalHjrSolver(Callable):
+    """
+    solves a batch of problems that share the dynamics, grid and configuration of a CompiledLocalHjrSolver, but each
+    have their own terminal values, avoid set and reach set (stacked along a leading member axis). the members still
+    running are advanced together: the compiled iteration loop is vmapped over them, for up to iterations_per_record
+    iterations per call. every member has its own break status; a member that breaks stops changing within the call and
+    is dropped from the batch after it, so later calls only carry the members still running. the batch is padded to a
+    power of two (repeating a member), so the loop compiles once per batch size bucket.
+
+    returns one result per member, as the member's own solver (get_member_solver) would have produced it. the result
+    sink and metrics of the solver are not used.
+    """
+    _solver: CompiledLocalHjrSolver
+    _avoid_sets: MaskNd
+    _reach_sets: MaskNd
+    _terminal_values: ArrayNd
+
+    _verbose: bool = False
+    _logger: logging.Logger = make_configured_logger(__name__)
+
+    def __attrs_post_init__(self):
+        assert isinstance(self._solver._local_hjr_stepper, HjReachabilityLocalHjrStepper), \
+            "only the classic and decrease steppers can be batched"
+        assert self._avoid_sets.shape == self._reach_sets.shape == self._terminal_values.shape, \
+            "avoid sets, reach sets and terminal values must be stacked alike"
+
+    @classmethod
+    def from_parts(
+            cls,
+            solver: CompiledLocalHjrSolver,
+            avoid_sets: MaskNd,
+            terminal_values: ArrayNd,
+            reach_sets: Optional[MaskNd] = None,
+            verbose: bool = False,
+    ):
+        return cls(
+            solver=solver,
+            avoid_sets=np.asarray(avoid_sets, dtype=bool),
+            reach_sets=np.zeros_like(avoid_sets, dtype=bool) if reach_sets is None else np.asarray(reach_sets, bool),
+            terminal_values=jnp.asarray(terminal_values),
+            verbose=verbose,
+        )
+
+    def __len__(self):
+        return len(self._terminal_values)
+
+    def get_member_solver(self, member: int) -> CompiledLocalHjrSolver:
+        return attr.evolve(
+            self._solver,
+            avoid_set=self._avoid_sets[member],
+            reach_set=self._reach_sets[member],
+            terminal_values=self._terminal_values[member],
+            local_hjr_stepper=self._solver._local_hjr_stepper.with_terminal_values(self._terminal_values[member]),
+        )
+
+    def __call__(self, seed_sets: MaskNd, initial_values: ArrayNd) -> List[LocalUpdateResult]:
+        start_time = time.time()
+        member_solvers = [self.get_member_solver(member) for member in range(len(self))]
+        results = [
+            member_solver._initialize_local_result(seed_set, member_initial_values)
+            for member_solver, seed_set, member_initial_values in zip(member_solvers, seed_sets, initial_values)
+        ]
+        carries = jax.tree_util.tree_map(
+            lambda *members: jnp.stack(members),
+            *[member_solver._initialize_carry(result) for member_solver, result in zip(member_solvers, results)]
+        )
+
+        running = np.arange(len(self))
+        while len(running) > 0:
+            bucket_size = min(1 << (len(running) - 1).bit_length(), len(self))
+            batch_members = np.pad(running, (0, bucket_size - len(running)), mode='edge')
+            batch = jax.tree_util.tree_map(lambda member_values: member_values[batch_members], carries)
+            batch = run_compiled_iterations_batched(
+                self._solver._iteration_components,
+                batch._replace(iterations_since_record=jnp.zeros(bucket_size, dtype=batch.iteration.dtype)),
+                self._terminal_values[batch_members],
+                self._solver._local_hjr_stepper.get_dynamics_table(),
+            )
+            carries = jax.tree_util.tree_map(
+                lambda member_values, batch_values: member_values.at[running].set(batch_values[:len(running)]),
+                carries,
+                batch
+            )
+
+            for index, member in enumerate(running):
+                self._record_member_iteration(results[member], member_solvers[member], batch, index, start_time)
+            done = np.asarray(batch.done[:len(running)])
+            if self._verbose:
+                self._logger.info(
+                    f'{len(running)} of {len(self)} members advanced to iteration {int(batch.iteration.max())}, '
+                    f'{int(done.sum())} converged, \trunning duration is {(time.time() - start_time):.2f} seconds'
+                )
+            running = running[~done]
+        return results
+
+    @staticmethod
+    def _record_member_iteration(
+            result: LocalUpdateResult,
+            member_solver: CompiledLocalHjrSolver,
+            batch: CompiledIterationCarry,
+            index: int,
+            start_time: float
+    ):
+        iteration = LocalUpdateResultIteration.from_parts(
+            active_set_pre_filtered=batch.active_set_pre_filtered[index],
+            active_set_expanded=batch.active_set_expanded[index],
+            values_next=batch.values[index],
+            active_set_post_filtered=batch.pending_seed_set[index],
+            time_step=float(batch.time_step[index]),
+            iteration_count=int(batch.iteration[index]),
+        )
+        result.add_iteration(iteration, member_solver._make_blurb(result, start_time))
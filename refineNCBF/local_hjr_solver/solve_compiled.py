@@ -0,0 +1,446 @@
+import functools
+import time
+from typing import NamedTuple, Optional
+
+import attr
+import jax
+import numpy as np
+from jax import numpy as jnp
+
+import hj_reachability
+from refineNCBF.hj_reachability_interface.hj_dynamics import DynamicsTable
+from refineNCBF.local_hjr_solver.breaker import BreakCriteriaChecker, MaxIterations, PostFilteredActiveSetEmpty, \
+    BarrierNotMarching
+from refineNCBF.local_hjr_solver.expand import CompiledNeighborExpander, DilationNeighbors, \
+    SignedDistanceNeighborsNearBoundaryDilation
+from refineNCBF.local_hjr_solver.postfilter import CompiledActiveSetPostFilter, RemoveWhereUnchanged, \
+    RemoveWhereNonNegativeHamiltonian
+from refineNCBF.local_hjr_solver.prefilter import CompiledActiveSetPreFilter, NoPreFilter, \
+    PreFilterWhereFarFromBoundarySplitDilation
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult, LocalUpdateResultIteration
+from refineNCBF.local_hjr_solver.solve import LocalHjrSolver
+from refineNCBF.local_hjr_solver.step_hj import CompiledLocalHjrStepper, ClassicLocalHjrStepper, \
+    DecreaseLocalHjrStepper
+from refineNCBF.utils.hashing import fingerprint
+from refineNCBF.utils.types import MaskNd, ArrayNd
+
+
+class CompiledIterationCarry(NamedTuple):
+    values: ArrayNd
+    previous_values: ArrayNd
+    pending_seed_set: MaskNd
+    active_set_pre_filtered: MaskNd
+    active_set_expanded: MaskNd
+    iteration: ArrayNd
+    iterations_since_record: ArrayNd
+    done: ArrayNd
+    time_step: ArrayNd
+
+
+@attr.s(auto_attribs=True, eq=False)
+class CompiledIterationComponents:
+    """
+    the components of a compiled solver iteration, without the arrays that differ between problems (the stepper's
+    terminal values and dynamics table), which the jitted iteration loop takes as operands instead. this is the loop's
+    static argument: components with the same fingerprint compare equal, so solvers that only differ in those arrays
+    share one compiled loop. components that cannot be fingerprinted are only equal to themselves.
+    """
+    _active_set_pre_filter: CompiledActiveSetPreFilter
+    _neighbor_expander: CompiledNeighborExpander
+    _local_hjr_stepper: CompiledLocalHjrStepper
+    _active_set_post_filter: CompiledActiveSetPostFilter
+    _break_criteria_checker: BreakCriteriaChecker
+    _iterations_per_record: int
+    _key: Optional[str] = attr.ib(default=None, repr=False)
+
+    @classmethod
+    def from_solver(cls, solver: "CompiledLocalHjrSolver"):
+        return cls(
+            active_set_pre_filter=solver._active_set_pre_filter,
+            neighbor_expander=solver._neighbor_expander,
+            local_hjr_stepper=solver._local_hjr_stepper.with_terminal_values(None).with_dynamics_table(None),
+            active_set_post_filter=solver._active_set_post_filter,
+            break_criteria_checker=solver._break_criteria_checker,
+            iterations_per_record=solver._iterations_per_record,
+        )
+
+    def __hash__(self):
+        return hash(self._get_key())
+
+    def __eq__(self, other):
+        return isinstance(other, CompiledIterationComponents) and self._get_key() == other._get_key()
+
+    def _get_key(self) -> str:
+        if self._key is None:
+            try:
+                self._key = fingerprint(self)
+            except TypeError:
+                self._key = f'id:{id(self)}'
+        return self._key
+
+    def run_iterations(
+            self,
+            carry: CompiledIterationCarry,
+            terminal_values: Optional[ArrayNd],
+            dynamics_table: Optional[DynamicsTable]
+    ) -> CompiledIterationCarry:
+        stepper = self._local_hjr_stepper.with_terminal_values(terminal_values).with_dynamics_table(dynamics_table)
+        return jax.lax.while_loop(
+            lambda loop_carry: ~loop_carry.done & (loop_carry.iterations_since_record < self._iterations_per_record),
+            lambda loop_carry: self._perform_iteration(stepper, loop_carry),
+            carry
+        )
+
+    def _perform_iteration(
+            self,
+            stepper: CompiledLocalHjrStepper,
+            carry: CompiledIterationCarry
+    ) -> CompiledIterationCarry:
+        active_set_pre_filtered = self._active_set_pre_filter.compute(
+            carry.values, carry.pending_seed_set, carry.iteration
+        )
+        active_set_expanded = self._neighbor_expander.compute(
+            carry.values, active_set_pre_filtered, carry.iteration
+        )
+        time_step = stepper.compute_time_step(
+            carry.values, active_set_expanded
+        )
+        values_next = stepper.compute(
+            carry.values, active_set_expanded, time_step
+        )
+        active_set_post_filtered = self._active_set_post_filter.compute(
+            carry.values, active_set_expanded, values_next
+        )
+        iteration = carry.iteration + 1
+        done = self._break_criteria_checker.compute(
+            iteration, values_next, carry.values, active_set_post_filtered
+        )
+
+        return CompiledIterationCarry(
+            values=values_next,
+            previous_values=carry.values,
+            pending_seed_set=active_set_post_filtered,
+            active_set_pre_filtered=active_set_pre_filtered,
+            active_set_expanded=active_set_expanded,
+            iteration=iteration,
+            iterations_since_record=carry.iterations_since_record + 1,
+            done=done,
+            time_step=jnp.asarray(time_step, dtype=carry.time_step.dtype),
+        )
+
+
+@functools.partial(jax.jit, static_argnames=('components',))
+def run_compiled_iterations(
+        components: CompiledIterationComponents,
+        carry: CompiledIterationCarry,
+        terminal_values: Optional[ArrayNd],
+        dynamics_table: Optional[DynamicsTable]
+) -> CompiledIterationCarry:
+    """
+    runs the compiled iteration loop until it breaks or records, i.e. for up to iterations_per_record iterations.
+    """
+    return components.run_iterations(carry, terminal_values, dynamics_table)
+
+
+@functools.partial(jax.jit, static_argnames=('components',))
+def run_compiled_iterations_batched(
+        components: CompiledIterationComponents,
+        carry: CompiledIterationCarry,
+        terminal_values: ArrayNd,
+        dynamics_table: Optional[DynamicsTable]
+) -> CompiledIterationCarry:
+    """
+    run_compiled_iterations vmapped over a batch of carries and terminal values, stacked along their leading axis.
+    """
+    return jax.vmap(components.run_iterations, in_axes=(0, 0, None))(carry, terminal_values, dynamics_table)
+
+
+@attr.s(auto_attribs=True)
+class CompiledLocalHjrSolver(LocalHjrSolver):
+    """
+    runs the same loop as LocalHjrSolver, but runs up to iterations_per_record iterations as one jitted
+    lax.while_loop, with values and masks kept on device. the host only syncs when an iteration is recorded, so with
+    iterations_per_record > 1 only every n-th iteration (and the last one) appears in the result. solvers that only
+    differ in their terminal values or dynamics table share one compiled loop (see CompiledIterationComponents).
+
+    all components must be the compiled (jax-native) variants, and the stepper must not use narrow-band mode.
+    with metrics enabled, the stages of an iteration run fused on device, so they are timed together as
+    compiled_iterations (including the break check).
+    """
+    _iterations_per_record: int = 1
+
+    def __attrs_post_init__(self):
+        assert isinstance(self._active_set_pre_filter, CompiledActiveSetPreFilter), \
+            "pre-filter must be a CompiledActiveSetPreFilter"
+        assert isinstance(self._neighbor_expander, CompiledNeighborExpander), \
+            "neighbor expander must be a CompiledNeighborExpander"
+        assert isinstance(self._local_hjr_stepper, CompiledLocalHjrStepper), \
+            "stepper must be a CompiledLocalHjrStepper"
+        assert isinstance(self._active_set_post_filter, CompiledActiveSetPostFilter), \
+            "post-filter must be a CompiledActiveSetPostFilter"
+        assert self._iterations_per_record >= 1, "iterations_per_record must be at least 1"
+        self._iteration_components = CompiledIterationComponents.from_solver(self)
+
+    def _solve(self, active_set: MaskNd, initial_values: ArrayNd) -> LocalUpdateResult:
+        start_time = time.time()
+        local_update_result = self._initialize_local_result(active_set, initial_values)
+        carry = self._initialize_carry(local_update_result)
+        self._result_sink.start(local_update_result)
+        try:
+            while True:
+                timer = self._make_iteration_timer(local_update_result)
+                carry = timer.time(
+                    'compiled_iterations',
+                    run_compiled_iterations,
+                    self._iteration_components,
+                    carry._replace(iterations_since_record=jnp.zeros_like(carry.iteration)),
+                    self._local_hjr_stepper.get_terminal_values(),
+                    self._local_hjr_stepper.get_dynamics_table(),
+                )
+                iteration = LocalUpdateResultIteration.from_parts(
+                    active_set_pre_filtered=carry.active_set_pre_filtered,
+                    active_set_expanded=carry.active_set_expanded,
+                    values_next=carry.values,
+                    active_set_post_filtered=carry.pending_seed_set,
+                    time_step=float(carry.time_step),
+                    iteration_count=int(carry.iteration),
+                )
+                timer.time('record', self._record_iteration, local_update_result, iteration, start_time)
+                self._record_metrics(local_update_result, timer)
+                if bool(carry.done):
+                    break
+        finally:
+            self._result_sink.finish(local_update_result)
+        return local_update_result
+
+    def warm_up(self, dtype=None) -> "CompiledLocalHjrSolver":
+        """
+        compiles the jitted iteration loop ahead of time for this solver's grid shape and a values dtype (by default
+        the terminal values' dtype), lowered on an abstract carry without running it.
+        """
+        values = jax.ShapeDtypeStruct(self._grid.shape, jnp.asarray(self._terminal_values, dtype=dtype).dtype)
+        carry = jax.eval_shape(
+            self._make_carry, values, values, jax.ShapeDtypeStruct(self._grid.shape, bool), jnp.array(0)
+        )
+        run_compiled_iterations.lower(
+            self._iteration_components,
+            carry,
+            self._local_hjr_stepper.get_terminal_values(),
+            self._local_hjr_stepper.get_dynamics_table(),
+        ).compile()
+        return self
+
+    def _initialize_carry(self, result: LocalUpdateResult) -> CompiledIterationCarry:
+        return self._make_carry(
+            jnp.asarray(result.get_recent_values()),
+            jnp.asarray(result.get_previous_values()),
+            jnp.asarray(result.get_pending_seed_set()),
+            jnp.array(result.get_iteration_count()),
+        )
+
+    def _make_carry(
+            self,
+            values: ArrayNd,
+            previous_values: ArrayNd,
+            pending_seed_set: MaskNd,
+            iteration: ArrayNd
+    ) -> CompiledIterationCarry:
+        return CompiledIterationCarry(
+            values=values,
+            previous_values=previous_values,
+            pending_seed_set=pending_seed_set,
+            active_set_pre_filtered=jnp.zeros_like(pending_seed_set, dtype=bool),
+            active_set_expanded=jnp.zeros_like(pending_seed_set, dtype=bool),
+            iteration=jnp.asarray(iteration, dtype=int),
+            iterations_since_record=jnp.zeros((), dtype=int),
+            done=jnp.array(False),
+            time_step=jnp.asarray(self._local_hjr_stepper.compute_time_step(values, pending_seed_set), dtype=float),
+        )
+
+    @classmethod
+    def as_global_solver(
+            cls,
+            dynamics: hj_reachability.Dynamics,
+            grid: hj_reachability.Grid,
+            avoid_set: MaskNd,
+            reach_set: MaskNd,
+            terminal_values: ArrayNd,
+
+            solver_timestep: float = -0.1,
+            max_iterations: int = 100,
+            change_fraction: float = 1,
+            atol: float = 1e-3,
+            rtol: float = 1e-3,
+            iterations_per_record: int = 1,
+
+            verbose: bool = False,
+    ):
+        """
+        compiled counterpart of LocalHjrSolver.as_global_solver.
+        """
+        active_set_pre_filter = NoPreFilter.from_parts(
+        )
+        neighbor_expander = DilationNeighbors.from_parts(
+            distance=np.inf
+        )
+        local_hjr_stepper = ClassicLocalHjrStepper.from_parts(
+            dynamics=dynamics,
+            grid=grid,
+            terminal_values=terminal_values,
+            time_step=solver_timestep,
+            verbose=verbose
+        )
+        active_set_post_filter = RemoveWhereUnchanged.from_parts(
+            atol=atol,
+            rtol=rtol,
+        )
+        break_criteria_checker = BreakCriteriaChecker.from_criteria(
+            [
+                MaxIterations.from_parts(max_iterations=max_iterations),
+                PostFilteredActiveSetEmpty.from_parts(),
+                BarrierNotMarching.from_parts(change_fraction=change_fraction)
+            ],
+            verbose=verbose
+        )
+
+        return cls(
+            dynamics=dynamics,
+            grid=grid,
+            avoid_set=avoid_set,
+            reach_set=reach_set,
+            terminal_values=terminal_values,
+            active_set_pre_filter=active_set_pre_filter,
+            neighbor_expander=neighbor_expander,
+            local_hjr_stepper=local_hjr_stepper,
+            active_set_post_filter=active_set_post_filter,
+            break_criteria_checker=break_criteria_checker,
+            verbose=verbose,
+            iterations_per_record=iterations_per_record,
+        )
+
+    @classmethod
+    def as_local_solver(
+            cls,
+            dynamics: hj_reachability.Dynamics,
+            grid: hj_reachability.Grid,
+            avoid_set: MaskNd,
+            reach_set: MaskNd,
+            terminal_values: ArrayNd,
+
+            neighbor_distance: float = 2,
+            solver_timestep: float = -0.1,
+            value_change_atol: float = 1e-3,
+            value_change_rtol: float = 1e-3,
+            max_iterations: int = 100,
+            iterations_per_record: int = 1,
+
+            verbose: bool = False,
+    ):
+        """
+        compiled counterpart of LocalHjrSolver.as_local_solver, with dilation neighbors instead of signed distance
+        neighbors.
+        """
+        active_set_pre_filter = NoPreFilter.from_parts(
+        )
+        neighbor_expander = DilationNeighbors.from_parts(
+            distance=neighbor_distance
+        )
+        local_hjr_stepper = ClassicLocalHjrStepper.from_parts(
+            dynamics=dynamics,
+            grid=grid,
+            terminal_values=terminal_values,
+            time_step=solver_timestep,
+            verbose=verbose
+        )
+        active_set_post_filter = RemoveWhereUnchanged.from_parts(
+            atol=value_change_atol,
+            rtol=value_change_rtol,
+        )
+        break_criteria_checker = BreakCriteriaChecker.from_criteria(
+            [
+                MaxIterations.from_parts(max_iterations=max_iterations),
+                PostFilteredActiveSetEmpty.from_parts(),
+            ],
+            verbose=verbose
+        )
+
+        return cls(
+            dynamics=dynamics,
+            grid=grid,
+            avoid_set=avoid_set,
+            reach_set=reach_set,
+            terminal_values=terminal_values,
+            active_set_pre_filter=active_set_pre_filter,
+            neighbor_expander=neighbor_expander,
+            local_hjr_stepper=local_hjr_stepper,
+            active_set_post_filter=active_set_post_filter,
+            break_criteria_checker=break_criteria_checker,
+            verbose=verbose,
+            iterations_per_record=iterations_per_record,
+        )
+
+    @classmethod
+    def as_marching_solver(
+            cls,
+            dynamics: hj_reachability.Dynamics,
+            grid: hj_reachability.Grid,
+            avoid_set: MaskNd,
+            reach_set: MaskNd,
+            terminal_values: ArrayNd,
+
+            boundary_distance_inner: float = 2,
+            boundary_distance_outer: float = 2,
+            neighbor_distance: float = 2,
+            solver_timestep: float = -0.1,
+            hamiltonian_atol: float = 1e-3,
+            max_iterations: int = 100,
+            iterations_per_record: int = 1,
+
+            verbose: bool = False,
+    ):
+        """
+        compiled counterpart of LocalHjrSolver.as_marching_solver, with a dilation boundary pre-filter.
+        """
+        assert solver_timestep < 0, "solver_timestep must be negative"
+
+        active_set_pre_filter = PreFilterWhereFarFromBoundarySplitDilation.from_parts(
+            distance_inner=boundary_distance_inner,
+            distance_outer=boundary_distance_outer,
+        )
+        neighbor_expander = SignedDistanceNeighborsNearBoundaryDilation.from_parts(
+            neighbor_distance=neighbor_distance,
+            boundary_distance_inner=boundary_distance_inner,
+            boundary_distance_outer=boundary_distance_outer,
+        )
+        local_hjr_stepper = DecreaseLocalHjrStepper.from_parts(
+            dynamics=dynamics,
+            grid=grid,
+            terminal_values=terminal_values,
+            time_step=solver_timestep,
+            verbose=verbose
+        )
+        active_set_post_filter = RemoveWhereNonNegativeHamiltonian.from_parts(
+            hamiltonian_atol=hamiltonian_atol
+        )
+        break_criteria_checker = BreakCriteriaChecker.from_criteria(
+            [
+                MaxIterations.from_parts(max_iterations=max_iterations),
+                PostFilteredActiveSetEmpty.from_parts(),
+            ],
+            verbose=verbose
+        )
+
+        return cls(
+            dynamics=dynamics,
+            grid=grid,
+            avoid_set=avoid_set,
+            reach_set=reach_set,
+            terminal_values=terminal_values,
+            active_set_pre_filter=active_set_pre_filter,
+            neighbor_expander=neighbor_expander,
+            local_hjr_stepper=local_hjr_stepper,
+            active_set_post_filter=active_set_post_filter,
+            break_criteria_checker=break_criteria_checker,
+            verbose=verbose,
+            iterations_per_record=iterations_per_record,
+        )
@@ -0,0 +1,165 @@
+import logging
+import time
+from typing import Callable, Tuple, Union
+
+import attr
+import numpy as np
+from jax import numpy as jnp
+
+import hj_reachability
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult
+from refineNCBF.local_hjr_solver.solve import LocalHjrSolver
+from refineNCBF.utils.sets import expand_mask_by_dilation_jax
+from refineNCBF.utils.types import MaskNd, ArrayNd
+from refineNCBF.utils.visuals import make_configured_logger
+
+# (grid, avoid_set, reach_set, terminal_values) -> solver, e.g. functools.partial(LocalHjrSolver.as_marching_solver,
+# dynamics=dynamics)
+SolverFactory = Callable[..., LocalHjrSolver]
+
+
+@attr.s(auto_attribs=True)
+class CoarseToFineLocalHjrSolver(Callable):
+    """
+    coarse-to-fine driver: first solves the problem on a grid downsampled by factors (every factors-th grid point, so
+    coarse cells coincide with fine cells), then upsamples the coarse values by multilinear interpolation and seeds
+    the fine solve only where the coarse kernel boundary moved, dilated by seed_cells fine cells. there the fine solve
+    starts from the upsampled coarse values, elsewhere from the given initial values, so the fine grid only refines the
+    part of the front the coarse solve already marched.
+
+    both solves are built by solver_factory, so they share its configuration. downsampling samples the avoid and reach
+    sets too, so obstacles thinner than the coarse spacing are missed by the coarse solve (the fine solve still
+    enforces them). with decrease-only steppers, the fine solve cannot raise values the coarse solve lowered too far.
+    """
+    _solver_factory: SolverFactory
+    _grid: hj_reachability.Grid
+    _avoid_set: MaskNd
+    _reach_set: MaskNd
+    _terminal_values: ArrayNd
+
+    _factors: Tuple[int, ...]
+    _seed_cells: int
+
+    _verbose: bool = False
+    _logger: logging.Logger = make_configured_logger(__name__)
+
+    @classmethod
+    def from_parts(
+            cls,
+            solver_factory: SolverFactory,
+            grid: hj_reachability.Grid,
+            avoid_set: MaskNd,
+            reach_set: MaskNd,
+            terminal_values: ArrayNd,
+            factors: Union[int, Tuple[int, ...]] = 2,
+            seed_cells: int = 2,
+            verbose: bool = False,
+    ):
+        if isinstance(factors, int):
+            factors = (factors,) * grid.ndim
+        for dim, (points, factor) in enumerate(zip(grid.shape, factors)):
+            assert factor >= 1, "downsampling factors must be at least 1"
+            assert grid.boundary_conditions[dim] is not hj_reachability.boundary_conditions.periodic \
+                or points % factor == 0, f"periodic dimension {dim} must be divisible by its downsampling factor"
+        return cls(
+            solver_factory=solver_factory,
+            grid=grid,
+            avoid_set=avoid_set,
+            reach_set=reach_set,
+            terminal_values=terminal_values,
+            factors=tuple(factors),
+            seed_cells=seed_cells,
+            verbose=verbose,
+        )
+
+    def __call__(self, active_set: MaskNd, initial_values: ArrayNd) -> LocalUpdateResult:
+        start_time = time.time()
+        coarse_grid = downsample_grid(self._grid, self._factors)
+        coarse_initial_values = self._downsample(initial_values)
+        coarse_result = self._solver_factory(
+            grid=coarse_grid,
+            avoid_set=self._downsample(self._avoid_set),
+            reach_set=self._downsample(self._reach_set),
+            terminal_values=self._downsample(self._terminal_values),
+        )(active_set=self._downsample(active_set), initial_values=coarse_initial_values)
+
+        fine_seed_set, fine_initial_values = self.get_fine_start(
+            coarse_grid, coarse_initial_values, coarse_result.get_recent_values(), initial_values
+        )
+        if self._verbose:
+            self._logger.info(
+                f'coarse solve on {coarse_grid.shape} took {len(coarse_result)} iterations and '
+                f'{(time.time() - start_time):.2f} seconds, seeding {int(fine_seed_set.sum())} fine cells'
+            )
+
+        fine_solver = self._solver_factory(
+            grid=self._grid,
+            avoid_set=self._avoid_set,
+            reach_set=self._reach_set,
+            terminal_values=self._terminal_values,
+        )
+        return fine_solver(active_set=fine_seed_set, initial_values=fine_initial_values)
+
+    def get_fine_start(
+            self,
+            coarse_grid: hj_reachability.Grid,
+            coarse_initial_values: ArrayNd,
+            coarse_values: ArrayNd,
+            initial_values: ArrayNd,
+    ) -> Tuple[MaskNd, ArrayNd]:
+        """
+        fine seed set and initial values from a coarse solve: the fine cells next to coarse cells whose kernel
+        membership changed, dilated by seed_cells, start from the upsampled coarse values.
+        """
+        boundary_moved = (jnp.asarray(coarse_initial_values) >= 0) != (jnp.asarray(coarse_values) >= 0)
+        fine_seed_set = expand_mask_by_dilation_jax(
+            upsample_values(coarse_grid, boundary_moved.astype(float), self._grid) > 0,
+            self._seed_cells
+        )
+        fine_initial_values = jnp.where(
+            fine_seed_set,
+            upsample_values(coarse_grid, jnp.asarray(coarse_values), self._grid),
+            jnp.asarray(initial_values)
+        )
+        return np.asarray(fine_seed_set), fine_initial_values.astype(jnp.asarray(initial_values).dtype)
+
+    def _downsample(self, array: ArrayNd) -> ArrayNd:
+        return downsample_array(array, self._factors)
+
+
+def downsample_grid(grid: hj_reachability.Grid, factors: Tuple[int, ...]) -> hj_reachability.Grid:
+    """
+    grid of every factors-th point of grid. periodic dimensions keep their domain; other dimensions end at their last
+    kept point.
+    """
+    hi, shape = [], []
+    for dim, (points, factor) in enumerate(zip(grid.shape, factors)):
+        shape.append(-(-points // factor))
+        if grid.boundary_conditions[dim] is hj_reachability.boundary_conditions.periodic:
+            hi.append(grid.domain.hi[dim])
+        else:
+            hi.append(grid.coordinate_vectors[dim][(shape[-1] - 1) * factor])
+
+    return hj_reachability.Grid.from_lattice_parameters_and_boundary_conditions(
+        domain=hj_reachability.sets.Box(jnp.asarray(grid.domain.lo), jnp.array(hi)),
+        shape=tuple(shape),
+        boundary_conditions=grid.boundary_conditions,
+    )
+
+
+def downsample_array(array: ArrayNd, factors: Tuple[int, ...]) -> ArrayNd:
+    return array[tuple(np.s_[::factor] for factor in factors)]
+
+
+def upsample_values(
+        coarse_grid: hj_reachability.Grid,
+        coarse_values: ArrayNd,
+        fine_grid: hj_reachability.Grid,
+) -> ArrayNd:
+    """
+    multilinear interpolation of coarse_values onto the states of fine_grid, held constant beyond the coarse domain.
+    """
+    return hj_reachability.utils.multivmap(
+        lambda state: coarse_grid.interpolate(coarse_values, state),
+        np.arange(fine_grid.ndim)
+    )(fine_grid.states)
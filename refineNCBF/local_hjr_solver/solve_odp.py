@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 
@@ -11,6 +11,7 @@ from refineNCBF.local_hjr_solver.prefilter import NoPreFilter, PreFilterWhereFar
 from refineNCBF.local_hjr_solver.solve import LocalHjrSolver
 from refineNCBF.local_hjr_solver.step_odp import DecreaseLocalHjrStepperOdp, ClassicLocalHjrStepperOdp
 from refineNCBF.optimized_dp_interface.odp_dynamics import OdpDynamics
+from refineNCBF.optimized_dp_interface.odp_kernel_cache import OdpKernelCache
 from refineNCBF.utils.types import MaskNd, ArrayNd
 
 
@@ -29,6 +30,7 @@ def create_global_solver_odp(
         change_fraction: float = 1,
         max_iterations: int = 100,
 
+        kernel_cache: Optional[OdpKernelCache] = None,
         verbose: bool = False,
 ) -> LocalHjrSolver:
     active_set_pre_filter = NoPreFilter.from_parts(
@@ -42,6 +44,7 @@ def create_global_solver_odp(
         periodic_dims=periodic_dims,
         integration_scheme=integration_scheme,
         time_step=solver_timestep,
+        kernel_cache=kernel_cache,
     )
     active_set_post_filter = RemoveWhereUnchanged.from_parts(
         atol=hamiltonian_atol,
@@ -86,6 +89,7 @@ def create_decrease_global_solver_odp(
         change_fraction: float = 1,
         max_iterations: int = 100,
 
+        kernel_cache: Optional[OdpKernelCache] = None,
         verbose: bool = False,
 ) -> LocalHjrSolver:
     active_set_pre_filter = NoPreFilter.from_parts(
@@ -99,6 +103,7 @@ def create_decrease_global_solver_odp(
         periodic_dims=periodic_dims,
         integration_scheme=integration_scheme,
         time_step=solver_timestep,
+        kernel_cache=kernel_cache,
     )
     active_set_post_filter = RemoveWhereUnchanged.from_parts(
         atol=hamiltonian_atol,
@@ -142,6 +147,7 @@ def create_local_solver_odp(
         change_rtol: float = 1e-3,
         max_iterations: int = 100,
 
+        kernel_cache: Optional[OdpKernelCache] = None,
         verbose: bool = False,
 ) -> LocalHjrSolver:
     active_set_pre_filter = NoPreFilter()
@@ -154,6 +160,7 @@ def create_local_solver_odp(
         periodic_dims=periodic_dims,
         integration_scheme=integration_scheme,
         time_step=solver_timestep,
+        kernel_cache=kernel_cache,
     )
     active_set_post_filter = RemoveWhereUnchanged.from_parts(
         atol=change_atol,
@@ -199,6 +206,7 @@ def create_marching_solver_odp(
         change_fraction: float = 1,
         max_iterations: int = 100,
 
+        kernel_cache: Optional[OdpKernelCache] = None,
         verbose: bool = False,
 ) -> LocalHjrSolver:
     """
@@ -224,7 +232,8 @@ def create_marching_solver_odp(
         grid=grid,
         periodic_dims=periodic_dims,
         integration_scheme=integration_scheme,
-        time_step=solver_timestep)
+        time_step=solver_timestep,
+        kernel_cache=kernel_cache)
 
     active_set_post_filter = RemoveWhereNonNegativeHamiltonian.from_parts(
         hamiltonian_atol=hamiltonian_atol
@@ -0,0 +1,182 @@
+from typing import Callable, Optional, Tuple
+
+import attr
+import jax
+import numpy as np
+from jax import numpy as jnp
+
+import hj_reachability
+from refineNCBF.hj_reachability_interface.hj_dynamics import DynamicsTable
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult
+from refineNCBF.local_hjr_solver.step_hj import LocalHjrStepper, HjReachabilityLocalHjrStepper
+from refineNCBF.local_hjr_solver.step_tiled import get_tile_slices
+from refineNCBF.utils.types import MaskNd, ArrayNd
+
+
+@attr.s(auto_attribs=True)
+class BlockIndex:
+    """
+    partition of a grid into fixed-size blocks, each with a padded window (core plus halo) of one shared shape, laid
+    out like get_tile_slices. the activity bitmap of a mask marks the blocks whose core it touches; gather and
+    scatter_cores move the windows of a list of blocks between a grid-shaped array and a (blocks, *window) batch.
+    """
+    _shape: Tuple[int, ...]
+    _block_shape: Tuple[int, ...]
+    _padded_shape: Tuple[int, ...]
+    _padded_starts: np.ndarray
+    _core_starts: np.ndarray
+    _core_stops: np.ndarray
+
+    @classmethod
+    def from_parts(cls, grid: hj_reachability.Grid, block_shape: Tuple[int, ...], halo_cells: int):
+        block_shape = tuple(
+            points if grid.boundary_conditions[dim] is hj_reachability.boundary_conditions.periodic
+            else min(block_points, points)
+            for dim, (points, block_points) in enumerate(zip(grid.shape, block_shape))
+        )
+        tiles = get_tile_slices(grid, block_shape, halo_cells)
+        padded_starts = np.array([[dim_padded.start for dim_padded in padded] for _, padded in tiles])
+        return cls(
+            shape=tuple(grid.shape),
+            block_shape=block_shape,
+            padded_shape=tuple(dim_padded.stop - dim_padded.start for dim_padded in tiles[0][1]),
+            padded_starts=padded_starts,
+            core_starts=np.array([[dim_core.start for dim_core in core] for core, _ in tiles]) - padded_starts,
+            core_stops=np.array([[dim_core.stop for dim_core in core] for core, _ in tiles]) - padded_starts,
+        )
+
+    @property
+    def block_count(self) -> int:
+        return len(self._padded_starts)
+
+    @property
+    def padded_shape(self) -> Tuple[int, ...]:
+        return self._padded_shape
+
+    def get_activity(self, mask: MaskNd) -> np.ndarray:
+        """
+        activity bitmap of mask over the block lattice: whether any cell in the core of each block is set.
+        """
+        return np.asarray(_get_block_activity(jnp.asarray(mask, dtype=bool), self._block_shape))
+
+    def get_active_block_ids(self, mask: MaskNd) -> np.ndarray:
+        return np.flatnonzero(self.get_activity(mask))
+
+    def get_padded_starts(self, block_ids: ArrayNd) -> ArrayNd:
+        return jnp.asarray(self._padded_starts)[block_ids]
+
+    def gather(self, array: ArrayNd, block_ids: ArrayNd) -> ArrayNd:
+        return jax.vmap(
+            lambda start_indices: jax.lax.dynamic_slice(array, start_indices, self._padded_shape)
+        )(self.get_padded_starts(block_ids))
+
+    def scatter_cores(self, array: ArrayNd, block_ids: ArrayNd, blocks: ArrayNd) -> ArrayNd:
+        """
+        array with the core of each block in block_ids replaced by the core of its window in blocks. halo cells are
+        routed to a discarded slot, so overlapping windows never conflict.
+        """
+        local_indices = np.indices(self._padded_shape).reshape(len(self._shape), -1).T
+        is_core = jnp.all(
+            (local_indices >= jnp.asarray(self._core_starts)[block_ids][:, None])
+            & (local_indices < jnp.asarray(self._core_stops)[block_ids][:, None]),
+            axis=-1
+        )
+        strides = np.cumprod((self._shape[1:] + (1,))[::-1])[::-1]
+        flat_indices = (self.get_padded_starts(block_ids)[:, None] + local_indices) @ strides
+        flat_indices = jnp.where(is_core, flat_indices, array.size)
+
+        array_flat = jnp.concatenate([jnp.ravel(array), jnp.zeros(1, dtype=array.dtype)])
+        array_flat = array_flat.at[jnp.ravel(flat_indices)].set(jnp.ravel(blocks).astype(array.dtype))
+        return array_flat[:-1].reshape(self._shape)
+
+
+def _get_block_activity(mask: MaskNd, block_shape: Tuple[int, ...]) -> MaskNd:
+    mask = jnp.pad(mask, [(0, -points % block_points) for points, block_points in zip(mask.shape, block_shape)])
+    blocked_shape = []
+    for points, block_points in zip(mask.shape, block_shape):
+        blocked_shape.extend([points // block_points, block_points])
+    return jnp.any(mask.reshape(blocked_shape), axis=tuple(range(1, 2 * mask.ndim, 2)))
+
+
+@attr.s(auto_attribs=True)
+class BlockSparseLocalHjrStepper(LocalHjrStepper):
+    """
+    steps only the fixed-size blocks whose core intersects the expanded active set, all in one jitted call: the active
+    blocks are read off the activity bitmap of the expanded active set, gathered with their halos into one batch,
+    stepped together under jax.vmap, and only their cores are scattered back. inactive blocks are never read or
+    written. the batch is padded to a power of two (repeating a block), so the step compiles once per size bucket
+    rather than once per active block count. halos behave as in TiledLocalHjrStepper.
+    """
+    _stepper: HjReachabilityLocalHjrStepper
+    _block_index: BlockIndex
+
+    _step_blocks: Optional[Callable] = attr.ib(default=None, repr=False)
+
+    def __attrs_post_init__(self):
+        assert isinstance(self._stepper, HjReachabilityLocalHjrStepper), \
+            "only the classic and decrease steppers can be stepped by block"
+        self._step_blocks = jax.jit(self._step_blocks_uncompiled)
+
+    @classmethod
+    def from_parts(
+            cls,
+            stepper: HjReachabilityLocalHjrStepper,
+            grid: hj_reachability.Grid,
+            block_shape: Tuple[int, ...],
+            halo_cells: int,
+    ):
+        return cls(
+            stepper=stepper,
+            block_index=BlockIndex.from_parts(grid, tuple(block_shape), halo_cells),
+        )
+
+    @property
+    def block_index(self) -> BlockIndex:
+        return self._block_index
+
+    def __call__(self, data: LocalUpdateResult, active_set_prefiltered: MaskNd, active_set_expanded: MaskNd) -> ArrayNd:
+        values = jnp.asarray(data.get_recent_values())
+        block_ids = self.get_active_block_ids(data, active_set_expanded)
+        if len(block_ids) == 0:
+            return values
+
+        bucket_size = min(1 << (len(block_ids) - 1).bit_length(), self._block_index.block_count)
+        block_ids = np.pad(block_ids, (0, bucket_size - len(block_ids)), mode='edge')
+        return self._step_blocks(
+            values,
+            jnp.asarray(active_set_expanded, dtype=bool),
+            jnp.asarray(block_ids),
+            jnp.asarray(self.get_time_step(data, active_set_expanded)),
+            self._stepper.get_dynamics_table(),
+        )
+
+    def get_active_block_ids(self, data: LocalUpdateResult, active_set_expanded: MaskNd) -> np.ndarray:
+        """
+        ids of the blocks active in the current iteration of data, from the activity bitmap of active_set_expanded.
+        """
+        return data.cache.get_or_compute(
+            len(data),
+            'active_block_ids',
+            lambda: self._block_index.get_active_block_ids(active_set_expanded)
+        )
+
+    def get_time_step(self, data: LocalUpdateResult, active_set_expanded: MaskNd) -> ArrayNd:
+        return self._stepper.get_time_step(data, active_set_expanded)
+
+    def _step_blocks_uncompiled(
+            self,
+            values: ArrayNd,
+            active_set: MaskNd,
+            block_ids: ArrayNd,
+            time_step: ArrayNd,
+            dynamics_table: Optional[DynamicsTable],
+    ) -> ArrayNd:
+        # the dynamics table is an operand rather than a constant of the compiled step
+        stepper = self._stepper.with_dynamics_table(dynamics_table)
+        values_blocks = jax.vmap(stepper.step_block, in_axes=(0, 0, 0, None))(
+            self._block_index.gather(values, block_ids),
+            self._block_index.gather(active_set, block_ids),
+            self._block_index.get_padded_starts(block_ids),
+            time_step,
+        )
+        return self._block_index.scatter_cores(values, block_ids, values_blocks)
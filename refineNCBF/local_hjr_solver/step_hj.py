@@ -1,12 +1,20 @@
+import dataclasses
 from abc import ABC, abstractmethod
-from typing import Callable
+from typing import Callable, Optional, Tuple
 
 import attr
+import jax
+from jax import numpy as jnp
 
 import hj_reachability
 from hj_reachability.solver import backwards_reachable_tube
+from refineNCBF.hj_reachability_interface.hj_dynamics import DynamicsTable, split_dynamics_table, join_dynamics_table
+from refineNCBF.hj_reachability_interface.hj_narrow_band import hj_step_narrow_band
+from refineNCBF.hj_reachability_interface.hj_step import hj_step_cropped, hj_step_block, hj_reachability_step, \
+    lower_hj_reachability_step
 from refineNCBF.hj_reachability_interface.hj_value_postprocessors import ReachAvoid
 from refineNCBF.local_hjr_solver.result import LocalUpdateResult
+from refineNCBF.local_hjr_solver.time_step import TimeStepPolicy
 from refineNCBF.utils.sets import compute_signed_distance
 from refineNCBF.utils.types import MaskNd, ArrayNd
 
@@ -22,14 +30,76 @@ class LocalHjrStepper(ABC, Callable):
     ) -> ArrayNd:
         ...
 
+    def get_time_step(self, data: LocalUpdateResult, active_set_expanded: MaskNd) -> Optional[ArrayNd]:
+        """
+        time step this stepper takes (or took) for the current iteration of data, None if it does not say.
+        """
+        return None
+
+    def warm_up(self, values: jax.ShapeDtypeStruct):
+        """
+        compiles this stepper's step ahead of time for values shaped and typed like values, without running it.
+        steppers with nothing to compile ahead of time do nothing.
+        """
+
+
+@attr.s(auto_attribs=True)
+class CompiledLocalHjrStepper(LocalHjrStepper):
+    """
+    stepper that can also be expressed as a pure jax function of device arrays, so it can run inside a jitted solver
+    iteration.
+    """
+    @abstractmethod
+    def compute(self, values: ArrayNd, active_set_expanded: MaskNd, time_step: Optional[ArrayNd] = None) -> ArrayNd:
+        """
+        values after one step over active_set_expanded. time_step is the step compute_time_step gives for these
+        arguments, passed in when the caller already has it so it is not computed twice.
+        """
+
+    @abstractmethod
+    def compute_time_step(self, values: ArrayNd, active_set_expanded: MaskNd) -> ArrayNd:
+        ...
+
+    def get_terminal_values(self) -> Optional[ArrayNd]:
+        """
+        terminal values this stepper enforces, if it enforces any, for a jitted solver iteration to take as an operand.
+        """
+        return None
+
+    def with_terminal_values(self, terminal_values: Optional[ArrayNd]) -> 'CompiledLocalHjrStepper':
+        """
+        copy of this stepper enforcing terminal_values instead, which may be traced (e.g. one member of a vmapped
+        batch). None leaves them out, for a copy that only serves as the static part of a jitted solver iteration.
+        """
+        return self
+
+    def get_dynamics_table(self) -> Optional[DynamicsTable]:
+        """
+        table of this stepper's dynamics, if they are tabled (see split_dynamics_table), for a jitted solver iteration
+        to take as an operand.
+        """
+        return None
+
+    def with_dynamics_table(self, dynamics_table: Optional[DynamicsTable]) -> 'CompiledLocalHjrStepper':
+        """
+        copy of this stepper reading its dynamics from dynamics_table, which may be traced.
+        """
+        return self
+
 
 @attr.s(auto_attribs=True)
-class ClassicLocalHjrStepper(LocalHjrStepper):
+class HjReachabilityLocalHjrStepper(CompiledLocalHjrStepper):
+    """
+    steps the expanded active set with hj_reachability.step (or the narrow band step), enforcing the terminal values
+    with a ReachAvoid value postprocessor. subclasses only choose the solver settings (see _make_solver_settings).
+    """
     _dynamics: hj_reachability.Dynamics
     _grid: hj_reachability.Grid
     _solver_settings: hj_reachability.SolverSettings
     _time_step: float
     _verbose: bool
+    _narrow_band: bool = False
+    _time_step_policy: Optional[TimeStepPolicy] = None
 
     @classmethod
     def from_parts(
@@ -38,85 +108,181 @@ class ClassicLocalHjrStepper(LocalHjrStepper):
             grid: hj_reachability.Grid,
             terminal_values: ArrayNd,
             time_step: float,
-            verbose: bool
+            verbose: bool,
+            narrow_band: bool = False,
+            time_step_policy: Optional[TimeStepPolicy] = None,
     ):
-        solver_settings = hj_reachability.SolverSettings.with_accuracy(
-            hj_reachability.solver.SolverAccuracyEnum.VERY_HIGH,
-            value_postprocessor=ReachAvoid.from_array(
-                values=terminal_values,
-            ),
-        )
         return cls(
             dynamics=dynamics,
             grid=grid,
-            solver_settings=solver_settings,
+            solver_settings=cls._make_solver_settings(terminal_values),
             time_step=time_step,
-            verbose=verbose
+            verbose=verbose,
+            narrow_band=narrow_band,
+            time_step_policy=time_step_policy,
         )
 
+    @classmethod
+    @abstractmethod
+    def _make_solver_settings(cls, terminal_values: ArrayNd) -> hj_reachability.SolverSettings:
+        ...
+
     def __call__(self, data: LocalUpdateResult, active_set_prefiltered: MaskNd, active_set_expanded: MaskNd) -> ArrayNd:
-        values = hj_reachability.step(
+        if self._narrow_band:
+            return hj_step_narrow_band(
+                dynamics=self._dynamics,
+                grid=self._grid,
+                solver_settings=self._solver_settings,
+                initial_values=data.get_recent_values(),
+                time_start=0,
+                time_target=self.get_time_step(data, active_set_expanded),
+                active_set=active_set_expanded,
+            )
+
+        return hj_reachability_step(
             solver_settings=self._solver_settings,
             dynamics=self._dynamics,
             grid=self._grid,
             time=0,
             values=data.get_recent_values(),
-            target_time=self._time_step,
+            target_time=self.get_time_step(data, active_set_expanded),
             active_set=active_set_expanded,
             progress_bar=self._verbose,
         )
-        return values
 
+    def compute(self, values: ArrayNd, active_set_expanded: MaskNd, time_step: Optional[ArrayNd] = None) -> ArrayNd:
+        if time_step is None:
+            time_step = self.compute_time_step(values, active_set_expanded)
+        return hj_reachability_step(
+            solver_settings=self._solver_settings,
+            dynamics=self._dynamics,
+            grid=self._grid,
+            time=0,
+            values=values,
+            target_time=time_step,
+            active_set=active_set_expanded,
+            progress_bar=False,
+        )
 
-@attr.s(auto_attribs=True)
-class DecreaseLocalHjrStepper(LocalHjrStepper):
-    _dynamics: hj_reachability.Dynamics
-    _grid: hj_reachability.Grid
-    _solver_settings: hj_reachability.SolverSettings
-    _time_step: float
-    _verbose: bool
+    def get_time_step(self, data: LocalUpdateResult, active_set_expanded: MaskNd) -> ArrayNd:
+        if self._time_step_policy is None:
+            return self._time_step
+        return data.cache.get_or_compute(
+            len(data),
+            'time_step',
+            lambda: self._time_step_policy(jnp.asarray(data.get_recent_values()), jnp.asarray(active_set_expanded))
+        )
 
-    @classmethod
-    def from_parts(
-            cls,
-            dynamics: hj_reachability.Dynamics,
-            grid: hj_reachability.Grid,
-            terminal_values: ArrayNd,
-            time_step: float,
-            verbose: bool
-    ):
-        solver_settings = hj_reachability.SolverSettings.with_accuracy(
-            hj_reachability.solver.SolverAccuracyEnum.VERY_HIGH,
-            value_postprocessor=ReachAvoid.from_array(
-                values=terminal_values,
-            ),
-            hamiltonian_postprocessor=backwards_reachable_tube
+    def compute_time_step(self, values: ArrayNd, active_set_expanded: MaskNd) -> ArrayNd:
+        if self._time_step_policy is None:
+            return jnp.asarray(self._time_step)
+        return self._time_step_policy(values, active_set_expanded)
+
+    def warm_up(self, values: jax.ShapeDtypeStruct):
+        # narrow band steps are compiled per band size, on first use
+        if self._narrow_band:
+            return
+        active_set = jax.ShapeDtypeStruct(values.shape, bool)
+        if self._time_step_policy is None:
+            time_step = self._time_step
+        else:
+            time_step = jax.eval_shape(self._time_step_policy, values, active_set)
+        compile_hj_step(self._dynamics, self._grid, self._solver_settings, values, time_step, active_set, self._verbose)
+
+    def get_terminal_values(self) -> Optional[ArrayNd]:
+        if self._solver_settings.value_postprocessor is None:
+            return None
+        return self._solver_settings.value_postprocessor.values
+
+    def with_terminal_values(self, terminal_values: Optional[ArrayNd]):
+        return attr.evolve(
+            self,
+            solver_settings=dataclasses.replace(
+                self._solver_settings,
+                value_postprocessor=None if terminal_values is None else ReachAvoid.from_array(values=terminal_values)
+            )
         )
-        return cls(
-            dynamics=dynamics,
-            grid=grid,
-            solver_settings=solver_settings,
-            time_step=time_step,
-            verbose=verbose
+
+    def get_dynamics_table(self) -> Optional[DynamicsTable]:
+        return split_dynamics_table(self._dynamics)[1]
+
+    def with_dynamics_table(self, dynamics_table: Optional[DynamicsTable]):
+        dynamics, _ = split_dynamics_table(self._dynamics)
+        return attr.evolve(
+            self,
+            dynamics=join_dynamics_table(dynamics, dynamics_table),
+            time_step_policy=(
+                None if self._time_step_policy is None else self._time_step_policy.with_dynamics_table(dynamics_table)
+            ),
         )
 
-    def __call__(
+    def step_tile(
             self,
-            data: LocalUpdateResult,
-            active_set_prefiltered: MaskNd,
-            active_set_expanded: MaskNd
+            values_cropped: ArrayNd,
+            active_set_cropped: MaskNd,
+            index_slice: Tuple[slice, ...],
+            time_step: float
     ) -> ArrayNd:
-        values_next = hj_reachability.step(
+        """
+        steps only the index_slice crop of the grid, given the values and active set already cropped to it.
+        """
+        return hj_step_cropped(
+            dynamics=self._dynamics,
+            grid=self._grid,
             solver_settings=self._solver_settings,
+            initial_values_cropped=values_cropped,
+            time_start=0,
+            time_target=time_step,
+            active_set_cropped=active_set_cropped,
+            index_slice=index_slice,
+        )
+
+    def step_block(
+            self,
+            values_block: ArrayNd,
+            active_set_block: MaskNd,
+            start_indices: ArrayNd,
+            time_step: float
+    ) -> ArrayNd:
+        """
+        steps only the block of the grid at start_indices, given the values and active set already cropped to it.
+        traceable in start_indices, so equally shaped blocks can be stepped under jax.vmap.
+        """
+        return hj_step_block(
             dynamics=self._dynamics,
             grid=self._grid,
-            time=0,
-            values=data.get_recent_values(),
-            target_time=self._time_step,
-            active_set=active_set_expanded,
-            progress_bar=self._verbose,
+            solver_settings=self._solver_settings,
+            initial_values_block=values_block,
+            time_start=0,
+            time_target=time_step,
+            active_set_block=active_set_block,
+            start_indices=start_indices,
+        )
+
+
+@attr.s(auto_attribs=True)
+class ClassicLocalHjrStepper(HjReachabilityLocalHjrStepper):
+    @classmethod
+    def _make_solver_settings(cls, terminal_values: ArrayNd) -> hj_reachability.SolverSettings:
+        return hj_reachability.SolverSettings.with_accuracy(
+            hj_reachability.solver.SolverAccuracyEnum.VERY_HIGH,
+            value_postprocessor=ReachAvoid.from_array(
+                values=terminal_values,
+            ),
+        )
+
+
+@attr.s(auto_attribs=True)
+class DecreaseLocalHjrStepper(HjReachabilityLocalHjrStepper):
+    @classmethod
+    def _make_solver_settings(cls, terminal_values: ArrayNd) -> hj_reachability.SolverSettings:
+        return hj_reachability.SolverSettings.with_accuracy(
+            hj_reachability.solver.SolverAccuracyEnum.VERY_HIGH,
+            value_postprocessor=ReachAvoid.from_array(
+                values=terminal_values,
+            ),
+            hamiltonian_postprocessor=backwards_reachable_tube
         )
-        return values_next
 
 
 @attr.s(auto_attribs=True)
@@ -146,7 +312,7 @@ class DecreaseReplaceLocalHjrStepper(LocalHjrStepper):
         return cls(dynamics=dynamics, grid=grid, solver_settings=solver_settings, time_step=time_step, verbose=verbose)
 
     def __call__(self, data: LocalUpdateResult, active_set_prefiltered: MaskNd, active_set_expanded: MaskNd) -> ArrayNd:
-        values_next = hj_reachability.step(
+        values_next = hj_reachability_step(
             solver_settings=self._solver_settings,
             dynamics=self._dynamics,
             grid=self._grid,
@@ -165,6 +331,15 @@ class DecreaseReplaceLocalHjrStepper(LocalHjrStepper):
             signed_distance_to_kernel[signed_distance_to_kernel < -3])
         return values
 
+    def get_time_step(self, data: LocalUpdateResult, active_set_expanded: MaskNd) -> ArrayNd:
+        return self._time_step
+
+    def warm_up(self, values: jax.ShapeDtypeStruct):
+        compile_hj_step(
+            self._dynamics, self._grid, self._solver_settings, values, self._time_step,
+            jax.ShapeDtypeStruct(values.shape, bool), self._verbose
+        )
+
 
 @attr.s(auto_attribs=True)
 class TrashLocalHjrStepper(LocalHjrStepper):
@@ -190,7 +365,7 @@ class TrashLocalHjrStepper(LocalHjrStepper):
         return cls(dynamics=dynamics, grid=grid, solver_settings=solver_settings, time_step=time_step, verbose=verbose)
 
     def __call__(self, data: LocalUpdateResult, active_set_prefiltered: MaskNd, active_set_expanded: MaskNd) -> ArrayNd:
-        values_next = hj_reachability.step(
+        values_next = hj_reachability_step(
             solver_settings=self._solver_settings,
             dynamics=self._dynamics,
             grid=self._grid,
@@ -201,3 +376,29 @@ class TrashLocalHjrStepper(LocalHjrStepper):
             progress_bar=self._verbose
         )
         return data.get_recent_values()
+
+
+def compile_hj_step(
+        dynamics: hj_reachability.Dynamics,
+        grid: hj_reachability.Grid,
+        solver_settings: hj_reachability.SolverSettings,
+        values: jax.ShapeDtypeStruct,
+        time_step,
+        active_set: jax.ShapeDtypeStruct,
+        progress_bar: bool,
+):
+    """
+    lowers and compiles hj_reachability_step for the arguments the steppers call it with, without running it. the
+    executable lands in jax's compilation caches (and the persistent one, see enable_compilation_cache), so the first
+    real step does not compile. time_step is passed as the steppers pass it, a python float or an abstract array.
+    """
+    lower_hj_reachability_step(
+        solver_settings=solver_settings,
+        dynamics=dynamics,
+        grid=grid,
+        time=0,
+        values=values,
+        target_time=time_step,
+        active_set=active_set,
+        progress_bar=progress_bar,
+    ).compile()
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 
 import attr
 import jax
@@ -6,12 +6,12 @@ import numpy as np
 
 import hj_reachability
 import odp.Grid
-from odp.Plots import PlotOptions
-from odp.solver import HJSolverClass
 from refineNCBF.local_hjr_solver.result import LocalUpdateResult
 from refineNCBF.local_hjr_solver.step_hj import LocalHjrStepper
 from refineNCBF.local_hjr_solver.step_odp_type import OdpStepper
 from refineNCBF.optimized_dp_interface.odp_dynamics import OdpDynamics
+from refineNCBF.optimized_dp_interface.odp_kernel_cache import OdpKernelCache, get_default_odp_kernel_cache
+from refineNCBF.optimized_dp_interface.odp_step import odp_step
 from refineNCBF.utils.types import MaskNd, ArrayNd
 
 
@@ -22,7 +22,7 @@ class ClassicLocalHjrStepperOdp(LocalHjrStepper, OdpStepper):
     time_step: float
     system_objectives: dict
     integration_scheme: str
-    hj_solver: HJSolverClass
+    kernel_cache: OdpKernelCache = attr.Factory(get_default_odp_kernel_cache)
 
     @classmethod
     def from_parts(
@@ -32,6 +32,7 @@ class ClassicLocalHjrStepperOdp(LocalHjrStepper, OdpStepper):
             periodic_dims: List[int],
             integration_scheme: str,
             time_step: float,
+            kernel_cache: Optional[OdpKernelCache] = None,
     ):
         grid_odp = odp.Grid.Grid(
             np.array(grid.domain.lo),
@@ -41,24 +42,20 @@ class ClassicLocalHjrStepperOdp(LocalHjrStepper, OdpStepper):
             periodic_dims
         )
         system_objectives = {"TargetSetMode": "minVWithV0"}
-        hj_solver = HJSolverClass()
         return cls(grid=grid_odp, dynamics=dynamics, time_step=time_step, system_objectives=system_objectives,
-                   integration_scheme=integration_scheme, hj_solver=hj_solver)
+                   integration_scheme=integration_scheme,
+                   kernel_cache=get_default_odp_kernel_cache() if kernel_cache is None else kernel_cache)
 
     def __call__(self, data: LocalUpdateResult, active_set_prefiltered: MaskNd, active_set_expanded: MaskNd) -> ArrayNd:
         values = data.get_recent_values()
-        next_result = self.hj_solver(
-            self.dynamics,
+        next_result = odp_step(
+            self.kernel_cache.get_kernel(self.dynamics, self.grid, self.system_objectives["TargetSetMode"], 'medium'),
             self.grid,
             values,
-            [0, -self.time_step],
-            self.system_objectives,
-            PlotOptions(do_plot=False, plot_type="3d_plot", plotDims=[0, 1, 3], slicesCut=[]),
-            accuracy='medium',
-            int_scheme=self.integration_scheme,
-            active_set=active_set_expanded,
-            verbose=False,
-            untilConvergent=True,
+            -self.time_step,
+            active_set_expanded,
+            integration_scheme=self.integration_scheme,
+            until_convergent=True,
         )
         return next_result
 
@@ -70,7 +67,7 @@ class DecreaseLocalHjrStepperOdp(LocalHjrStepper, OdpStepper):
     time_step: float
     system_objectives: dict
     integration_scheme: str
-    hj_solver: HJSolverClass
+    kernel_cache: OdpKernelCache = attr.Factory(get_default_odp_kernel_cache)
 
     @classmethod
     def from_parts(
@@ -80,6 +77,7 @@ class DecreaseLocalHjrStepperOdp(LocalHjrStepper, OdpStepper):
             periodic_dims: List[int],
             integration_scheme: str,
             time_step: float,
+            kernel_cache: Optional[OdpKernelCache] = None,
     ):
         grid_odp = odp.Grid.Grid(
             np.array(grid.domain.lo),
@@ -89,23 +87,19 @@ class DecreaseLocalHjrStepperOdp(LocalHjrStepper, OdpStepper):
             periodic_dims
         )
         system_objectives = {"TargetSetMode": "minVWithV0"}
-        hj_solver = HJSolverClass()
         return cls(grid=grid_odp, dynamics=dynamics, time_step=time_step, system_objectives=system_objectives,
-                   integration_scheme=integration_scheme, hj_solver=hj_solver)
+                   integration_scheme=integration_scheme,
+                   kernel_cache=get_default_odp_kernel_cache() if kernel_cache is None else kernel_cache)
 
     def __call__(self, data: LocalUpdateResult, active_set_prefiltered: MaskNd, active_set_expanded: MaskNd) -> ArrayNd:
         values = data.get_recent_values()
-        next_result = self.hj_solver(
-            self.dynamics,
+        next_result = odp_step(
+            self.kernel_cache.get_kernel(self.dynamics, self.grid, self.system_objectives["TargetSetMode"], 'medium'),
             self.grid,
             values,
-            [0, -self.time_step],
-            self.system_objectives,
-            PlotOptions(do_plot=False, plot_type="3d_plot", plotDims=[0, 1, 3], slicesCut=[]),
-            accuracy='medium',
-            int_scheme=self.integration_scheme,
-            active_set=active_set_expanded,
-            verbose=False
+            -self.time_step,
+            active_set_expanded,
+            integration_scheme=self.integration_scheme,
         )
         next_result = jax.numpy.array(next_result)
         where_decrease = (next_result < (values - 1e-3))
@@ -0,0 +1,158 @@
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+import attr
+import dill
+import numpy as np
+from jax import numpy as jnp
+
+import hj_reachability
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult
+from refineNCBF.local_hjr_solver.step_hj import LocalHjrStepper, HjReachabilityLocalHjrStepper
+from refineNCBF.utils.types import MaskNd, ArrayNd
+
+TileSlices = Tuple[Tuple[slice, ...], Tuple[slice, ...]]
+
+
+@attr.s(auto_attribs=True)
+class TiledLocalHjrStepper(LocalHjrStepper):
+    """
+    domain-decomposed stepper: splits the grid into tiles, and steps only the tiles whose core intersects the expanded
+    active set, each over its core plus a halo of halo_cells on either side (active halo cells are stepped redundantly,
+    so core cells read evolving neighbors through the whole step). only the cores are written back, so halos are
+    exchanged through the full values array between iterations. the halo has to cover the stencil plus the neighbor
+    distance, which LocalHjrSolver.with_tiles derives from its neighbor expander (see get_min_halo_cells).
+
+    with max_workers, tiles are dispatched to a pool of that many spawned processes, each holding its own copy of the
+    stepper; with max_workers=0 they are stepped one after another in this process. every worker compiles the tile
+    step once, which enable_compilation_cache lets them share. periodic dimensions are never split, so a tile never
+    needs to wrap around a seam.
+    """
+    _stepper: HjReachabilityLocalHjrStepper
+    _grid: hj_reachability.Grid
+    _tile_shape: Tuple[int, ...]
+    _halo_cells: int
+    _max_workers: int
+
+    _tiles: List[TileSlices] = attr.ib(factory=list, repr=False)
+    _executor: Optional[ProcessPoolExecutor] = attr.ib(default=None, repr=False)
+
+    def __attrs_post_init__(self):
+        assert isinstance(self._stepper, HjReachabilityLocalHjrStepper), \
+            "only the classic and decrease steppers can be tiled"
+        self._tiles = get_tile_slices(self._grid, self._tile_shape, self._halo_cells)
+
+    @classmethod
+    def from_parts(
+            cls,
+            stepper: HjReachabilityLocalHjrStepper,
+            grid: hj_reachability.Grid,
+            tile_shape: Tuple[int, ...],
+            halo_cells: int,
+            max_workers: Optional[int] = None,
+    ):
+        return cls(
+            stepper=stepper,
+            grid=grid,
+            tile_shape=tuple(tile_shape),
+            halo_cells=halo_cells,
+            max_workers=multiprocessing.cpu_count() if max_workers is None else max_workers,
+        )
+
+    @property
+    def tile_count(self) -> int:
+        return len(self._tiles)
+
+    def __call__(self, data: LocalUpdateResult, active_set_prefiltered: MaskNd, active_set_expanded: MaskNd) -> ArrayNd:
+        values = np.asarray(data.get_recent_values())
+        active_set = np.asarray(active_set_expanded, dtype=bool)
+        time_step = float(self.get_time_step(data, active_set_expanded))
+
+        tiles = [(core, padded) for core, padded in self._tiles if active_set[core].any()]
+        jobs = [(values[padded], active_set[padded], padded, time_step) for _, padded in tiles]
+        if self._max_workers == 0:
+            tile_values = [np.asarray(self._stepper.step_tile(*job)) for job in jobs]
+        else:
+            tile_values = list(self._get_executor().map(_step_tile, *zip(*jobs))) if len(jobs) > 0 else []
+
+        values_next = values.copy()
+        for (core, padded), values_tile in zip(tiles, tile_values):
+            values_next[core] = values_tile[_get_relative_slice(core, padded)]
+        return jnp.asarray(values_next)
+
+    def get_time_step(self, data: LocalUpdateResult, active_set_expanded: MaskNd) -> ArrayNd:
+        return self._stepper.get_time_step(data, active_set_expanded)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            atexit.unregister(self._executor.shutdown)
+            self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # spawned, not forked, since jax is not fork-safe
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self._max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_initialize_worker,
+                initargs=(dill.dumps(self._stepper),),
+            )
+            atexit.register(self._executor.shutdown)
+        return self._executor
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        return state
+
+
+def get_tile_slices(grid: hj_reachability.Grid, tile_shape: Tuple[int, ...], halo_cells: int) -> List[TileSlices]:
+    """
+    (core, core plus halo) index slices of every tile of grid, cores covering the grid without overlap. all padded
+    slices have the same shape (edge tiles take their halo from the inner side), so the tile step compiles once.
+    periodic dimensions are kept whole.
+    """
+    tiles = [((), ())]
+    for dim, (points, tile_points) in enumerate(zip(grid.shape, tile_shape)):
+        if grid.boundary_conditions[dim] is hj_reachability.boundary_conditions.periodic:
+            tile_points = points
+        tiles = [
+            (core + (dim_core,), padded + (dim_padded,))
+            for core, padded in tiles
+            for dim_core, dim_padded in _get_axis_tile_slices(points, tile_points, halo_cells)
+        ]
+    return tiles
+
+
+def _get_axis_tile_slices(points: int, tile_points: int, halo_cells: int) -> List[Tuple[slice, slice]]:
+    padded_points = min(tile_points + 2 * halo_cells, points)
+    axis_tiles = []
+    for start in range(0, points, tile_points):
+        padded_start = min(max(start - halo_cells, 0), points - padded_points)
+        axis_tiles.append((
+            np.s_[start:min(start + tile_points, points)],
+            np.s_[padded_start:padded_start + padded_points]
+        ))
+    return axis_tiles
+
+
+def _get_relative_slice(core: Tuple[slice, ...], padded: Tuple[slice, ...]) -> Tuple[slice, ...]:
+    return tuple(
+        np.s_[core_slice.start - padded_slice.start:core_slice.stop - padded_slice.start]
+        for core_slice, padded_slice in zip(core, padded)
+    )
+
+
+_worker_stepper: Optional[HjReachabilityLocalHjrStepper] = None
+
+
+def _initialize_worker(stepper_serialized: bytes):
+    global _worker_stepper
+    _worker_stepper = dill.loads(stepper_serialized)
+
+
+def _step_tile(values: np.ndarray, active_set: np.ndarray, index_slice: Tuple[slice, ...], time_step: float):
+    return np.asarray(_worker_stepper.step_tile(values, active_set, index_slice, time_step))
@@ -0,0 +1,284 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import attr
+import dill
+import numpy as np
+
+import hj_reachability
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult, LocalUpdateResultIteration, \
+    LocalUpdateResultValuesDelta
+from refineNCBF.utils.files import FilePathAbsolute
+from refineNCBF.utils.masks import CompactMask
+from refineNCBF.utils.types import MaskNd
+
+RESULT_STORE_FORMAT = 'local_update_result_store'
+RESULT_STORE_VERSION = 1
+
+_STATIC_ARRAYS = ('initial_values', 'terminal_values')
+_STATIC_MASKS = ('avoid_set', 'reach_set', 'seed_set')
+_ITERATION_MASKS = ('active_set_pre_filtered', 'active_set_expanded', 'active_set_post_filtered')
+
+
+@attr.s(auto_attribs=True)
+class LocalUpdateResultStore:
+    """
+    chunked directory layout for a LocalUpdateResult, with one .npy file per field and iteration, so arrays can be
+    memory-mapped and only the iterations and slices actually looked at are read from disk:
+
+        metadata.json               format, shape, storage options
+        grid.json                   lattice parameters to rebuild the hj_reachability grid
+        static/<field>.npy          initial/terminal values, avoid/reach/seed sets
+        iterations/<index>/<field>.npy
+        progress.json               number of complete iterations and their blurbs, replaced atomically
+        objects.dill                optional, the solver and dynamics
+
+    iterations are only counted in progress.json once all of their files are written, so a store interrupted
+    mid-write still loads up to the last complete iteration. an iteration's time_step.npy and iteration_count.npy are
+    only written when its time step and running iteration count were recorded.
+    """
+    _directory: FilePathAbsolute
+    _metadata: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_directory(cls, directory: FilePathAbsolute):
+        return cls(directory=directory)
+
+    @property
+    def directory(self) -> FilePathAbsolute:
+        return self._directory
+
+    def exists(self) -> bool:
+        return os.path.isfile(os.path.join(self._directory, 'metadata.json'))
+
+    def write_header(self, result: LocalUpdateResult, include_objects: bool = True):
+        os.makedirs(os.path.join(self._directory, 'static'), exist_ok=True)
+        os.makedirs(os.path.join(self._directory, 'iterations'), exist_ok=True)
+
+        for name in _STATIC_ARRAYS:
+            np.save(os.path.join(self._directory, 'static', f'{name}.npy'), np.asarray(getattr(result, name)))
+        for name in _STATIC_MASKS:
+            _save_mask(os.path.join(self._directory, 'static'), name, getattr(result, name))
+
+        _write_json_atomic(os.path.join(self._directory, 'grid.json'), _grid_to_parameters(result.grid))
+        if include_objects:
+            with open(os.path.join(self._directory, 'objects.dill'), 'wb') as f:
+                dill.dump({'local_solver': result.local_solver, 'dynamics': result.dynamics}, f)
+
+        self._metadata = None
+        _write_json_atomic(os.path.join(self._directory, 'metadata.json'), {
+            'format': RESULT_STORE_FORMAT,
+            'version': RESULT_STORE_VERSION,
+            'shape': list(np.shape(result.initial_values)),
+            'keyframe_interval': result.keyframe_interval,
+            'compact_masks': result.compact_masks,
+            'has_objects': include_objects,
+        })
+        if not os.path.isfile(os.path.join(self._directory, 'progress.json')):
+            self.write_progress(0, [])
+
+    def write_iteration(self, index: int, iteration: LocalUpdateResultIteration):
+        iteration_directory = self._get_iteration_directory(index)
+        os.makedirs(iteration_directory, exist_ok=True)
+        for name in _ITERATION_MASKS:
+            _save_mask(iteration_directory, name, getattr(iteration, name))
+        if iteration.computed_values is not None:
+            np.save(os.path.join(iteration_directory, 'computed_values.npy'), np.asarray(iteration.computed_values))
+        else:
+            np.save(os.path.join(iteration_directory, 'values_delta_indices.npy'), iteration.values_delta.indices)
+            np.save(os.path.join(iteration_directory, 'values_delta_values.npy'), iteration.values_delta.values)
+        if iteration.time_step is not None:
+            np.save(os.path.join(iteration_directory, 'time_step.npy'), np.asarray(iteration.time_step))
+        if iteration.iteration_count is not None:
+            np.save(os.path.join(iteration_directory, 'iteration_count.npy'), np.asarray(iteration.iteration_count))
+
+    def write_progress(self, iteration_count: int, blurbs: List[str]):
+        _write_json_atomic(
+            os.path.join(self._directory, 'progress.json'),
+            {'iterations': iteration_count, 'blurbs': list(blurbs[:iteration_count])}
+        )
+
+    def read_metadata(self) -> Dict[str, Any]:
+        if self._metadata is None:
+            metadata = _read_json(os.path.join(self._directory, 'metadata.json'))
+            assert metadata.get('format') == RESULT_STORE_FORMAT, \
+                f'{self._directory} is not a local update result store'
+            self._metadata = metadata
+        return self._metadata
+
+    def read_progress(self) -> Tuple[int, List[str]]:
+        progress = _read_json(os.path.join(self._directory, 'progress.json'))
+        return progress['iterations'], progress['blurbs']
+
+    def read_iteration(self, index: int) -> LocalUpdateResultIteration:
+        iteration_directory = self._get_iteration_directory(index)
+        shape = tuple(self.read_metadata()['shape'])
+        masks = {name: _load_mask(iteration_directory, name, shape) for name in _ITERATION_MASKS}
+
+        values_path = os.path.join(iteration_directory, 'computed_values.npy')
+        if os.path.isfile(values_path):
+            computed_values, values_delta = np.load(values_path, mmap_mode='r'), None
+        else:
+            computed_values = None
+            values_delta = LocalUpdateResultValuesDelta(
+                indices=np.load(os.path.join(iteration_directory, 'values_delta_indices.npy'), mmap_mode='r'),
+                values=np.load(os.path.join(iteration_directory, 'values_delta_values.npy'), mmap_mode='r'),
+            )
+
+        time_step_path = os.path.join(iteration_directory, 'time_step.npy')
+        time_step = float(np.load(time_step_path)) if os.path.isfile(time_step_path) else None
+        iteration_count_path = os.path.join(iteration_directory, 'iteration_count.npy')
+        iteration_count = int(np.load(iteration_count_path)) if os.path.isfile(iteration_count_path) else None
+
+        return LocalUpdateResultIteration(
+            computed_values=computed_values,
+            values_delta=values_delta,
+            time_step=time_step,
+            iteration_count=iteration_count,
+            **masks
+        )
+
+    def load(self, load_objects: bool = True) -> LocalUpdateResult:
+        """
+        lazily loads the result: static arrays and iterations are memory-mapped, and iterations are only opened when
+        accessed.
+        """
+        metadata = self.read_metadata()
+        shape = tuple(metadata['shape'])
+        iteration_count, blurbs = self.read_progress()
+
+        objects = {'local_solver': None, 'dynamics': None}
+        if load_objects and metadata['has_objects']:
+            with open(os.path.join(self._directory, 'objects.dill'), 'rb') as f:
+                objects = dill.load(f)
+
+        static_directory = os.path.join(self._directory, 'static')
+        return LocalUpdateResult(
+            local_solver=objects['local_solver'],
+            dynamics=objects['dynamics'],
+            grid=_grid_from_parameters(_read_json(os.path.join(self._directory, 'grid.json'))),
+            avoid_set=_load_mask(static_directory, 'avoid_set', shape),
+            reach_set=_load_mask(static_directory, 'reach_set', shape),
+            initial_values=np.load(os.path.join(static_directory, 'initial_values.npy'), mmap_mode='r'),
+            terminal_values=np.load(os.path.join(static_directory, 'terminal_values.npy'), mmap_mode='r'),
+            seed_set=_load_mask(static_directory, 'seed_set', shape),
+            iterations=LazyIterationList.from_store(self, iteration_count),
+            blurbs=blurbs,
+            keyframe_interval=metadata['keyframe_interval'],
+            compact_masks=metadata['compact_masks'],
+        )
+
+    def save(self, result: LocalUpdateResult, include_objects: bool = True):
+        self.write_header(result, include_objects=include_objects)
+        for index in range(len(result)):
+            self.write_iteration(index, result.iterations[index])
+        self.write_progress(len(result), result.blurbs)
+
+    def _get_iteration_directory(self, index: int) -> FilePathAbsolute:
+        return os.path.join(self._directory, 'iterations', f'{index:06d}')
+
+
+@attr.s(auto_attribs=True)
+class LazyIterationList:
+    """
+    list of LocalUpdateResultIterations whose first stored_count entries live in a LocalUpdateResultStore and are
+    read (memory-mapped) on access. appended iterations stay in memory until they are marked as stored, after which
+    they may be released from memory and read back from the store when needed.
+    """
+    _store: LocalUpdateResultStore
+    _stored_count: int
+    _in_memory: Dict[int, LocalUpdateResultIteration] = attr.ib(factory=dict)
+    _count: int = 0
+
+    @classmethod
+    def from_store(cls, store: LocalUpdateResultStore, stored_count: int):
+        return cls(store=store, stored_count=stored_count, count=stored_count)
+
+    @property
+    def store(self) -> LocalUpdateResultStore:
+        return self._store
+
+    @property
+    def stored_count(self) -> int:
+        return self._stored_count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        index = range(self._count)[index]
+        if index in self._in_memory:
+            return self._in_memory[index]
+        assert index < self._stored_count, f'iteration {index} is neither in memory nor stored'
+        return self._store.read_iteration(index)
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
+
+    def append(self, iteration: LocalUpdateResultIteration):
+        self._in_memory[self._count] = iteration
+        self._count += 1
+
+    def mark_stored(self, stored_count: int):
+        self._stored_count = max(self._stored_count, stored_count)
+
+    def release(self, keep_last: int):
+        """
+        drops stored iterations other than the last keep_last from memory.
+        """
+        for index in [index for index in self._in_memory if index < min(self._stored_count, self._count - keep_last)]:
+            del self._in_memory[index]
+
+
+def _save_mask(directory: FilePathAbsolute, name: str, mask: Union[MaskNd, CompactMask]):
+    if isinstance(mask, CompactMask) and mask.is_sparse:
+        np.save(os.path.join(directory, f'{name}.indices.npy'), mask.flat_indices)
+    elif isinstance(mask, CompactMask):
+        np.save(os.path.join(directory, f'{name}.packed.npy'), mask.packed_bits)
+    else:
+        np.save(os.path.join(directory, f'{name}.npy'), np.asarray(mask, dtype=bool))
+
+
+def _load_mask(directory: FilePathAbsolute, name: str, shape: Tuple[int, ...]) -> Union[MaskNd, CompactMask]:
+    if os.path.isfile(os.path.join(directory, f'{name}.indices.npy')):
+        return CompactMask.from_flat_indices(shape, np.load(os.path.join(directory, f'{name}.indices.npy')))
+    if os.path.isfile(os.path.join(directory, f'{name}.packed.npy')):
+        return CompactMask.from_packed_bits(
+            shape, np.load(os.path.join(directory, f'{name}.packed.npy'), mmap_mode='r')
+        )
+    return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+
+
+def _grid_to_parameters(grid: hj_reachability.Grid) -> Dict[str, Any]:
+    return {
+        'lo': np.asarray(grid.domain.lo).tolist(),
+        'hi': np.asarray(grid.domain.hi).tolist(),
+        'shape': list(grid.shape),
+        'boundary_conditions': [boundary_condition.__name__ for boundary_condition in grid.boundary_conditions],
+    }
+
+
+def _grid_from_parameters(parameters: Dict[str, Any]) -> hj_reachability.Grid:
+    return hj_reachability.Grid.from_lattice_parameters_and_boundary_conditions(
+        domain=hj_reachability.sets.Box(np.array(parameters['lo']), np.array(parameters['hi'])),
+        shape=tuple(parameters['shape']),
+        boundary_conditions=tuple(
+            getattr(hj_reachability.boundary_conditions, name) for name in parameters['boundary_conditions']
+        ),
+    )
+
+
+def _write_json_atomic(file_path: FilePathAbsolute, content: Dict[str, Any]):
+    temporary_path = f'{file_path}.tmp'
+    with open(temporary_path, 'w') as f:
+        json.dump(content, f)
+    os.replace(temporary_path, file_path)
+
+
+def _read_json(file_path: FilePathAbsolute) -> Dict[str, Any]:
+    with open(file_path, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,294 @@
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+import attr
+import dill
+import numpy as np
+
+import hj_reachability
+from refineNCBF.local_hjr_solver.metrics import JsonLinesMetricsExporter
+from refineNCBF.local_hjr_solver.result import LocalUpdateResult
+from refineNCBF.local_hjr_solver.sink import StoreResultSink
+from refineNCBF.local_hjr_solver.solve import LocalHjrSolver
+from refineNCBF.local_hjr_solver.store import LocalUpdateResultStore
+from refineNCBF.optimized_dp_interface.odp_dynamics import OdpDynamics
+from refineNCBF.utils.files import FilePathRelative, construct_refine_ncbf_path
+from refineNCBF.utils.types import MaskNd, ArrayNd
+from refineNCBF.utils.visuals import make_configured_logger
+
+ParameterGrid = Dict[str, Sequence[Any]]
+
+
+@attr.s(auto_attribs=True)
+class SweepProblem:
+    """
+    the problem a sweep configuration is solved on: everything a solver factory takes besides its own parameters,
+    plus the seed set and initial values of the solve.
+    """
+    dynamics: Union[hj_reachability.Dynamics, OdpDynamics]
+    grid: hj_reachability.Grid
+    avoid_set: MaskNd
+    reach_set: MaskNd
+    terminal_values: ArrayNd
+    active_set: MaskNd
+    initial_values: ArrayNd
+
+    @classmethod
+    def from_parts(
+            cls,
+            dynamics: Union[hj_reachability.Dynamics, OdpDynamics],
+            grid: hj_reachability.Grid,
+            avoid_set: MaskNd,
+            terminal_values: ArrayNd,
+            active_set: MaskNd,
+            reach_set: Optional[MaskNd] = None,
+            initial_values: Optional[ArrayNd] = None,
+    ):
+        return cls(
+            dynamics=dynamics,
+            grid=grid,
+            avoid_set=avoid_set,
+            reach_set=np.zeros_like(avoid_set, dtype=bool) if reach_set is None else reach_set,
+            terminal_values=terminal_values,
+            active_set=active_set,
+            initial_values=terminal_values.copy() if initial_values is None else initial_values,
+        )
+
+    def get_solver_arguments(self) -> Dict[str, Any]:
+        return dict(
+            dynamics=self.dynamics,
+            grid=self.grid,
+            avoid_set=self.avoid_set,
+            reach_set=self.reach_set,
+            terminal_values=self.terminal_values,
+        )
+
+
+@attr.s(auto_attribs=True)
+class SweepConfiguration:
+    problem_parameters: Dict[str, Any]
+    solver_parameters: Dict[str, Any]
+
+    @property
+    def name(self) -> str:
+        """
+        stable name derived from the parameters, so a configuration maps to the same results on every run.
+        """
+        parameters = json.dumps(self.to_record(), sort_keys=True, default=repr)
+        return f'config_{hashlib.sha256(parameters.encode()).hexdigest()[:12]}'
+
+    def to_record(self) -> Dict[str, Any]:
+        return {'problem_parameters': self.problem_parameters, 'solver_parameters': self.solver_parameters}
+
+
+@attr.s(auto_attribs=True)
+class ParameterSweep:
+    """
+    runs every combination of a declarative grid of problem parameters (passed to problem_factory, which builds a
+    SweepProblem) and solver parameters (passed to solver_factory along with the problem, e.g.
+    LocalHjrSolver.as_marching_solver, LocalHjrSolver.as_local_solver or create_marching_solver_odp).
+
+    configurations run in max_workers spawned processes, each pinned to its own cores_per_worker cores, or one after
+    another in this process with max_workers=0. each configuration gets a directory under results_directory, named
+    after its parameters, holding config.json, the result store (streamed by a StoreResultSink as iterations
+    complete), metrics.jsonl and, once it ends, summary.json. configurations whose summary says complete are skipped,
+    interrupted ones are resumed from their store and failed ones are retried, so a sweep can be rerun or extended in
+    place. a results directory should hold a single pair of factories, since they are not part of the names.
+    """
+    _problem_factory: Callable[..., SweepProblem]
+    _solver_factory: Callable[..., LocalHjrSolver]
+    _configurations: List[SweepConfiguration]
+    _results_directory: FilePathRelative
+    _max_workers: int
+    _cores_per_worker: int
+
+    _verbose: bool = True
+    _logger: logging.Logger = make_configured_logger(__name__)
+
+    @classmethod
+    def from_parts(
+            cls,
+            problem_factory: Callable[..., SweepProblem],
+            solver_factory: Callable[..., LocalHjrSolver],
+            problem_grid: ParameterGrid,
+            solver_grid: ParameterGrid,
+            results_directory: FilePathRelative,
+            max_workers: Optional[int] = None,
+            cores_per_worker: int = 1,
+            verbose: bool = True,
+    ):
+        cores = len(os.sched_getaffinity(0))
+        return cls(
+            problem_factory=problem_factory,
+            solver_factory=solver_factory,
+            configurations=[
+                SweepConfiguration(problem_parameters=problem_parameters, solver_parameters=solver_parameters)
+                for problem_parameters in _expand_parameter_grid(problem_grid)
+                for solver_parameters in _expand_parameter_grid(solver_grid)
+            ],
+            results_directory=results_directory,
+            max_workers=max(cores // cores_per_worker, 1) if max_workers is None else max_workers,
+            cores_per_worker=cores_per_worker,
+            verbose=verbose,
+        )
+
+    def __len__(self):
+        return len(self._configurations)
+
+    @property
+    def configurations(self) -> List[SweepConfiguration]:
+        return self._configurations
+
+    def __call__(self) -> Dict[str, Dict[str, Any]]:
+        """
+        runs the configurations without complete results, and returns the summaries of all configurations by name.
+        """
+        pending = [configuration for configuration in self._configurations if not self.is_complete(configuration)]
+        if self._verbose:
+            self._logger.info(
+                f'running {len(pending)} of {len(self)} configurations, {len(self) - len(pending)} already complete'
+            )
+
+        if self._max_workers == 0:
+            for configuration in pending:
+                self._log_summary(run_sweep_configuration(
+                    self._problem_factory,
+                    self._solver_factory,
+                    configuration,
+                    self.get_configuration_directory(configuration)
+                ))
+        elif len(pending) > 0:
+            context = multiprocessing.get_context('spawn')
+            core_groups = context.Queue()
+            for core_group in self._get_core_groups():
+                core_groups.put(core_group)
+            with ProcessPoolExecutor(
+                    max_workers=self._max_workers,
+                    mp_context=context,
+                    initializer=_initialize_worker,
+                    initargs=(dill.dumps((self._problem_factory, self._solver_factory)), core_groups),
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _run_sweep_configuration_in_worker,
+                        configuration,
+                        self.get_configuration_directory(configuration)
+                    )
+                    for configuration in pending
+                ]
+                for future in as_completed(futures):
+                    self._log_summary(future.result())
+
+        return {configuration.name: self.read_summary(configuration) for configuration in self._configurations}
+
+    def get_configuration_directory(self, configuration: SweepConfiguration) -> FilePathRelative:
+        return os.path.join(self._results_directory, configuration.name)
+
+    def read_summary(self, configuration: SweepConfiguration) -> Optional[Dict[str, Any]]:
+        summary_path = construct_refine_ncbf_path(
+            os.path.join(self.get_configuration_directory(configuration), 'summary.json')
+        )
+        if not os.path.isfile(summary_path):
+            return None
+        with open(summary_path, 'r') as f:
+            return json.load(f)
+
+    def is_complete(self, configuration: SweepConfiguration) -> bool:
+        summary = self.read_summary(configuration)
+        return summary is not None and summary['status'] == 'complete'
+
+    def load_result(self, configuration: SweepConfiguration) -> LocalUpdateResult:
+        return LocalUpdateResult.load(
+            os.path.join(self.get_configuration_directory(configuration), 'result'),
+            load_objects=False
+        )
+
+    def _get_core_groups(self) -> List[List[int]]:
+        cores = sorted(os.sched_getaffinity(0))
+        return [
+            [cores[(worker * self._cores_per_worker + core) % len(cores)] for core in range(self._cores_per_worker)]
+            for worker in range(self._max_workers)
+        ]
+
+    def _log_summary(self, summary: Dict[str, Any]):
+        if self._verbose:
+            self._logger.info(
+                f'{summary["name"]} {summary["status"]} after {summary["iterations"]} iterations in '
+                f'{summary["duration"]:.2f} seconds: {summary["solver_parameters"]}, {summary["problem_parameters"]}'
+            )
+
+
+def run_sweep_configuration(
+        problem_factory: Callable[..., SweepProblem],
+        solver_factory: Callable[..., LocalHjrSolver],
+        configuration: SweepConfiguration,
+        directory: FilePathRelative,
+) -> Dict[str, Any]:
+    """
+    solves one configuration into directory (resuming its result store if one was started) and writes its summary.
+    failures are recorded in the summary rather than raised, so one configuration cannot stop a sweep.
+    """
+    full_directory = construct_refine_ncbf_path(directory)
+    os.makedirs(full_directory, exist_ok=True)
+    with open(os.path.join(full_directory, 'config.json'), 'w') as f:
+        json.dump(configuration.to_record(), f, indent=2, default=repr)
+
+    summary = {'name': configuration.name, **configuration.to_record(), 'iterations': 0}
+    start_time = time.time()
+    try:
+        problem = problem_factory(**configuration.problem_parameters)
+        result_path = os.path.join(directory, 'result')
+        solver = solver_factory(
+            **problem.get_solver_arguments(),
+            **configuration.solver_parameters
+        ).with_result_sink(
+            StoreResultSink.from_parts(result_path, include_objects=False)
+        ).with_metrics(
+            JsonLinesMetricsExporter.from_parts(os.path.join(directory, 'metrics.jsonl'))
+        )
+
+        if LocalUpdateResultStore.from_directory(construct_refine_ncbf_path(result_path)).exists():
+            result = solver.resume(result_path)
+        else:
+            result = solver(active_set=problem.active_set, initial_values=problem.initial_values)
+
+        summary.update(
+            status='complete',
+            iterations=len(result),
+            kernel_cells=int((np.asarray(result.get_recent_values()) >= 0).sum()),
+        )
+    except Exception as error:
+        summary.update(status='failed', error=repr(error))
+    summary['duration'] = time.time() - start_time
+
+    summary_path = os.path.join(full_directory, 'summary.json')
+    with open(f'{summary_path}.tmp', 'w') as f:
+        json.dump(summary, f, indent=2, default=repr)
+    os.replace(f'{summary_path}.tmp', summary_path)
+    return summary
+
+
+def _expand_parameter_grid(parameter_grid: ParameterGrid) -> List[Dict[str, Any]]:
+    names = list(parameter_grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*(parameter_grid[name] for name in names))]
+
+
+_worker_factories = None
+
+
+def _initialize_worker(factories_serialized: bytes, core_groups):
+    global _worker_factories
+    # pinned before any computation, so the xla backend (set up on first use) sizes its thread pools to these cores
+    os.sched_setaffinity(0, core_groups.get())
+    _worker_factories = dill.loads(factories_serialized)
+
+
+def _run_sweep_configuration_in_worker(configuration: SweepConfiguration, directory: FilePathRelative):
+    return run_sweep_configuration(*_worker_factories, configuration, directory)
@@ -0,0 +1,144 @@
+from abc import ABC, abstractmethod
+from typing import Callable, Optional, Tuple
+
+import attr
+import jax
+import numpy as np
+from jax import numpy as jnp
+
+import hj_reachability
+from refineNCBF.hj_reachability_interface.hj_dynamics import DynamicsTable, split_dynamics_table, join_dynamics_table
+from refineNCBF.hj_reachability_interface.hj_narrow_band import get_stencil_segments, get_stencil_windows, \
+    compute_upwind_grad_values
+from refineNCBF.utils.types import MaskNd, ArrayNd
+
+
+@attr.s(auto_attribs=True)
+class TimeStepPolicy(ABC, Callable):
+    """
+    chooses the outer time step of a local hjr stepper from the current values and active set. written as a pure jax
+    function, so it also runs inside a jitted solver iteration. hj_reachability.step still sub-steps each outer step
+    at its own cfl limit, so the policy only sets how much time one solver iteration covers.
+    """
+    @abstractmethod
+    def __call__(self, values: ArrayNd, active_set: MaskNd) -> ArrayNd:
+        ...
+
+    def with_dynamics_table(self, dynamics_table: Optional[DynamicsTable]) -> 'TimeStepPolicy':
+        """
+        copy of this policy reading its dynamics, if it has any, from dynamics_table, which may be traced.
+        """
+        return self
+
+
+@attr.s(auto_attribs=True)
+class HamiltonianTimeStep(TimeStepPolicy):
+    """
+    sizes the step so the largest value change over the active set, |H| * |time_step|, is about max_cells_per_step
+    grid cells (the values are signed-distance-like), clipped to [min_time_step, max_time_step] in magnitude. the step
+    grows while the front is slow and shrinks while it moves fast. an empty active set gets the max time step.
+    the sign of max_time_step sets the time direction.
+
+    near convergence, when even the full step would change the values by less than convergence_cells_per_step cells
+    at the rate they actually change (the hamiltonian after hamiltonian_postprocessor, as the solver applies it), the
+    step shrinks in proportion, down to min_time_step, so the last iterations do not jump past the converged values
+    (an empty active set, where nothing changes, then gets the min time step). None turns this off.
+
+    the hamiltonian is only evaluated on the active cells, gathered with their first order stencils, as long as there
+    are at most max_active_fraction of the grid's cells; larger active sets are evaluated over the whole grid.
+    """
+    _dynamics: hj_reachability.Dynamics
+    _grid: hj_reachability.Grid
+    _max_time_step: float
+    _min_time_step: float
+    _max_value_change: float
+    _convergence_value_change: Optional[float]
+    _hamiltonian_postprocessor: Callable
+    _max_active_cells: int
+
+    @classmethod
+    def from_parts(
+            cls,
+            dynamics: hj_reachability.Dynamics,
+            grid: hj_reachability.Grid,
+            max_time_step: float,
+            min_time_step: float,
+            max_cells_per_step: float = 1,
+            convergence_cells_per_step: Optional[float] = 0.1,
+            hamiltonian_postprocessor: Optional[Callable] = None,
+            max_active_fraction: float = 0.1,
+    ):
+        min_spacing = float(np.min(np.array(grid.spacings)))
+        return cls(
+            dynamics=dynamics,
+            grid=grid,
+            max_time_step=max_time_step,
+            min_time_step=min_time_step,
+            max_value_change=max_cells_per_step * min_spacing,
+            convergence_value_change=(
+                None if convergence_cells_per_step is None else convergence_cells_per_step * min_spacing
+            ),
+            hamiltonian_postprocessor=(
+                (lambda hamiltonian: hamiltonian) if hamiltonian_postprocessor is None else hamiltonian_postprocessor
+            ),
+            max_active_cells=max(1, int(np.ceil(max_active_fraction * np.prod(grid.shape)))),
+        )
+
+    def with_dynamics_table(self, dynamics_table: Optional[DynamicsTable]) -> 'HamiltonianTimeStep':
+        dynamics, _ = split_dynamics_table(self._dynamics)
+        return attr.evolve(self, dynamics=join_dynamics_table(dynamics, dynamics_table))
+
+    def __call__(self, values: ArrayNd, active_set: MaskNd) -> ArrayNd:
+        max_hamiltonian, max_rate = jax.lax.cond(
+            jnp.count_nonzero(active_set) <= self._max_active_cells,
+            self._get_max_rates_over_active_cells,
+            self._get_max_rates_over_grid,
+            values,
+            active_set
+        )
+        time_step_magnitude = jnp.clip(
+            self._max_value_change / jnp.maximum(max_hamiltonian, 1e-12),
+            abs(self._min_time_step),
+            abs(self._max_time_step)
+        )
+        if self._convergence_value_change is not None:
+            time_step_magnitude = jnp.clip(
+                time_step_magnitude * jnp.minimum(max_rate * time_step_magnitude / self._convergence_value_change, 1),
+                abs(self._min_time_step),
+                abs(self._max_time_step)
+            )
+        return np.sign(self._max_time_step) * time_step_magnitude
+
+    def _get_max_rates_over_active_cells(self, values: ArrayNd, active_set: MaskNd) -> Tuple[ArrayNd, ArrayNd]:
+        active_indices = jnp.nonzero(active_set.reshape(-1), size=self._max_active_cells, fill_value=0)[0]
+        segments, window_offsets = get_stencil_segments(self._grid, active_indices, ghost_cells=1, xp=jnp)
+        windows = get_stencil_windows(
+            self._grid, tuple(values.reshape(-1)[segment] for segment in segments), window_offsets, ghost_cells=1
+        )
+        left_grad_values, right_grad_values = compute_upwind_grad_values(
+            self._grid, hj_reachability.finite_differences.upwind_first.first_order, windows
+        )
+        hamiltonian, rate = self._get_rates(
+            self._grid.states.reshape((-1, self._grid.ndim))[active_indices],
+            values.reshape(-1)[active_indices],
+            (left_grad_values + right_grad_values) / 2
+        )
+        is_active = jnp.arange(self._max_active_cells) < jnp.count_nonzero(active_set)
+        return jnp.max(jnp.where(is_active, hamiltonian, 0)), jnp.max(jnp.where(is_active, rate, 0))
+
+    def _get_max_rates_over_grid(self, values: ArrayNd, active_set: MaskNd) -> Tuple[ArrayNd, ArrayNd]:
+        hamiltonian, rate = self._get_rates(
+            self._grid.states.reshape((-1, self._grid.ndim)),
+            values.reshape(-1),
+            self._grid.grad_values(values).reshape((-1, self._grid.ndim))
+        )
+        is_active = active_set.reshape(-1)
+        return jnp.max(jnp.where(is_active, hamiltonian, 0)), jnp.max(jnp.where(is_active, rate, 0))
+
+    def _get_rates(self, states: ArrayNd, values: ArrayNd, grad_values: ArrayNd) -> Tuple[ArrayNd, ArrayNd]:
+        # |H|, and |dvalues/dt| as the solver integrates it
+        hamiltonian = jax.vmap(
+            lambda state, value, grad_value: self._dynamics.hamiltonian(state, 0., value, grad_value)
+        )(states, values, grad_values)
+        time_direction = np.sign(self._max_time_step)
+        return jnp.abs(hamiltonian), jnp.abs(self._hamiltonian_postprocessor(time_direction * hamiltonian))
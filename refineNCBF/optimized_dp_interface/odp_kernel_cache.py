@@ -0,0 +1,123 @@
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import attr
+import heterocl as hcl
+import numpy as np
+
+import odp.Grid
+from odp.computeGraphs import graph_3D, graph_4D, graph_5D, graph_6D
+from refineNCBF.optimized_dp_interface.odp_dynamics import OdpDynamics
+from refineNCBF.utils.files import FilePathRelative, construct_refine_ncbf_path, FilePathAbsolute
+from refineNCBF.utils.hashing import fingerprint
+from refineNCBF.utils.visuals import make_configured_logger
+
+_GRAPH_BUILDERS = {3: graph_3D, 4: graph_4D, 5: graph_5D, 6: graph_6D}
+
+
+@attr.s(auto_attribs=True)
+class OdpKernelCache:
+    """
+    cache of compiled heterocl kernels for the odp steppers, one euler step kernel (see odp_step) per setup. kernels are
+    keyed on the dynamics (its class, class attributes and fields), the grid, the target set mode and the accuracy,
+    before any graph is built, so a hit costs neither a trace nor a lowering. the integration scheme is not part of
+    the key, since odp_step builds the runge kutta stages out of the same euler kernel.
+
+    with a directory, compiled kernels are also exported there as shared libraries and loaded by later runs. kernels
+    that cannot be exported or loaded are kept in process only.
+    """
+    _directory: Optional[FilePathAbsolute] = None
+    _kernels: Dict[str, Any] = attr.ib(factory=dict, repr=False)
+
+    _logger: logging.Logger = make_configured_logger(__name__)
+
+    @classmethod
+    def from_parts(cls, directory: Optional[FilePathRelative] = None):
+        return cls(directory=None if directory is None else construct_refine_ncbf_path(directory))
+
+    def __len__(self):
+        return len(self._kernels)
+
+    def get_kernel(
+            self,
+            dynamics: OdpDynamics,
+            grid: odp.Grid.GridProcessing.Grid,
+            target_set_mode: str,
+            accuracy: str,
+    ):
+        key = make_odp_kernel_key(dynamics, grid, target_set_mode, accuracy)
+        if key not in self._kernels:
+            kernel = self._load(key)
+            if kernel is None:
+                kernel = _build_kernel(dynamics, grid, target_set_mode, accuracy)
+                self._save(key, kernel)
+            self._kernels[key] = kernel
+        return self._kernels[key]
+
+    def clear(self):
+        self._kernels.clear()
+
+    def _get_kernel_path(self, key: str) -> FilePathAbsolute:
+        return os.path.join(self._directory, f'{key}.so')
+
+    def _load(self, key: str):
+        if self._directory is None or not os.path.isfile(self._get_kernel_path(key)):
+            return None
+        try:
+            return hcl.tvm.module.load(self._get_kernel_path(key))
+        except Exception as error:
+            self._logger.warning(f'could not load cached odp kernel {key}, rebuilding: {error}')
+            return None
+
+    def _save(self, key: str, kernel):
+        if self._directory is None:
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        temporary_path = f'{self._get_kernel_path(key)}.tmp.so'
+        try:
+            kernel.export_library(temporary_path)
+            os.replace(temporary_path, self._get_kernel_path(key))
+        except Exception as error:
+            self._logger.warning(f'could not export odp kernel {key}, keeping it in process only: {error}')
+
+
+def make_odp_kernel_key(
+        dynamics: OdpDynamics,
+        grid: odp.Grid.GridProcessing.Grid,
+        target_set_mode: str,
+        accuracy: str,
+) -> str:
+    """
+    key of the kernel for a setup. odp dynamics often keep their parameters as class attributes, and the kernel is
+    traced from their methods, so the class namespace is hashed along with the instance.
+    """
+    class_namespaces = [
+        {name: value for name, value in vars(cls).items() if not name.startswith(('__', '_abc_'))}
+        for cls in type(dynamics).__mro__ if cls is not object
+    ]
+    grid_parameters = (
+        np.asarray(grid.min),
+        np.asarray(grid.max),
+        int(grid.dims),
+        np.asarray(grid.pts_each_dim),
+        tuple(np.atleast_1d(grid.pDim).tolist()),
+    )
+    return fingerprint(class_namespaces, dynamics, grid_parameters, target_set_mode, accuracy)
+
+
+def _build_kernel(dynamics: OdpDynamics, grid: odp.Grid.GridProcessing.Grid, target_set_mode: str, accuracy: str):
+    assert grid.dims in _GRAPH_BUILDERS, f'odp has no solver graph for {grid.dims} dimensions'
+    hcl.init()
+    hcl.config.init_dtype = hcl.Float(32)
+    return _GRAPH_BUILDERS[grid.dims](dynamics, grid, target_set_mode, accuracy)
+
+
+_default_odp_kernel_cache = OdpKernelCache()
+
+
+def get_default_odp_kernel_cache() -> OdpKernelCache:
+    """
+    process-wide in-memory kernel cache, shared by odp steppers that are not given their own.
+    """
+    return _default_odp_kernel_cache
@@ -0,0 +1,67 @@
+from typing import Tuple
+
+import heterocl as hcl
+import numpy as np
+
+import odp.Grid
+from refineNCBF.utils.types import ArrayNd, MaskNd
+
+_TVD_RUNGE_KUTTA_ORDERS = {'first': 1, 'second': 2, 'third': 3}
+
+
+def odp_step(
+        kernel,
+        grid: odp.Grid.GridProcessing.Grid,
+        initial_values: ArrayNd,
+        time_horizon: float,
+        active_set: MaskNd,
+        integration_scheme: str = 'first',
+        until_convergent: bool = False,
+        epsilon: float = 2e-3,
+) -> np.ndarray:
+    """
+    steps initial_values over time_horizon with a compiled odp euler kernel (see OdpKernelCache), sub-stepping at the
+    kernel's cfl step, with the total variation diminishing runge kutta scheme of integration_scheme built from
+    euler kernel calls. the initial values are the target set values of the kernel. cells outside active_set are
+    frozen at every stage. with until_convergent, stops early once a sub step changes no value by epsilon or more.
+
+    later runge kutta stages ask the kernel for the first stage's step. the kernel shortens a stage whose own cfl limit
+    is below that step, which makes that sub step only first order accurate in time.
+    """
+    assert integration_scheme in _TVD_RUNGE_KUTTA_ORDERS, f'unknown integration scheme {integration_scheme}'
+    order = _TVD_RUNGE_KUTTA_ORDERS[integration_scheme]
+
+    values = np.asarray(initial_values, dtype=np.float32)
+    active_set = np.asarray(active_set, dtype=bool)
+    coordinate_vectors = [
+        hcl.asarray(np.reshape(grid.vs[dim], grid.pts_each_dim[dim]).astype(np.float32)) for dim in range(grid.dims)
+    ]
+    target_values = hcl.asarray(values)
+
+    def euler_step(stage_values: np.ndarray, time: float, max_time_step: float) -> Tuple[float, np.ndarray]:
+        values_next = hcl.asarray(np.zeros_like(stage_values))
+        times = hcl.asarray(np.array([time, time + max_time_step], dtype=np.float32))
+        kernel(values_next, hcl.asarray(stage_values), *coordinate_vectors, times, target_values)
+        return float(times.asnumpy()[0]), np.where(active_set, values_next.asnumpy(), stage_values)
+
+    time = 0.
+    while time < time_horizon - 1e-4:
+        time_1, values_1 = euler_step(values, time, time_horizon - time)
+        time_step = time_1 - time
+        if order == 1:
+            values_next = values_1
+        else:
+            _, values_2 = euler_step(values_1, time_1, time_step)
+            if order == 2:
+                values_next = (values + values_2) / 2
+            else:
+                values_0_5 = (3 / 4) * values + (1 / 4) * values_2
+                _, values_1_5 = euler_step(values_0_5, time + time_step / 2, time_step)
+                values_next = (1 / 3) * values + (2 / 3) * values_1_5
+        time = time_1
+        values_next = np.where(active_set, values_next, values).astype(np.float32)
+        converged = np.max(np.abs(values_next - values)) < epsilon
+        values = values_next
+        if until_convergent and converged:
+            break
+    return values
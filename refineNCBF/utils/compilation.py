@@ -0,0 +1,22 @@
+import os
+
+import jax
+
+from refineNCBF.utils.files import FilePathRelative, FilePathAbsolute, construct_refine_ncbf_path
+
+
+def enable_compilation_cache(
+        directory: FilePathRelative = 'data/jax_compilation_cache',
+        min_compile_time_secs: float = 1.
+) -> FilePathAbsolute:
+    """
+    persists compiled xla executables under directory (git-ignored), so later processes (repeated runs, parameter
+    sweeps) load them instead of compiling again. executables taking less than min_compile_time_secs to compile are
+    not persisted, which keeps the many trivial ones off disk. jax sets the cache up on first use, so this must be
+    called before the first computation of the process.
+    """
+    full_path = construct_refine_ncbf_path(directory)
+    os.makedirs(full_path, exist_ok=True)
+    jax.config.update('jax_compilation_cache_dir', full_path)
+    jax.config.update('jax_persistent_cache_min_compile_time_secs', min_compile_time_secs)
+    return full_path
@@ -0,0 +1,147 @@
+import dataclasses
+import enum
+import functools
+import hashlib
+import logging
+import types
+from typing import Any
+
+import attr
+import jax
+import numpy as np
+
+
+def fingerprint(*objects: Any) -> str:
+    """
+    content hash of objects: arrays by dtype, shape and data, attrs classes and dataclasses by their fields, functions
+    by their qualified name, bytecode, constants, defaults and closure contents (so two lambdas closing over different
+    values differ), classes by their qualified names, other objects by their attributes or slots. attrs fields with
+    repr=False (runtime state such as executors and compiled functions) and loggers are left out. raises TypeError for
+    an object with no state to hash, rather than hashing it by its type alone.
+    """
+    hasher = hashlib.sha256()
+    for obj in objects:
+        _update(hasher, obj, set())
+    return hasher.hexdigest()
+
+
+def _update(hasher, obj: Any, visiting: set):
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, enum.Enum)):
+        hasher.update(f'{type(obj).__name__}:{obj!r};'.encode())
+        return
+    if isinstance(obj, (np.ndarray, np.generic, jax.Array)):
+        array = np.ascontiguousarray(np.asarray(obj))
+        hasher.update(f'array:{array.dtype}:{array.shape};'.encode())
+        hasher.update(array.tobytes())
+        return
+    if _is_tensor(obj):
+        _update(hasher, obj.detach().cpu().numpy(), visiting)
+        return
+    if isinstance(obj, (types.BuiltinFunctionType, type, np.ufunc)):
+        hasher.update(f'callable:{getattr(obj, "__module__", "")}.{getattr(obj, "__qualname__", repr(obj))};'.encode())
+        return
+    if isinstance(obj, (np.dtype, slice, range, type(Ellipsis), jax.tree_util.PyTreeDef)):
+        hasher.update(f'{type(obj).__name__}:{obj!r};'.encode())
+        return
+    if isinstance(obj, types.ModuleType):
+        hasher.update(f'module:{obj.__name__};'.encode())
+        return
+    if isinstance(obj, logging.Logger):
+        return
+
+    if id(obj) in visiting:
+        hasher.update(b'cycle;')
+        return
+    visiting.add(id(obj))
+
+    if isinstance(obj, (list, tuple)):
+        hasher.update(f'{type(obj).__name__}:{len(obj)}['.encode())
+        for item in obj:
+            _update(hasher, item, visiting)
+        hasher.update(b']')
+    elif isinstance(obj, (dict, types.MappingProxyType)):
+        hasher.update(b'dict{')
+        for key in sorted(obj, key=repr):
+            _update(hasher, key, visiting)
+            _update(hasher, obj[key], visiting)
+        hasher.update(b'}')
+    elif isinstance(obj, (set, frozenset)):
+        hasher.update(b'set{')
+        for item in sorted(obj, key=repr):
+            _update(hasher, item, visiting)
+        hasher.update(b'}')
+    elif isinstance(obj, functools.partial):
+        hasher.update(b'partial(')
+        _update(hasher, obj.func, visiting)
+        _update(hasher, obj.args, visiting)
+        _update(hasher, obj.keywords, visiting)
+        hasher.update(b')')
+    elif isinstance(obj, types.MethodType):
+        hasher.update(b'method(')
+        _update(hasher, obj.__func__, visiting)
+        _update(hasher, obj.__self__, visiting)
+        hasher.update(b')')
+    elif isinstance(obj, types.FunctionType):
+        hasher.update(f'function:{obj.__module__}.{obj.__qualname__}('.encode())
+        _update(hasher, obj.__code__, visiting)
+        _update(hasher, obj.__defaults__, visiting)
+        _update(hasher, obj.__kwdefaults__, visiting)
+        for cell in obj.__closure__ or ():
+            try:
+                _update(hasher, cell.cell_contents, visiting)
+            except ValueError:
+                # a cell not yet bound
+                hasher.update(b'empty cell;')
+        hasher.update(b')')
+    elif isinstance(obj, types.CodeType):
+        hasher.update(f'code:{obj.co_name}:{obj.co_argcount}:{obj.co_kwonlyargcount}:{obj.co_flags};'.encode())
+        hasher.update(obj.co_code)
+        _update(hasher, obj.co_consts, visiting)
+        _update(hasher, obj.co_names, visiting)
+    elif isinstance(obj, (staticmethod, classmethod)):
+        hasher.update(f'{type(obj).__name__}('.encode())
+        _update(hasher, obj.__func__, visiting)
+        hasher.update(b')')
+    elif isinstance(obj, property):
+        hasher.update(b'property(')
+        _update(hasher, (obj.fget, obj.fset, obj.fdel), visiting)
+        hasher.update(b')')
+    elif callable(obj) and hasattr(obj, '__wrapped__'):
+        # jitted and other wrapped functions, hashed by what they wrap
+        hasher.update(f'wrapped:{type(obj).__qualname__}('.encode())
+        _update(hasher, obj.__wrapped__, visiting)
+        hasher.update(b')')
+    else:
+        hasher.update(f'object:{type(obj).__module__}.{type(obj).__qualname__}('.encode())
+        for name, value in _get_fields(obj):
+            hasher.update(f'{name}='.encode())
+            _update(hasher, value, visiting)
+        hasher.update(b')')
+
+    visiting.discard(id(obj))
+
+
+def _get_fields(obj: Any):
+    if attr.has(type(obj)):
+        return [(field.name, getattr(obj, field.name)) for field in attr.fields(type(obj)) if field.repr]
+    if dataclasses.is_dataclass(obj):
+        return [(field.name, getattr(obj, field.name)) for field in dataclasses.fields(obj)]
+    slot_names = _get_slot_names(type(obj))
+    if not hasattr(obj, '__dict__') and not slot_names:
+        raise TypeError(f'cannot fingerprint {type(obj).__qualname__} objects, they have no attributes or slots')
+    fields = sorted(getattr(obj, '__dict__', {}).items())
+    fields += [(slot_name, getattr(obj, slot_name)) for slot_name in slot_names if hasattr(obj, slot_name)]
+    return fields
+
+
+def _get_slot_names(cls: type):
+    slot_names = []
+    for base in cls.__mro__:
+        slots = base.__dict__.get('__slots__', ())
+        slot_names += [slots] if isinstance(slots, str) else list(slots)
+    return [slot_name for slot_name in slot_names if slot_name not in ('__dict__', '__weakref__')]
+
+
+def _is_tensor(obj: Any) -> bool:
+    # torch tensors, recognized without importing torch
+    return type(obj).__module__.startswith('torch') and hasattr(obj, 'detach') and hasattr(obj, 'numpy')
@@ -0,0 +1,222 @@
+from typing import Tuple, Union
+
+import attr
+import numpy as np
+
+from refineNCBF.utils.types import MaskNd
+
+# a sparse index costs 4 or 8 bytes, a packed cell 1/8 byte, so sparse wins below this density (with int32 indices)
+SPARSE_MASK_MAX_DENSITY = 1 / 32
+
+_POPCOUNT_TABLE = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+@attr.s(auto_attribs=True, eq=False)
+class CompactMask:
+    """
+    memory-compact boolean mask. depending on density, cells are either bit-packed along the last axis (1 bit per
+    cell) or stored as a sorted list of flat indices of the true cells. supports &, |, ~, count_nonzero and dilation
+    without materializing the dense mask, and converts to a dense array through np.asarray.
+    """
+    _shape: Tuple[int, ...]
+    _packed: Union[np.ndarray, None] = None
+    _indices: Union[np.ndarray, None] = None
+
+    @classmethod
+    def from_dense(cls, mask: MaskNd) -> "CompactMask":
+        mask = np.asarray(mask, dtype=bool)
+        if np.count_nonzero(mask) <= SPARSE_MASK_MAX_DENSITY * mask.size:
+            return cls._from_indices(mask.shape, np.flatnonzero(mask))
+        return cls(shape=mask.shape, packed=np.packbits(mask, axis=-1, bitorder='little'))
+
+    @classmethod
+    def zeros(cls, shape: Tuple[int, ...]) -> "CompactMask":
+        return cls._from_indices(tuple(shape), np.zeros(0, dtype=np.int64))
+
+    @classmethod
+    def from_packed_bits(cls, shape: Tuple[int, ...], packed_bits: np.ndarray) -> "CompactMask":
+        """
+        wraps bits packed along the last axis (little bit order, as in packed_bits) as is, e.g. a memory-mapped array.
+        """
+        return cls(shape=tuple(shape), packed=packed_bits)
+
+    @classmethod
+    def from_flat_indices(cls, shape: Tuple[int, ...], flat_indices: np.ndarray) -> "CompactMask":
+        """
+        wraps sorted flat indices of the true cells as is, e.g. a memory-mapped array.
+        """
+        return cls(shape=tuple(shape), indices=flat_indices)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._shape
+
+    @property
+    def ndim(self) -> int:
+        return len(self._shape)
+
+    @property
+    def size(self) -> int:
+        return int(np.prod(self._shape))
+
+    @property
+    def dtype(self):
+        return np.dtype(bool)
+
+    @property
+    def is_sparse(self) -> bool:
+        return self._indices is not None
+
+    @property
+    def packed_bits(self) -> np.ndarray:
+        return self._get_packed()
+
+    @property
+    def flat_indices(self) -> np.ndarray:
+        return self._get_flat_indices()
+
+    @property
+    def nbytes(self) -> int:
+        return self._indices.nbytes if self.is_sparse else self._packed.nbytes
+
+    def to_dense(self) -> np.ndarray:
+        if self.is_sparse:
+            mask = np.zeros(self.size, dtype=bool)
+            mask[self._indices] = True
+            return mask.reshape(self._shape)
+        return np.unpackbits(self._packed, axis=-1, count=self._shape[-1], bitorder='little').astype(bool)
+
+    def __array__(self, dtype=None):
+        mask = self.to_dense()
+        return mask if dtype is None else mask.astype(dtype)
+
+    def count_nonzero(self) -> int:
+        if self.is_sparse:
+            return int(self._indices.size)
+        return int(_POPCOUNT_TABLE[self._packed].sum(dtype=np.int64))
+
+    def __and__(self, other: "CompactMask") -> "CompactMask":
+        other = self._check_compatible(other)
+        if self.is_sparse and other.is_sparse:
+            return self._from_indices(self._shape, np.intersect1d(self._indices, other._indices, assume_unique=True))
+        if self.is_sparse or other.is_sparse:
+            sparse, packed = (self, other) if self.is_sparse else (other, self)
+            return self._from_indices(self._shape, sparse._indices[packed._test_flat_indices(sparse._indices)])
+        return self._from_packed(self._shape, self._packed & other._packed)
+
+    def __or__(self, other: "CompactMask") -> "CompactMask":
+        other = self._check_compatible(other)
+        if self.is_sparse and other.is_sparse:
+            return self._from_indices(self._shape, np.union1d(self._indices, other._indices))
+        return self._from_packed(self._shape, self._get_packed() | other._get_packed())
+
+    def __invert__(self) -> "CompactMask":
+        inverted = ~self._get_packed()
+        inverted[..., -1] &= _last_byte_mask(self._shape[-1])
+        return self._from_packed(self._shape, inverted)
+
+    def dilate(self, iterations: int = 1) -> "CompactMask":
+        """
+        dilation with the same cross-shaped structuring element (and false outside the grid) as
+        utils.sets.expand_mask_by_dilation.
+        """
+        dilated = self
+        for _ in range(iterations):
+            if dilated.is_sparse:
+                dilated = dilated._dilate_indices_once()
+            else:
+                dilated = dilated._dilate_packed_once()
+        return dilated
+
+    def _dilate_indices_once(self) -> "CompactMask":
+        coordinates = np.unravel_index(self._indices, self._shape)
+        neighbors = [self._indices]
+        for axis, size in enumerate(self._shape):
+            for step in (-1, 1):
+                shifted = coordinates[axis] + step
+                valid = (shifted >= 0) & (shifted < size)
+                neighbor_coordinates = tuple(
+                    shifted[valid] if dim == axis else coordinate[valid]
+                    for dim, coordinate in enumerate(coordinates)
+                )
+                neighbors.append(np.ravel_multi_index(neighbor_coordinates, self._shape))
+        return self._from_indices(self._shape, np.unique(np.concatenate(neighbors)))
+
+    def _dilate_packed_once(self) -> "CompactMask":
+        packed = self._packed
+        dilated = packed.copy()
+        for axis in range(self.ndim - 1):
+            lower = [slice(None)] * self.ndim
+            upper = [slice(None)] * self.ndim
+            lower[axis], upper[axis] = slice(None, -1), slice(1, None)
+            dilated[tuple(upper)] |= packed[tuple(lower)]
+            dilated[tuple(lower)] |= packed[tuple(upper)]
+
+        # along the last axis cells are bits, so neighbors are one bit over, carrying across byte edges
+        dilated |= packed << 1
+        dilated[..., 1:] |= packed[..., :-1] >> 7
+        dilated |= packed >> 1
+        dilated[..., :-1] |= packed[..., 1:] << 7
+        dilated[..., -1] &= _last_byte_mask(self._shape[-1])
+        return self._from_packed(self._shape, dilated)
+
+    def _test_flat_indices(self, indices: np.ndarray) -> np.ndarray:
+        coordinates = np.unravel_index(indices, self._shape)
+        last = coordinates[-1]
+        byte = self._packed[coordinates[:-1] + (last // 8,)]
+        return ((byte >> (last % 8).astype(np.uint8)) & 1).astype(bool)
+
+    def _get_packed(self) -> np.ndarray:
+        if not self.is_sparse:
+            return self._packed
+        packed = np.zeros(self._shape[:-1] + (-(-self._shape[-1] // 8),), dtype=np.uint8)
+        coordinates = np.unravel_index(self._indices, self._shape)
+        last = coordinates[-1]
+        np.bitwise_or.at(packed, coordinates[:-1] + (last // 8,), (1 << (last % 8)).astype(np.uint8))
+        return packed
+
+    def _check_compatible(self, other: "CompactMask") -> "CompactMask":
+        if not isinstance(other, CompactMask):
+            other = CompactMask.from_dense(other)
+        assert other.shape == self.shape, f"mask shapes {self.shape} and {other.shape} do not match"
+        return other
+
+    @classmethod
+    def _from_indices(cls, shape: Tuple[int, ...], indices: np.ndarray) -> "CompactMask":
+        index_dtype = np.int32 if np.prod(shape) < np.iinfo(np.int32).max else np.int64
+        return cls(shape=tuple(shape), indices=indices.astype(index_dtype, copy=False))
+
+    @classmethod
+    def _from_packed(cls, shape: Tuple[int, ...], packed: np.ndarray) -> "CompactMask":
+        compact_mask = cls(shape=tuple(shape), packed=packed)
+        if compact_mask.count_nonzero() <= SPARSE_MASK_MAX_DENSITY * compact_mask.size:
+            return cls._from_indices(shape, compact_mask._get_flat_indices())
+        return compact_mask
+
+    def _get_flat_indices(self) -> np.ndarray:
+        if self.is_sparse:
+            return self._indices
+        nonzero_bytes = np.flatnonzero(self._packed)
+        bits = np.unpackbits(self._packed.ravel()[nonzero_bytes][:, None], axis=1, bitorder='little')
+        byte_index, bit_index = np.nonzero(bits)
+        flat_byte = nonzero_bytes[byte_index]
+        bytes_per_row = self._packed.shape[-1]
+        row, last = flat_byte // bytes_per_row, (flat_byte % bytes_per_row) * 8 + bit_index
+        return row * self._shape[-1] + last
+
+
+def compact_mask(mask: MaskNd) -> CompactMask:
+    return mask if isinstance(mask, CompactMask) else CompactMask.from_dense(mask)
+
+
+def as_dense_mask(mask: Union[MaskNd, CompactMask]) -> MaskNd:
+    return mask.to_dense() if isinstance(mask, CompactMask) else mask
+
+
+def count_mask_nonzero(mask: Union[MaskNd, CompactMask]) -> int:
+    return mask.count_nonzero() if isinstance(mask, CompactMask) else int(np.count_nonzero(mask))
+
+
+def _last_byte_mask(last_axis_size: int) -> np.uint8:
+    remainder = last_axis_size % 8
+    return np.uint8(0xFF if remainder == 0 else (1 << remainder) - 1)
@@ -1,3 +1,9 @@
+import functools
+import itertools
+from typing import Optional, Tuple
+
+import attr
+import jax
 import jax.numpy as jnp
 import numpy as np
 import skfmm
@@ -11,38 +17,162 @@ def compute_signed_distance(bool_array: MaskNd) -> ArrayNd:
     return signed_distance
 
 
-def expand_mask_by_signed_distance(mask: MaskNd, distance: float = 1) -> MaskNd:
+@functools.partial(jax.jit, static_argnames=('band',))
+def compute_signed_distance_jax(mask: MaskNd, band: Optional[float] = None) -> ArrayNd:
+    """
+    jax-native signed distance to the boundary of mask, in cells: positive inside, negative outside. distances are
+    exact euclidean distances from a cell center to the nearest cell center on the other side of the boundary, minus
+    half a cell, so they sit within a fraction of a cell of the fast marching values of compute_signed_distance (up to
+    about a quarter cell). a mask thresholded at a whole number of cells can therefore differ from the skfmm one on
+    the cells right at the threshold.
+
+    with a band, only distances up to band are resolved and everything further away is +/-inf. the cost is then
+    O(cells * band) rather than O(cells * grid width), so thresholding at a few cells is cheap.
+    """
+    mask = jnp.asarray(mask, dtype=bool)
+    if band is not None and not np.isfinite(band):
+        band = None
+    distance_inside = _distance_to_cells_jax(~mask, band)
+    distance_outside = _distance_to_cells_jax(mask, band)
+    signed_distance = jnp.where(mask, distance_inside, -distance_outside)
+    return signed_distance
+
+
+@attr.s(auto_attribs=True)
+class SignedDistanceEngine:
+    """
+    banded compute_signed_distance_jax that remembers the last mask and field. when the next mask only differs from
+    the last one locally, just the cells within reach of the change are recomputed, on a crop around it. without a
+    band every call is a full recompute.
+    """
+    _band: Optional[float] = None
+    _max_crop_fraction: float = 0.5
+    _crop_bucket_size: int = 8
+
+    _mask: Optional[MaskNd] = None
+    _signed_distance: Optional[ArrayNd] = None
+
+    @classmethod
+    def from_parts(cls, band: Optional[float] = None, max_crop_fraction: float = 0.5, crop_bucket_size: int = 8):
+        if band is not None and not np.isfinite(band):
+            band = None
+        return cls(band=band, max_crop_fraction=max_crop_fraction, crop_bucket_size=crop_bucket_size)
+
+    def __call__(self, mask: MaskNd) -> ArrayNd:
+        mask = jnp.asarray(mask, dtype=bool)
+        if self._band is None or self._mask is None or self._mask.shape != mask.shape:
+            signed_distance = compute_signed_distance_jax(mask, band=self._band)
+        else:
+            signed_distance = self._update(mask)
+        self._mask = mask
+        self._signed_distance = signed_distance
+        return signed_distance
+
+    def _update(self, mask: MaskNd) -> ArrayNd:
+        bounds = get_mask_bounding_box(mask ^ self._mask)
+        if bounds is None:
+            return self._signed_distance
+
+        # a cell's banded distance only depends on cells within reach along each axis, so cells further than reach
+        # from every change keep their value, and recomputing the rest needs another reach of context around them
+        reach = int(np.ceil(self._band + 0.5))
+        update_slices, crop_slices, update_in_crop_slices = [], [], []
+        for (start, stop), size in zip(bounds, mask.shape):
+            update_start, update_stop = max(start - reach, 0), min(stop + reach, size)
+            crop_start, crop_stop = max(update_start - reach, 0), min(update_stop + reach, size)
+            crop_length = min(-(-(crop_stop - crop_start) // self._crop_bucket_size) * self._crop_bucket_size, size)
+            crop_start = min(crop_start, size - crop_length)
+            update_slices.append(slice(update_start, update_stop))
+            crop_slices.append(slice(crop_start, crop_start + crop_length))
+            update_in_crop_slices.append(slice(update_start - crop_start, update_stop - crop_start))
+
+        crop_size = np.prod([crop_slice.stop - crop_slice.start for crop_slice in crop_slices])
+        if crop_size > self._max_crop_fraction * mask.size:
+            return compute_signed_distance_jax(mask, band=self._band)
+
+        signed_distance_crop = compute_signed_distance_jax(mask[tuple(crop_slices)], band=self._band)
+        signed_distance = self._signed_distance.at[tuple(update_slices)].set(
+            signed_distance_crop[tuple(update_in_crop_slices)]
+        )
+        return signed_distance
+
+
+def _distance_to_cells_jax(cells: MaskNd, band: Optional[float]) -> ArrayNd:
+    """
+    distance from every cell center to the nearest true cell center, minus half a cell, by separable min-plus passes
+    over the squared distance (one pass per axis). with a band, each pass only looks band + 1/2 cells either way,
+    which is exact for every distance within the band.
+    """
+    squared_distance = jnp.where(cells, 0.0, jnp.inf)
+    for axis in range(cells.ndim):
+        size = cells.shape[axis]
+        reach = size - 1 if band is None else min(int(np.ceil(band + 0.5)), size - 1)
+        if reach <= 0:
+            continue
+        padding = [(reach, reach) if dim == axis else (0, 0) for dim in range(cells.ndim)]
+        padded = jnp.pad(squared_distance, padding, constant_values=jnp.inf)
+
+        def relax(offset, current, padded=padded, reach=reach, size=size, axis=axis):
+            shift_cost = jnp.square(offset).astype(current.dtype)
+            ahead = jax.lax.dynamic_slice_in_dim(padded, reach + offset, size, axis=axis)
+            behind = jax.lax.dynamic_slice_in_dim(padded, reach - offset, size, axis=axis)
+            return jnp.minimum(current, jnp.minimum(ahead, behind) + shift_cost)
+
+        squared_distance = jax.lax.fori_loop(1, reach + 1, relax, squared_distance)
+
+    distance = jnp.sqrt(squared_distance) - 0.5
+    if band is not None:
+        distance = jnp.where(distance > band, jnp.inf, distance)
+    return distance
+
+
+def _compute_signed_distance_within(mask: MaskNd, distance: float, use_jax: bool) -> ArrayNd:
+    """
+    signed distance the mask helpers threshold at distance: the fast marching field of compute_signed_distance by
+    default, or, with use_jax, the banded compute_signed_distance_jax field. the two differ by a fraction of a cell, so
+    cells lying right at distance can fall on either side; use_jax is opt-in for callers that accept that.
+    """
+    if use_jax:
+        return compute_signed_distance_jax(mask, band=distance)
+    return compute_signed_distance(mask)
+
+
+def expand_mask_by_signed_distance(mask: MaskNd, distance: float = 1, use_jax: bool = False) -> MaskNd:
     if np.count_nonzero(mask) == 0 or np.count_nonzero(~mask) == 0:
         print('mask is full, returning mask')
         return mask
-    signed_distance = compute_signed_distance(mask)
+    signed_distance = _compute_signed_distance_within(mask, distance, use_jax)
     expanded_mask = (signed_distance >= -distance)
     return expanded_mask
 
 
-def shrink_mask_by_signed_distance(mask: MaskNd, distance: float = 1) -> MaskNd:
+def shrink_mask_by_signed_distance(mask: MaskNd, distance: float = 1, use_jax: bool = False) -> MaskNd:
     if np.count_nonzero(mask) == 0 or np.count_nonzero(~mask) == 0:
         print('mask is full, returning mask')
         return mask
-    signed_distance = compute_signed_distance(mask)
+    signed_distance = _compute_signed_distance_within(mask, distance, use_jax)
     shrunk_mask = (signed_distance >= distance)
     return shrunk_mask
 
 
-def get_mask_boundary_by_signed_distance(mask: MaskNd, distance: float = 1) -> MaskNd:
+def get_mask_boundary_by_signed_distance(mask: MaskNd, distance: float = 1, use_jax: bool = False) -> MaskNd:
     if np.count_nonzero(mask) == 0 or np.count_nonzero(~mask) == 0:
         print('mask is full, returning mask')
         return mask
-    signed_distance = compute_signed_distance(mask)
+    signed_distance = _compute_signed_distance_within(mask, distance, use_jax)
     mask_boundary = (signed_distance <= distance) & (signed_distance >= 0)
     return mask_boundary
 
 
-def get_mask_boundary_on_both_sides_by_signed_distance(mask: MaskNd, distance: float = 1) -> MaskNd:
+def get_mask_boundary_on_both_sides_by_signed_distance(
+        mask: MaskNd,
+        distance: float = 1,
+        use_jax: bool = False
+) -> MaskNd:
     if np.count_nonzero(mask) == 0 or np.count_nonzero(~mask) == 0:
         print('mask is full, returning mask')
         return mask
-    signed_distance = compute_signed_distance(mask)
+    signed_distance = _compute_signed_distance_within(mask, distance, use_jax)
     mask_boundary = (signed_distance <= distance) & (signed_distance >= -distance)
     return mask_boundary
 
@@ -52,8 +182,156 @@ def expand_mask_by_dilation(mask: MaskNd, iterations: int = 1) -> MaskNd:
     return expanded_mask
 
 
+def get_mask_bounding_box(mask: MaskNd) -> Optional[Tuple[Tuple[int, int], ...]]:
+    """
+    returns the (start, stop) index bounds of the true cells of mask along each dimension, or None if mask is empty.
+    only the per-axis projections are transferred to the host, not the mask itself.
+    """
+    mask = jnp.asarray(mask)
+    bounds = []
+    for axis in range(mask.ndim):
+        projection = np.asarray(jnp.any(mask, axis=tuple(dim for dim in range(mask.ndim) if dim != axis)))
+        where_true = np.flatnonzero(projection)
+        if where_true.size == 0:
+            return None
+        bounds.append((int(where_true[0]), int(where_true[-1]) + 1))
+    return tuple(bounds)
+
+
 def get_mask_boundary_by_dilation(mask: MaskNd, iterations_inner: int = 1, iterations_outer: int = 1) -> MaskNd:
     inner = expand_mask_by_dilation(~mask, iterations=iterations_inner)
     outer = expand_mask_by_dilation(mask, iterations=iterations_outer)
     intersection = inner & outer
     return intersection
+
+
+def expand_mask_by_dilation_jax(mask: MaskNd, iterations: int = 1) -> MaskNd:
+    """
+    jax-native equivalent of expand_mask_by_dilation (cross-shaped structuring element, cells outside the grid are
+    treated as false), so it can run on device and inside jit. like binary_dilation, iterations < 1 dilates until the
+    mask stops changing.
+    """
+    mask = jnp.asarray(mask)
+    if iterations < 1:
+        def dilate_while_changing(carry):
+            dilated, _ = carry
+            dilated_next = _dilate_once_jax(dilated)
+            return dilated_next, jnp.any(dilated_next != dilated)
+
+        return jax.lax.while_loop(lambda carry: carry[1], dilate_while_changing, (mask, jnp.array(True)))[0]
+    return jax.lax.fori_loop(0, int(iterations), lambda _, dilated: _dilate_once_jax(dilated), mask)
+
+
+def get_mask_boundary_by_dilation_jax(mask: MaskNd, iterations_inner: int = 1, iterations_outer: int = 1) -> MaskNd:
+    inner = expand_mask_by_dilation_jax(~mask, iterations=iterations_inner)
+    outer = expand_mask_by_dilation_jax(mask, iterations=iterations_outer)
+    intersection = inner & outer
+    return intersection
+
+
+def _dilate_once_jax(mask: MaskNd) -> MaskNd:
+    dilated = mask
+    for axis in range(mask.ndim):
+        padding = [(1, 1) if dim == axis else (0, 0) for dim in range(mask.ndim)]
+        padded = jnp.pad(mask, padding)
+        dilated = (
+                dilated
+                | jax.lax.slice_in_dim(padded, 0, mask.shape[axis], axis=axis)
+                | jax.lax.slice_in_dim(padded, 2, mask.shape[axis] + 2, axis=axis)
+        )
+    return dilated
+
+
+def expand_mask_by_index_boxes(
+        mask: MaskNd,
+        half_widths: ArrayNd,
+        periodic_axes: Optional[Tuple[bool, ...]] = None,
+        max_half_widths: Optional[Tuple[int, ...]] = None
+) -> MaskNd:
+    """
+    cells whose own index box, reaching half_widths[..., axis] cells to either side along each axis, contains a true
+    cell of mask. boxes are clipped at the grid edge, or wrap around along periodic axes. evaluated with a summed-area
+    table of the mask (N cumulative sums and 2^N gathers), so the cost does not depend on the box sizes.
+    max_half_widths bounds the wrap-around padding and must be given when half_widths is traced.
+    """
+    shape = mask.shape
+    if periodic_axes is None:
+        periodic_axes = (False,) * len(shape)
+    if max_half_widths is None:
+        max_half_widths = tuple(np.max(np.asarray(half_widths).reshape(-1, len(shape)), axis=0).astype(int))
+    paddings = tuple(
+        min(int(max_half_width), size // 2) if is_periodic else 0
+        for size, is_periodic, max_half_width in zip(shape, periodic_axes, max_half_widths)
+    )
+
+    summed_area = jnp.pad(
+        jnp.asarray(mask).astype(jnp.int32), [(padding, padding) for padding in paddings], mode='wrap'
+    )
+    for axis in range(len(shape)):
+        summed_area = jnp.cumsum(summed_area, axis=axis)
+    summed_area = jnp.pad(summed_area, [(1, 0)] * len(shape))
+
+    half_widths = jnp.asarray(half_widths, dtype=jnp.int32)
+    indices = jnp.indices(shape, dtype=jnp.int32)
+    lowers, uppers = [], []
+    for axis, (size, padding) in enumerate(zip(shape, paddings)):
+        half_width = half_widths[..., axis]
+        if periodic_axes[axis]:
+            half_width = jnp.minimum(half_width, padding)
+            lowers.append(indices[axis] - half_width + padding)
+            uppers.append(indices[axis] + half_width + 1 + padding)
+        else:
+            lowers.append(jnp.maximum(indices[axis] - half_width, 0))
+            uppers.append(jnp.minimum(indices[axis] + half_width + 1, size))
+
+    counts = jnp.zeros(shape, dtype=jnp.int32)
+    for corner in itertools.product((0, 1), repeat=len(shape)):
+        corner_index = tuple(uppers[axis] if upper else lowers[axis] for axis, upper in enumerate(corner))
+        sign = 1 if (len(shape) - sum(corner)) % 2 == 0 else -1
+        counts = counts + sign * summed_area[corner_index]
+    return counts > 0
+
+
+def flag_index_boxes(
+        lower_indices: np.ndarray,
+        upper_indices: np.ndarray,
+        shape: Tuple[int, ...],
+        chunk_size: Optional[int] = None,
+) -> MaskNd:
+    """
+    mask of shape with every index box set, box i spanning lower_indices[i] to upper_indices[i] inclusive along each
+    axis. boxes are stamped into a difference array (+-1 at the 2^N corners of every box), whose cumulative sums along
+    each axis count the boxes covering each cell, so the cost does not depend on the box sizes. boxes are clipped to
+    the grid; boxes left empty are skipped.
+
+    with chunk_size, boxes are stamped chunk_size at a time into the one difference array, so the memory on top of
+    the grid-sized counts is bounded by the chunk's corner indices.
+    """
+    shape = tuple(int(size) for size in shape)
+    lower_indices = np.maximum(np.asarray(lower_indices, dtype=np.int64), 0)
+    upper_indices = np.minimum(np.asarray(upper_indices, dtype=np.int64), np.array(shape) - 1)
+    is_nonempty = np.all(lower_indices <= upper_indices, axis=-1)
+    lower_indices, upper_indices = lower_indices[is_nonempty], upper_indices[is_nonempty] + 1
+
+    difference_shape = tuple(size + 1 for size in shape)
+    strides = np.array([int(np.prod(difference_shape[axis + 1:])) for axis in range(len(shape))], dtype=np.int64)
+    corners = list(itertools.product((0, 1), repeat=len(shape)))
+    counts = np.zeros(int(np.prod(difference_shape)), dtype=np.int64)
+
+    box_count = len(lower_indices)
+    chunk_size = max(box_count, 1) if chunk_size is None else chunk_size
+    for start in range(0, box_count, chunk_size):
+        chunk = np.s_[start:start + chunk_size]
+        for sign in (1, -1):
+            corner_indices = np.concatenate([
+                np.where(corner, upper_indices[chunk], lower_indices[chunk]) @ strides
+                for corner in corners if (1 if sum(corner) % 2 == 0 else -1) == sign
+            ])
+            # unique indices, so the fancy-indexed add does not drop repeated corners
+            unique_indices, repeats = np.unique(corner_indices, return_counts=True)
+            counts[unique_indices] += sign * repeats
+
+    counts = counts.reshape(difference_shape)
+    for axis in range(len(shape)):
+        np.cumsum(counts, axis=axis, out=counts)
+    return counts[tuple(np.s_[:size] for size in shape)] > 0
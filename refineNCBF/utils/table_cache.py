@@ -0,0 +1,89 @@
+import contextlib
+import hashlib
+import os
+import uuid
+from typing import Any, Optional, Sequence
+
+import attr
+import numpy as np
+
+import hj_reachability
+from refineNCBF.utils.files import FilePath, FilePathRelative, FilePathAbsolute, construct_refine_ncbf_path
+from refineNCBF.utils.hashing import fingerprint
+
+
+@attr.s(auto_attribs=True)
+class TableCache:
+    """
+    on-disk cache of tabularized networks, one .npy file per table, read back memory-mapped. a table is keyed on the
+    content of the network's checkpoint files, the standardizer, and the grid's domain, shape and boundary conditions,
+    so a retrained checkpoint, another standardization or another grid never hits a stale table. tables are written
+    to a temporary file and renamed into place, so an interrupted write is never read back.
+    """
+    _directory: FilePathAbsolute
+
+    @classmethod
+    def from_parts(cls, directory: FilePathRelative = 'data/table_cache'):
+        return cls(directory=construct_refine_ncbf_path(directory))
+
+    def make_key(
+            self,
+            grid: hj_reachability.Grid,
+            checkpoint_paths: Sequence[FilePath],
+            standardizer: Optional[Any] = None,
+    ) -> str:
+        checkpoint_hashes = [_hash_file(checkpoint_path) for checkpoint_path in checkpoint_paths]
+        grid_parameters = (
+            np.asarray(grid.domain.lo),
+            np.asarray(grid.domain.hi),
+            tuple(grid.shape),
+            tuple(boundary_condition.__name__ for boundary_condition in grid.boundary_conditions),
+        )
+        return fingerprint(checkpoint_hashes, standardizer, grid_parameters)
+
+    def get_table_path(self, key: str) -> FilePathAbsolute:
+        return os.path.join(self._directory, f'{key}.npy')
+
+    def load(self, key: str) -> Optional[np.ndarray]:
+        """
+        the table stored under key, memory-mapped read-only, or None on a miss.
+        """
+        if not os.path.isfile(self.get_table_path(key)):
+            return None
+        return np.load(self.get_table_path(key), mmap_mode='r')
+
+    @contextlib.contextmanager
+    def writing(self, key: str):
+        """
+        yields a temporary .npy path to write the table for key to; it is moved into place when the block exits
+        without an error, and removed otherwise.
+        """
+        os.makedirs(self._directory, exist_ok=True)
+        temporary_path = os.path.join(self._directory, f'.{key}.{uuid.uuid4().hex}.tmp.npy')
+        try:
+            yield temporary_path
+            os.replace(temporary_path, self.get_table_path(key))
+        finally:
+            if os.path.isfile(temporary_path):
+                os.remove(temporary_path)
+
+
+def _hash_file(file_path: FilePath, block_size: int = 2 ** 20) -> str:
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+_default_table_cache: Optional[TableCache] = None
+
+
+def get_default_table_cache() -> TableCache:
+    """
+    table cache under data/table_cache, used when a checkpoint is given without a cache.
+    """
+    global _default_table_cache
+    if _default_table_cache is None:
+        _default_table_cache = TableCache.from_parts()
+    return _default_table_cache
@@ -0,0 +1,52 @@
+import itertools
+from enum import IntEnum
+
+import numpy as np
+from jax import numpy as jnp
+
+import hj_reachability
+from refineNCBF.utils.types import VectorBatch, ArrayNd
+
+
+class TableLookupModes(IntEnum):
+    NEAREST = 0
+    MULTILINEAR = 1
+
+
+def lookup_table(
+        table: ArrayNd,
+        grid: hj_reachability.Grid,
+        states: VectorBatch,
+        mode: TableLookupModes = TableLookupModes.NEAREST,
+) -> ArrayNd:
+    """
+    values of table (shaped (*grid.shape, *value_shape)) at a batch of states (shaped (..., grid.ndim)), as an array
+    shaped (..., *value_shape). nearest takes the closest cell, multilinear blends the 2^ndim surrounding cells.
+    periodic dimensions of grid wrap around, the others are clamped to the grid. pure jax with static shapes, so it can
+    be jitted and vmapped, and gathers from a flattened table with precomputed strides.
+    """
+    shape = np.array(grid.shape)
+    strides = np.cumprod((1, *grid.shape[:0:-1]))[::-1]
+    is_periodic = np.array(grid._is_periodic_dim)
+    flat_table = jnp.reshape(table, (-1, *table.shape[grid.ndim:]))
+
+    position = (states - jnp.asarray(grid.domain.lo)) / jnp.array(grid.spacings)
+
+    def gather(index):
+        index = jnp.where(is_periodic, index % shape, jnp.clip(index, 0, shape - 1))
+        return flat_table[jnp.sum(index * strides, axis=-1)]
+
+    if mode == TableLookupModes.NEAREST:
+        return gather(jnp.round(position).astype(jnp.int32))
+
+    # non periodic positions are clamped first, so states off the grid take the values at its edge
+    position = jnp.where(is_periodic, position, jnp.clip(position, 0, shape - 1))
+    index_lo = jnp.floor(position).astype(jnp.int32)
+    weight_hi = position - index_lo
+    values = 0
+    for corner in itertools.product((0, 1), repeat=grid.ndim):
+        corner = np.array(corner)
+        weight = jnp.prod(jnp.where(corner == 1, weight_hi, 1 - weight_hi), axis=-1)
+        corner_values = gather(index_lo + corner)
+        values = values + weight.reshape(weight.shape + (1,) * (corner_values.ndim - weight.ndim)) * corner_values
+    return values
@@ -1,14 +1,17 @@
-from typing import Callable, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Sequence, Tuple
 
 import attr
 import numpy as np
 import torch
 from jax import numpy as jnp
-from tqdm import tqdm
 
 import hj_reachability
 from neural_barrier_kinematic_model.standardizer import Standardizer
-from refineNCBF.utils.files import construct_refine_ncbf_path, generate_unique_filename
+from refineNCBF.utils.files import construct_refine_ncbf_path, generate_unique_filename, FilePathRelative, FilePath
+from refineNCBF.utils.sets import flag_index_boxes
+from refineNCBF.utils.table_cache import TableCache, get_default_table_cache
+from refineNCBF.utils.table_lookup import TableLookupModes, lookup_table
 from refineNCBF.utils.types import VectorBatch, ScalarBatch, ArrayNd, MaskNd, Vector
 
 
@@ -23,7 +26,15 @@ def tabularize_dnn(
         dnn: Callable[[VectorBatch], ScalarBatch],
         grid: hj_reachability.Grid,
         standardizer: Optional[Standardizer] = None,
+        checkpoint_paths: Optional[Sequence[FilePath]] = None,
+        table_cache: Optional[TableCache] = None,
 ) -> ArrayNd:
+    """
+    dnn evaluated on every state of grid. with checkpoint_paths (the files dnn was loaded from), the table goes
+    through table_cache (the default cache when None), see tabularize_dnn_cached.
+    """
+    if checkpoint_paths is not None:
+        return jnp.array(tabularize_dnn_cached(dnn, grid, checkpoint_paths, standardizer, table_cache))
     flat_states = np.array(grid.states.reshape((-1, grid.states.shape[-1])))
     if standardizer is not None:
         flat_states = standardizer.standardize(flat_states)
@@ -35,13 +46,116 @@ def tabularize_dnn(
     return output
 
 
+def tabularize_dnn_streaming(
+        dnn: Callable[[VectorBatch], ScalarBatch],
+        grid: hj_reachability.Grid,
+        standardizer: Optional[Standardizer] = None,
+        chunk_size: int = 2 ** 16,
+        max_workers: Optional[int] = None,
+        output_path: Optional[FilePathRelative] = None,
+) -> np.ndarray:
+    """
+    tabularize_dnn without materializing every state at once: walks the grid in chunks of chunk_size states (built
+    from the coordinate vectors), standardizes each chunk and runs dnn on it under torch.no_grad, writing into a
+    preallocated table. with output_path, the table is a memory-mapped .npy file there, so it never has to fit in
+    memory. with max_workers, chunks are evaluated on that many threads (torch releases the gil during inference).
+    """
+    cell_count = int(np.prod(grid.shape))
+    coordinate_vectors = [np.asarray(coordinate_vector) for coordinate_vector in grid.coordinate_vectors]
+
+    def evaluate(start: int) -> Tuple[int, np.ndarray]:
+        indices = np.unravel_index(np.arange(start, min(start + chunk_size, cell_count)), grid.shape)
+        states = np.stack(
+            [coordinate_vector[index] for coordinate_vector, index in zip(coordinate_vectors, indices)], axis=-1
+        )
+        if standardizer is not None:
+            states = standardizer.standardize(states)
+        with torch.no_grad():
+            dnn_output = dnn(torch.FloatTensor(states))
+        if isinstance(dnn_output, torch.Tensor):
+            dnn_output = dnn_output.numpy()
+        return start, np.asarray(dnn_output).reshape((len(states), -1))
+
+    # the first chunk fixes the output width and dtype of the table
+    _, first_output = evaluate(0)
+    table_shape = (cell_count, first_output.shape[-1])
+    if output_path is None:
+        table = np.empty(table_shape, dtype=first_output.dtype)
+    else:
+        table = np.lib.format.open_memmap(
+            construct_refine_ncbf_path(output_path), mode='w+', dtype=first_output.dtype, shape=table_shape
+        )
+    table[:len(first_output)] = first_output
+
+    starts = range(chunk_size, cell_count, chunk_size)
+    if max_workers is None or max_workers <= 1:
+        for start, chunk_output in map(evaluate, starts):
+            table[start:start + len(chunk_output)] = chunk_output
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for start, chunk_output in executor.map(evaluate, starts):
+                table[start:start + len(chunk_output)] = chunk_output
+
+    if isinstance(table, np.memmap):
+        table.flush()
+    return table.reshape((*grid.shape, table_shape[-1])).squeeze()
+
+
+def tabularize_dnn_cached(
+        dnn: Callable[[VectorBatch], ScalarBatch],
+        grid: hj_reachability.Grid,
+        checkpoint_paths: Sequence[FilePath],
+        standardizer: Optional[Standardizer] = None,
+        table_cache: Optional[TableCache] = None,
+        chunk_size: int = 2 ** 16,
+        max_workers: Optional[int] = None,
+) -> np.ndarray:
+    """
+    tabularize_dnn_streaming through a TableCache, keyed on the contents of checkpoint_paths (the files dnn was loaded
+    from), the standardizer and the grid. a hit is memory-mapped from disk without running dnn; a miss is streamed
+    straight into the cache file. the table is returned memory-mapped and read-only.
+    """
+    return tabularize_dnn_checkpoints_cached(
+        lambda: dnn, grid, checkpoint_paths, standardizer, table_cache, chunk_size, max_workers
+    )
+
+
+def tabularize_dnn_checkpoints_cached(
+        load_dnn: Callable[[], Callable[[VectorBatch], ScalarBatch]],
+        grid: hj_reachability.Grid,
+        checkpoint_paths: Sequence[FilePath],
+        standardizer: Optional[Standardizer] = None,
+        table_cache: Optional[TableCache] = None,
+        chunk_size: int = 2 ** 16,
+        max_workers: Optional[int] = None,
+) -> np.ndarray:
+    """
+    tabularize_dnn_cached for a dnn that is not loaded yet: load_dnn loads it from checkpoint_paths, and is only
+    called on a miss, so a hit never deserializes the checkpoints.
+    """
+    table_cache = get_default_table_cache() if table_cache is None else table_cache
+    key = table_cache.make_key(grid, checkpoint_paths, standardizer)
+    table = table_cache.load(key)
+    if table is None:
+        with table_cache.writing(key) as temporary_path:
+            tabularize_dnn_streaming(
+                load_dnn(), grid, standardizer, chunk_size, max_workers, output_path=temporary_path
+            )
+        table = table_cache.load(key)
+    return table.reshape((*grid.shape, table.shape[-1])).squeeze()
+
+
 def flag_states_on_grid(
         cell_centerpoints: VectorBatch,
         cell_halfwidths: Tuple[float, ...],
         grid: hj_reachability.Grid,
-        verbose: bool = False,
-        save_array: bool = False
+        save_array: bool = False,
+        chunk_size: Optional[int] = None,
 ) -> MaskNd:
+    """
+    flags the grid cells overlapped by any of the boxes of cell_halfwidths around cell_centerpoints. all boxes are
+    rasterized at once (see flag_index_boxes); with chunk_size, chunk_size boxes at a time.
+    """
     dims = grid.states.shape[-1]
 
     cell_lower_bounds = cell_centerpoints - cell_halfwidths
@@ -56,12 +170,12 @@ def flag_states_on_grid(
     upper_index = np.minimum(cell_upper_bounds_in_grid_frame // np.array(grid.spacings).reshape((1, dims)),
                              np.array(grid.states.shape[0:-1]).reshape((1, dims)) - 1)
 
-    overlap_indices = np.stack([lower_index, upper_index], axis=-1).astype(int)
-
-    bool_grid = np.zeros_like(grid.states[..., 0], dtype=bool)
-    for overlap_index in tqdm(overlap_indices, disable=not verbose, desc='flagging states on grid'):
-        index_slice = tuple([np.s_[overlap_index[dim][0]:overlap_index[dim][1] + 1] for dim in range(dims)])
-        bool_grid[index_slice] = True
+    bool_grid = flag_index_boxes(
+        lower_index.astype(int),
+        upper_index.astype(int),
+        grid.shape,
+        chunk_size=chunk_size
+    )
 
     if save_array:
         np.save(construct_refine_ncbf_path(
@@ -72,15 +186,51 @@ def flag_states_on_grid(
 
 @attr.s(auto_attribs=True)
 class TabularizedDnn(Callable):
+    """
+    a network tabularized on a grid, looked up with lookup_table. called with a single state it returns the values as
+    a column, with a batch of states (shaped (..., grid.ndim)) it returns them shaped (..., *value_shape).
+    """
     _table: ArrayNd
     _grid: hj_reachability.Grid
+    _mode: TableLookupModes = TableLookupModes.NEAREST
+
+    def __attrs_post_init__(self):
+        # moved to the device once, rather than on every lookup
+        self._table = jnp.asarray(self._table)
+
+    @classmethod
+    def from_dnn_and_grid(
+            cls,
+            dnn: Callable,
+            grid: hj_reachability.Grid,
+            checkpoint_paths: Optional[Sequence[FilePath]] = None,
+            table_cache: Optional[TableCache] = None,
+            mode: TableLookupModes = TableLookupModes.NEAREST,
+    ) -> 'TabularizedDnn':
+        table = tabularize_dnn(dnn, grid, checkpoint_paths=checkpoint_paths, table_cache=table_cache)
+        return cls(table, grid, mode)
 
     @classmethod
-    def from_dnn_and_grid(cls, dnn: Callable, grid: hj_reachability.Grid) -> 'TabularizedDnn':
-        table = tabularize_dnn(dnn, grid)
-        return cls(table, grid)
+    def from_checkpoints(
+            cls,
+            load_dnn: Callable[[], Callable],
+            grid: hj_reachability.Grid,
+            checkpoint_paths: Sequence[FilePath],
+            table_cache: Optional[TableCache] = None,
+            mode: TableLookupModes = TableLookupModes.NEAREST,
+    ) -> 'TabularizedDnn':
+        """
+        from_dnn_and_grid for a network loaded by load_dnn from checkpoint_paths, which only runs when the table is not
+        cached yet.
+        """
+        table = tabularize_dnn_checkpoints_cached(load_dnn, grid, checkpoint_paths, table_cache=table_cache)
+        return cls(jnp.array(table), grid, mode)
+
+    def with_mode(self, mode: TableLookupModes) -> 'TabularizedDnn':
+        return attr.evolve(self, mode=mode)
 
     def __call__(self, state: Vector) -> Vector:
-        index = self._grid.nearest_index(state)
-        controls = self._table[index].reshape((self._table.shape[-1], 1))
-        return controls
+        values = lookup_table(self._table, self._grid, state, self._mode)
+        if jnp.ndim(state) == 1:
+            return values.reshape((-1, 1))
+        return values
@@ -37,7 +37,7 @@ class ArraySlice1D:
         return len(self.slice_index)
 
     def get_sliced_array(self, array: ArrayNd) -> ArrayNd:
-        return np.array(array)[self.slice_index]
+        return np.asarray(array)[self.slice_index]
 
 
 @attr.dataclass
@@ -79,7 +79,7 @@ class ArraySlice2D:
         return len(self.slice_index)
 
     def get_sliced_array(self, array: ArrayNd) -> ArrayNd:
-        return self._protect_2d_if_same_dimensions(np.array(array)[self.slice_index])
+        return self._protect_2d_if_same_dimensions(np.asarray(array)[self.slice_index])
 
     def _protect_2d_if_same_dimensions(self, values: ArrayNd) -> ArrayNd:
         if self.free_dim_1.dim == self.free_dim_2.dim:
@@ -5,6 +5,7 @@ from jax import numpy as jnp
 import hj_reachability
 from refineNCBF.dynamic_systems.quadcopter import quadcopter_vertical_jax_hj
 from refineNCBF.local_hjr_solver.solve import LocalHjrSolver
+from refineNCBF.utils.compilation import enable_compilation_cache
 from refineNCBF.utils.files import generate_unique_filename
 from refineNCBF.utils.sets import compute_signed_distance, get_mask_boundary_on_both_sides_by_signed_distance
 
@@ -54,4 +55,5 @@ def result_qv_march(save_result: bool = False):
 
 
 if __name__ == '__main__':
+    enable_compilation_cache()
     result_qv_march(save_result=True)
@@ -0,0 +1,72 @@
+import warnings
+
+from jax import numpy as jnp
+
+import hj_reachability
+from refineNCBF.dynamic_systems.active_cruise_control import ActiveCruiseControlJAX, \
+    simplified_active_cruise_control_params
+from refineNCBF.hj_reachability_interface.hj_dynamics import HJControlAffineDynamics, ActorModes
+from refineNCBF.local_hjr_solver.solve import LocalHjrSolver
+from refineNCBF.local_hjr_solver.sweep import ParameterSweep, SweepProblem
+from refineNCBF.utils.compilation import enable_compilation_cache
+from refineNCBF.utils.sets import compute_signed_distance, get_mask_boundary_on_both_sides_by_signed_distance
+
+warnings.simplefilter(action='ignore', category=FutureWarning)
+
+
+def acc_problem(grid_shape=(3, 201, 201)) -> SweepProblem:
+    enable_compilation_cache()
+
+    dynamics = HJControlAffineDynamics.from_parts(
+        control_affine_dynamic_system=ActiveCruiseControlJAX.from_params(simplified_active_cruise_control_params),
+        control_mode=ActorModes.MAX,
+        disturbance_mode=ActorModes.MIN,
+    )
+
+    grid = hj_reachability.Grid.from_lattice_parameters_and_boundary_conditions(
+        domain=hj_reachability.sets.Box(
+            [0, -20, 20],
+            [1e3, 20, 80]
+        ),
+        shape=grid_shape
+    )
+
+    avoid_set = (
+            (grid.states[..., 2] > 60)
+            |
+            (grid.states[..., 2] < 40)
+    )
+
+    terminal_values = compute_signed_distance(~avoid_set)
+
+    return SweepProblem.from_parts(
+        dynamics=dynamics,
+        grid=grid,
+        avoid_set=avoid_set,
+        reach_set=jnp.zeros_like(avoid_set, dtype=bool),
+        terminal_values=terminal_values,
+        active_set=get_mask_boundary_on_both_sides_by_signed_distance(~avoid_set, distance=2),
+    )
+
+
+def sweep_acc_march_jax():
+    sweep = ParameterSweep.from_parts(
+        problem_factory=acc_problem,
+        solver_factory=LocalHjrSolver.as_marching_solver,
+        problem_grid={
+            'grid_shape': [(3, 101, 101), (3, 201, 201)],
+        },
+        solver_grid={
+            'solver_timestep': [-0.1, -0.05],
+            'neighbor_distance': [1, 2],
+            'boundary_distance_inner': [1, 2],
+            'boundary_distance_outer': [1, 2],
+            'max_iterations': [100],
+        },
+        results_directory='data/sweeps/sweep_acc_march_jax',
+    )
+    return sweep()
+
+
+if __name__ == '__main__':
+    sweep_acc_march_jax()
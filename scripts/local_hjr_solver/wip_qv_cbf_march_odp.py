@@ -11,7 +11,7 @@ from refineNCBF.neural_barrier_kinematic_model_interface.certification import lo
 from refineNCBF.utils.files import generate_unique_filename
 from refineNCBF.utils.sets import compute_signed_distance, get_mask_boundary_by_dilation
 from refineNCBF.utils.tables import flag_states_on_grid, tabularize_dnn
-from scripts.pre_constructed_stuff.quadcopter_cbf import load_cbf_feb24
+from scripts.pre_constructed_stuff.quadcopter_cbf import load_cbf_feb24, cbf_feb24_checkpoint_path
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
@@ -30,7 +30,9 @@ def wip_qv_cbf_global_odp(save_result: bool = False):
     )
 
     cbf, standardizer, certified_dict = load_cbf_feb24()
-    cbvf = -tabularize_dnn(dnn=cbf, grid=grid, standardizer=standardizer)
+    cbvf = -tabularize_dnn(
+        dnn=cbf, grid=grid, standardizer=standardizer, checkpoint_paths=[cbf_feb24_checkpoint_path]
+    )
 
     avoid_set = cbvf < 0
     reach_set = jnp.zeros_like(avoid_set, dtype=bool)
@@ -61,7 +63,6 @@ def wip_qv_cbf_global_odp(save_result: bool = False):
                 cell_centerpoints=load_certified_states(certified_dict, standardizer),
                 cell_halfwidths=tuple([0.02551] * grid.ndim),
                 grid=grid,
-                verbose=True,
                 save_array=False
             )
              & ~
@@ -69,7 +70,6 @@ def wip_qv_cbf_global_odp(save_result: bool = False):
                  cell_centerpoints=load_uncertified_states(certified_dict, standardizer),
                  cell_halfwidths=tuple([0.02551] * grid.ndim),
                  grid=grid,
-                 verbose=True,
                  save_array=False
              )
              )
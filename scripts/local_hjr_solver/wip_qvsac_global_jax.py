@@ -51,7 +51,6 @@ def result_qv_sac_global(save_result: bool = False):
     #             cell_centerpoints=load_certified_states(),
     #             cell_halfwidths=(0.009375, 0.009375, 0.009375, 0.009375),
     #             grid=grid,
-    #             verbose=True,
     #             save_array=False
     #         )
     #          & ~
@@ -59,7 +58,6 @@ def result_qv_sac_global(save_result: bool = False):
     #              cell_centerpoints=load_uncertified_states(),
     #              cell_halfwidths=(0.009375, 0.009375, 0.009375, 0.009375),
     #              grid=grid,
-    #              verbose=True,
     #              save_array=False
     #          )
     #          )
@@ -1,4 +1,5 @@
 import json
+import os
 
 import numpy as np
 import stable_baselines3
@@ -9,17 +10,20 @@ import hj_reachability
 from neural_barrier_kinematic_model.cbf_tanh_2_layer import CBFTanh2Layer
 from neural_barrier_kinematic_model.standardizer import Standardizer
 from refineNCBF.neural_barrier_kinematic_model_interface.stable_baselines_interface import StableBaselinesCallable
-from refineNCBF.utils.files import construct_refine_ncbf_path, FilePathRelative, construct_nbkm_path
+from refineNCBF.utils.files import construct_refine_ncbf_path, FilePathRelative, FilePathAbsolute, construct_nbkm_path
+from refineNCBF.utils.table_lookup import TableLookupModes
 from refineNCBF.utils.tables import TabularizedDnn
 from refineNCBF.utils.types import NnCertifiedDict
 
+cbf_feb24_checkpoint_path = construct_nbkm_path(
+    'neural_barrier_kinematic_model/experiments/tanh_barrier_2_layers/cbf_tanh_2_layer.pth'
+)
+
 
 def load_cbf_feb24() -> (CBFTanh2Layer, Standardizer, NnCertifiedDict):
     device = 'cpu'
     cbf = CBFTanh2Layer(4, 512)
-    cbf_ckpt = torch.load(
-        construct_nbkm_path('neural_barrier_kinematic_model/experiments/tanh_barrier_2_layers/cbf_tanh_2_layer.pth'),
-        map_location=device)
+    cbf_ckpt = torch.load(cbf_feb24_checkpoint_path, map_location=device)
     cbf.load_state_dict(cbf_ckpt['model_state_dict'])
     cbf.to(device)
 
@@ -58,9 +62,32 @@ def load_policy_sac(relative_path: FilePathRelative) -> StableBaselinesCallable:
     }
 
     return StableBaselinesCallable(
-        stable_baselines3.SAC.load(construct_refine_ncbf_path(relative_path), custom_objects=custom_objects)
+        stable_baselines3.SAC.load(get_policy_sac_checkpoint_path(relative_path), custom_objects=custom_objects)
     )
 
 
-def load_tabularized_sac(grid: hj_reachability.Grid, relative_path: FilePathRelative) -> TabularizedDnn:
-    return TabularizedDnn.from_dnn_and_grid(load_policy_sac(relative_path), grid)
+def get_policy_sac_checkpoint_path(relative_path: FilePathRelative) -> FilePathAbsolute:
+    """
+    the file SAC.load reads for relative_path, which adds the .zip extension when it is left out.
+    """
+    checkpoint_path = construct_refine_ncbf_path(relative_path)
+    if not os.path.isfile(checkpoint_path) and not checkpoint_path.endswith('.zip'):
+        checkpoint_path = f'{checkpoint_path}.zip'
+    return checkpoint_path
+
+
+def load_tabularized_sac(
+        grid: hj_reachability.Grid,
+        relative_path: FilePathRelative,
+        mode: TableLookupModes = TableLookupModes.NEAREST,
+) -> TabularizedDnn:
+    """
+    the policy tabularized on grid, cached on disk, so the policy is only loaded and run the first time a checkpoint and
+    grid are paired.
+    """
+    return TabularizedDnn.from_checkpoints(
+        lambda: load_policy_sac(relative_path),
+        grid,
+        checkpoint_paths=[get_policy_sac_checkpoint_path(relative_path)],
+        mode=mode,
+    )